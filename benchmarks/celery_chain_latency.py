@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Critical path latency of the Celery driver
+
+Runs a linear chain of trivial calls, where every call depends on the
+previous one, and prints the wall time per node. By default an in-process
+worker is started with the in-memory broker and the rpc result backend.
+
+    python benchmarks/celery_chain_latency.py --length 1000
+    python benchmarks/celery_chain_latency.py --scheduler workers
+"""
+from celery.contrib.testing.worker import start_worker
+import argparse
+import tempfile
+import time
+import xun
+
+
+@xun.function()
+def step(n):
+    return previous + 1
+    with ...:
+        previous = step(n - 1) if n > 0 else 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--length', type=int, default=1000)
+    parser.add_argument('--broker', default='memory://')
+    parser.add_argument('--backend', default='rpc://')
+    parser.add_argument(
+        '--scheduler', choices=['driver', 'workers'], default='driver'
+    )
+    args = parser.parse_args()
+
+    celery_app = xun.functions.driver.celery.celery_app
+    celery_app.conf.update(
+        broker_url=args.broker,
+        result_backend=args.backend,
+        broker_transport_options={'polling_interval': 0.001},
+    )
+
+    blueprint = step.blueprint(args.length - 1)
+    driver = xun.functions.driver.Celery(
+        broker_url=args.broker,
+        result_backend=args.backend,
+        scheduler=args.scheduler,
+    )
+
+    with start_worker(celery_app, perform_ping_check=False), \
+         tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        blueprint.run(driver=driver, store=xun.functions.store.Disk(tmp))
+        elapsed = time.perf_counter() - start
+
+    print('{} nodes in {:.3f} s, {:.3f} ms/node'.format(
+        args.length, elapsed, 1000 * elapsed / args.length
+    ))
+
+
+if __name__ == '__main__':
+    main()
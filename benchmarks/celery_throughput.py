@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Throughput of the Celery driver
+
+Runs a wide fan-out of trivial calls, all ready at the same time, and prints
+the number of calls completed per second. By default an in-process worker is
+started with the in-memory broker and the rpc result backend.
+
+    python benchmarks/celery_throughput.py --width 2000
+"""
+from celery.contrib.testing.worker import start_worker
+import argparse
+import tempfile
+import time
+import xun
+
+
+@xun.function()
+def identity(i):
+    return i
+
+
+@xun.function()
+def fan_out(width):
+    return len(values)
+    with ...:
+        values = [identity(i) for i in range(width)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--width', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--broker', default='memory://')
+    parser.add_argument('--backend', default='rpc://')
+    args = parser.parse_args()
+
+    celery_app = xun.functions.driver.celery.celery_app
+    celery_app.conf.update(
+        broker_url=args.broker,
+        result_backend=args.backend,
+        broker_transport_options={'polling_interval': 0.001},
+    )
+
+    blueprint = fan_out.blueprint(args.width)
+    driver = xun.functions.driver.Celery(
+        broker_url=args.broker,
+        result_backend=args.backend,
+    )
+
+    with start_worker(celery_app,
+                      concurrency=args.concurrency,
+                      perform_ping_check=False), \
+         tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        blueprint.run(driver=driver, store=xun.functions.store.Disk(tmp))
+        elapsed = time.perf_counter() - start
+
+    print('{} calls in {:.3f} s, {:.0f} calls/s'.format(
+        args.width + 1, elapsed, (args.width + 1) / elapsed
+    ))
+
+
+if __name__ == '__main__':
+    main()
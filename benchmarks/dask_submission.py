@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Submission time of the Dask driver
+
+Builds a call graph of a wide fan-out, and times how long it takes to hand
+it over to the scheduler. The task graph emitted by the driver is compared to
+building one dask.delayed object per call, as the driver used to. Nothing is
+computed, the cluster has no workers.
+
+    python benchmarks/dask_submission.py --nodes 100000
+"""
+from dask.distributed import Client
+from xun.functions import CallNode
+from xun.functions.driver.dask import compute_proxy
+import argparse
+import dask
+import networkx as nx
+import tempfile
+import time
+import xun
+
+
+@xun.function()
+def identity(i):
+    return i
+
+
+@xun.function()
+def aggregate(n):
+    return sum(values)
+    with ...:
+        values = [identity(i) for i in range(n)]
+
+
+def call_graph(n):
+    entry_call = CallNode('aggregate', n)
+    graph = nx.DiGraph()
+    graph.add_node(entry_call)
+    graph.add_edges_from((CallNode('identity', i), entry_call) for i in range(n))
+    return graph, entry_call
+
+
+def submit_delayed(client, graph, entry_call, function_images, store_accessor):
+    output = {}
+    for node in nx.topological_sort(graph):
+        func = function_images[node.function_name]
+        if store_accessor.completed(node, func.hash):
+            continue
+        predecessors = [
+            pred for pred in graph.predecessors(node) if pred in output
+        ]
+        dependencies = [output[pred] for pred in predecessors]
+        output[node] = dask.delayed(compute_proxy)(
+            node, predecessors, dependencies, func, store_accessor
+        )
+    return client.compute(output[entry_call], optimize_graph=False)
+
+
+def submit_task_graph(client, graph, entry_call, function_images,
+                      store_accessor):
+    driver = xun.functions.driver.Dask(client)
+    dsk, keys = driver.dask_graph(graph, function_images, store_accessor)
+    return client.get(dsk, keys, sync=False)
+
+
+def scheduled_tasks(dask_scheduler):
+    return len(dask_scheduler.tasks)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=20000)
+    args = parser.parse_args()
+
+    graph, entry_call = call_graph(args.nodes)
+
+    for name, submit in [
+            ('dask.delayed', submit_delayed),
+            ('task graph', submit_task_graph),
+        ]:
+        with Client(n_workers=0, processes=False) as client, \
+             tempfile.TemporaryDirectory() as tmp:
+            store = xun.functions.store.Disk(tmp)
+            store_accessor = xun.functions.store.StoreAccessor(store)
+            function_images = {
+                func.name: func.callable(extra_globals={'_xun_store': store})
+                for func in [identity, aggregate]
+            }
+
+            # Submission is done once the scheduler knows every task
+            start = time.perf_counter()
+            futures = submit(
+                client, graph, entry_call, function_images, store_accessor
+            )
+            while client.run_on_scheduler(scheduled_tasks) < len(graph):
+                time.sleep(0.01)
+            elapsed = time.perf_counter() - start
+
+            client.cancel(futures)
+            print('{}: {} nodes submitted in {:.2f} s'.format(
+                name, len(graph), elapsed
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Per-task overhead of the local parallel drivers
+
+Runs a fan-out of trivial calls with the ProcessPool driver and with the Dask
+driver on a local cluster, using a disk store in a temporary directory, and
+prints the wall time per task.
+
+    python benchmarks/driver_overhead.py --tasks 1000 --workers 4
+"""
+import argparse
+import tempfile
+import time
+import xun
+
+
+@xun.function()
+def identity(i):
+    return i
+
+
+@xun.function()
+def fan_out(n):
+    return len(values)
+    with ...:
+        values = [identity(i) for i in range(n)]
+
+
+def timed_run(driver, n):
+    with tempfile.TemporaryDirectory() as tmp:
+        blueprint = fan_out.blueprint(n)
+        store = xun.functions.store.Disk(tmp)
+        start = time.perf_counter()
+        blueprint.run(driver=driver, store=store)
+        return time.perf_counter() - start
+
+
+def report(name, elapsed, n):
+    print('{:<24} {:8.3f} s {:10.3f} ms/task'.format(
+        name, elapsed, 1000 * elapsed / n
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tasks', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    with xun.functions.driver.ProcessPool(max_workers=args.workers) as pool:
+        report('ProcessPool (cold)', timed_run(pool, args.tasks), args.tasks)
+        report('ProcessPool (warm)', timed_run(pool, args.tasks), args.tasks)
+
+    from dask.distributed import Client
+    from dask.distributed import LocalCluster
+    with LocalCluster(n_workers=args.workers, threads_per_worker=1) as cluster:
+        with Client(cluster) as client:
+            driver = xun.functions.driver.Dask(client)
+            report('Dask LocalCluster', timed_run(driver, args.tasks),
+                   args.tasks)
+
+
+if __name__ == '__main__':
+    main()
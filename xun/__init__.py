@@ -15,6 +15,8 @@ from .functions import describe
 from .functions import function_ast
 from .functions import function_source
 from .functions import make_shared
+from .functions import map
+from .functions import reduce
 from .functions import ContextError
 from .functions import CopyError
 from .functions import FunctionDefNotFoundError
@@ -101,6 +101,43 @@ parser_fgraph_action.add_argument('--dot-layout', action='store_true')
 parser_fgraph_action.add_argument('--dot', action='store_true')
 
 
+#
+# Failures recorded by runs remembering failures
+#
+
+parser_failures = subparsers.add_parser('failures')
+subparsers_failures = parser_failures.add_subparsers()
+parser_failures_list = subparsers_failures.add_parser(
+    'list',
+    help='list the failures recorded in a store',
+)
+parser_failures_list.set_defaults(func=functions.cli.xun_failures_list)
+parser_failures_list.add_argument('--traceback',
+                                  help='print the traceback of each failure',
+                                  action='store_true')
+parser_failures_clear = subparsers_failures.add_parser(
+    'clear',
+    help='clear failures, so that the calls are executed again',
+)
+parser_failures_clear.set_defaults(func=functions.cli.xun_failures_clear)
+for parser_failures_action in (parser_failures_list, parser_failures_clear):
+    parser_failures_action.add_argument(
+        'call_strings',
+        help='calls to list or clear, all calls by default',
+        metavar='call_string',
+        nargs='*',
+    )
+    parser_failures_store = (
+        parser_failures_action.add_mutually_exclusive_group(required=True)
+    )
+    parser_failures_store.add_argument('--disk',
+                                       help='directory of a disk store',
+                                       metavar='DIR')
+    parser_failures_store.add_argument('--redis',
+                                       help='host of a redis store',
+                                       metavar='HOST[:PORT]')
+
+
 #
 # create new project from cookiecutter template
 #
@@ -1,18 +1,28 @@
 from .blueprint import build_call_graph
 from .blueprint import build_function_call_graph
+from .errors import CallTimeoutError
+from .errors import CallsFailedError
 from .errors import CopyError
 from .errors import ContextError
 from .errors import FunctionError
 from .errors import FunctionDefNotFoundError
+from .errors import KnownFailureError
 from .errors import NotDAGError
 from .errors import XunSyntaxError
 from .function import Function
 from .function import function
+from .function import map
+from .function import reduce
 from .function_description import FunctionDescription
 from .function_description import describe
 from .function_image import FunctionImage
 from .function_image import make_shared
 from .graph import CallNode
+from .graph import InternedArgument
+from .graph import LazyResults
+from .graph import MapNode
+from .graph import MapResults
+from .graph import ReduceNode
 from .transformations import FunctionDecomposition
 from .transformations import build_xun_graph
 from .transformations import copy_only_constants
@@ -29,6 +39,8 @@ from .util import strip_decorators
 from . import cli
 from . import compatibility
 from . import driver
+from . import fusion
 from . import graph
+from . import limits
 from . import store
 from . import util
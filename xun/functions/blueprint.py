@@ -1,6 +1,12 @@
+from .compatibility import ast
 from .errors import NotDAGError
+from .errors import XunSyntaxError
 from .graph import CallNode
+from .graph import MapNode
+from .graph import ReduceNode
 from .graph import sink_nodes
+from .graph import unintern
+from .transformations import is_xun_primitive_call
 import networkx as nx
 import queue
 
@@ -15,7 +21,7 @@ class Blueprint:
 
     Methods
     -------
-    run(driver, store)
+    run(driver, store, fuse=False)
         Executes the blueprint with the given driver and store
 
     See Also
@@ -28,7 +34,15 @@ class Blueprint:
         self.functions = discover_functions(func)
         self.graph = build_call_graph(self.functions, self.call)
 
-    def run(self, driver=None, store=None):
+    def run(self,
+            driver=None,
+            store=None,
+            fuse=False,
+            keep_going=False,
+            single_flight=False,
+            remember_failures=False,
+            early_cutoff=False,
+            store_elements=False):
         """run
 
         Executes this blueprint given a driver and store
@@ -37,11 +51,50 @@ class Blueprint:
         ----------
         driver : Driver
         store : Store
+        fuse : bool
+            If true, linear chains of calls are fused and executed as single
+            tasks, saving the per task overhead of the driver. The result of
+            every call is still stored
+        keep_going : bool
+            If true, a failed call does not stop the run. Every call that does
+            not depend on a failed call is executed, and the results are
+            stored
+        single_flight : bool or float
+            If true, runs sharing the store execute each call only once at a
+            time. A run waits for calls that another run is executing, and
+            uses their results. Runs hold leases on the calls they execute,
+            which expire if a run dies, after 30 seconds or the given number
+            of seconds
+        remember_failures : bool or tuple of exception types
+            If true, the exception, traceback and runtime of failed calls are
+            recorded in the store. Calls with a recorded failure fail with a
+            `KnownFailureError` without being executed, until the failure is
+            cleared or the function changes. In keep going mode, the calls
+            depending on them are skipped. Transient failures, such as
+            timeouts and lost connections, are not remembered. Given a tuple
+            of exception types, only failures with these are remembered
+        early_cutoff : bool
+            If true, results are stored with a digest of their content, and
+            calls record the digests of the results they load. A call whose
+            function changed only because a function it depends on changed
+            is not executed again if the results it loads are unchanged, its
+            earlier result is reused
+        store_elements : bool
+            If true, the elements of results that are unpacked or subscripted
+            in the call graph are stored separately, along with the results.
+            Calls depending on an element load only the element, and calls
+            are executed once, however many of their elements are used
 
         Returns
         -------
         Any
             The result of the execution
+
+        Raises
+        ------
+        CallsFailedError
+            In keep going mode, if any call failed. The error holds a
+            `FailureReport` of the failed and skipped calls
         """
         if driver is None:
             raise ValueError("driver must be specified")
@@ -70,7 +123,39 @@ class Blueprint:
             for name, func in self.functions.items()
         }
 
-        return driver.exec(self.graph, self.call, function_images, store)
+        from .fusion import batch_calls
+        from .fusion import fuse_chains
+        from .fusion import map_chunks
+        from .fusion import reduce_trees
+        from .fusion import separate_elements
+
+        graph, elements = self.graph, None
+        if store_elements:
+            graph, elements = separate_elements(graph)
+
+        graph, function_images = map_chunks(
+            graph, function_images, store, elements=elements
+        )
+        graph, function_images = reduce_trees(graph, function_images)
+        if fuse:
+            graph, function_images = fuse_chains(
+                graph, function_images, store, elements=elements
+            )
+        graph, function_images = batch_calls(
+            graph, function_images, store, elements=elements
+        )
+
+        return driver.exec(
+            graph,
+            self.call,
+            function_images,
+            store,
+            keep_going=keep_going,
+            single_flight=single_flight,
+            remember_failures=remember_failures,
+            early_cutoff=early_cutoff,
+            elements=elements,
+        )
 
 
 def discover_functions(root_function):
@@ -125,7 +210,10 @@ def build_function_call_graph(functions, call):
         the internal dependency graph and calls this call depends on
     """
     func = functions[call.function_name]
-    graph = func.graph(*call.args, **call.kwargs)
+    graph = func.graph(
+        *(unintern(arg) for arg in call.args),
+        **{key: unintern(arg) for key, arg in call.kwargs.items()},
+    )
 
     # Connect the function call graph to this call
     graph.add_node(call)
@@ -143,6 +231,100 @@ def build_function_call_graph(functions, call):
     return graph, dependencies
 
 
+def calls_xun_functions(func):
+    """Calls xun functions
+
+    Parameters
+    ----------
+    func : Function
+
+    Returns
+    -------
+    bool
+        True if the function may call xun functions in its with constants
+        statement. Calls to such functions have call graphs of their own
+    """
+    return any(
+        isinstance(node, ast.Call) and (
+            isinstance(node.func, ast.Name) and
+            node.func.id in func.dependencies or
+            is_xun_primitive_call(node, func.desc, 'map')
+        )
+        for node in ast.walk(func.desc.ast)
+    )
+
+
+def build_map_chunk_graph(functions, chunk):
+    """Build Map Chunk Graph
+
+    Build the internal dependency graph of a chunk of a map. The calls of the
+    chunk are not in the graph, the chunk depends on the dependencies of all
+    of them.
+
+    Parameters
+    ----------
+    functions : mapping of str to Function
+        The functions of the program
+    chunk : CallNode
+        The chunk of a map
+
+    Returns
+    -------
+    nx.DiGraph, tuple of CallNode
+        the internal dependency graph and calls this chunk depends on
+    """
+    function_name = MapNode.mapped_function_name(chunk)
+    graph = nx.DiGraph()
+    graph.add_node(chunk)
+
+    if not calls_xun_functions(functions[function_name]):
+        return graph, ()
+
+    for item in chunk.args[0]:
+        call = CallNode(function_name, item)
+        call_graph, _ = build_function_call_graph(functions, call)
+        call_graph = nx.relabel_nodes(call_graph, {call: chunk})
+        graph.add_nodes_from(call_graph.nodes)
+        graph.add_edges_from(call_graph.edges)
+
+    if not nx.is_directed_acyclic_graph(graph):
+        raise NotDAGError
+
+    dependencies = tuple(
+        n for n in graph.nodes if isinstance(n, CallNode) and n != chunk
+    )
+
+    return graph, dependencies
+
+
+def build_reduce_graph(functions, call):
+    """Build Reduce Graph
+
+    The calls of a reduction tree, and their dependencies, are added to the
+    call graph of the function using `xun.reduce`. A call of the tree has no
+    internal dependency graph of its own.
+
+    Parameters
+    ----------
+    functions : mapping of str to Function
+        The functions of the program
+    call : CallNode
+        The call of a reduction tree
+
+    Returns
+    -------
+    nx.DiGraph, tuple of CallNode
+        the graph holding only the call, and no dependencies
+    """
+    function_name = ReduceNode.reduced_function_name(call)
+    if calls_xun_functions(functions[function_name]):
+        msg = 'Functions used by xun.reduce cannot call xun functions'
+        raise XunSyntaxError(msg)
+    graph = nx.DiGraph()
+    graph.add_node(call)
+    return graph, ()
+
+
 def build_call_graph(functions, call):
     """Build Call Graph
 
@@ -176,14 +358,23 @@ def build_call_graph(functions, call):
 
         visited.add(call)
 
-        func_graph, dependencies = build_function_call_graph(functions, call)
+        if MapNode.mapped_function_name(call) is not None:
+            func_graph, dependencies = build_map_chunk_graph(functions, call)
+        elif ReduceNode.reduced_function_name(call) is not None:
+            func_graph, dependencies = build_reduce_graph(functions, call)
+        else:
+            func_graph, dependencies = build_function_call_graph(
+                functions, call
+            )
 
         for dependency in dependencies:
             q.put(dependency)
 
-        graph = nx.compose(graph, func_graph)
+        # Merge in place, composing copies the graph for every call
+        graph.add_nodes_from(func_graph.nodes)
+        graph.add_edges_from(func_graph.edges)
 
-        if not nx.is_directed_acyclic_graph(graph):
-            raise NotDAGError
+    if not nx.is_directed_acyclic_graph(graph):
+        raise NotDAGError
 
     return graph
@@ -6,6 +6,7 @@ import inspect
 import networkx as nx
 import numpy as np
 import sys
+import time
 import xun
 
 
@@ -33,6 +34,61 @@ def xun_graph(args):
         draw_list(plt, G, call)
 
 
+def xun_failures_list(args):
+    """
+    CLI entrypoint for ``xun failures list`` command
+    """
+    store_accessor = xun.functions.store.StoreAccessor(store_from_args(args))
+    failures = select_failures(store_accessor, args.call_strings)
+    for failure in sorted(failures, key=lambda f: f.failed_at):
+        print('{}  {}  {}  {:.1f} s  {}'.format(
+            failure.call,
+            failure.hash.hex()[:12],
+            time.strftime(
+                '%Y-%m-%d %H:%M:%S', time.localtime(failure.failed_at)
+            ),
+            failure.runtime,
+            failure.description,
+        ))
+        if args.traceback:
+            print(failure.traceback)
+
+
+def xun_failures_clear(args):
+    """
+    CLI entrypoint for ``xun failures clear`` command
+    """
+    store_accessor = xun.functions.store.StoreAccessor(store_from_args(args))
+    failures = select_failures(store_accessor, args.call_strings)
+    for failure in failures:
+        store_accessor.forget_failure(failure.call)
+    print('Cleared {} failures'.format(len(failures)))
+
+
+def select_failures(store_accessor, call_strings):
+    """Select failures
+
+    The failures recorded in a store, of the given calls if any
+    """
+    failures = store_accessor.known_failures()
+    if len(call_strings) == 0:
+        return failures
+    calls = {interpret_call(call_string) for call_string in call_strings}
+    return [failure for failure in failures if failure.call in calls]
+
+
+def store_from_args(args):
+    """Store from args
+
+    The store given on the command line, as ``--disk DIR`` or
+    ``--redis HOST[:PORT]``
+    """
+    if args.disk is not None:
+        return xun.functions.store.Disk(args.disk)
+    host, _, port = args.redis.partition(':')
+    return xun.functions.store.Redis(host, port=int(port or 6379))
+
+
 def draw_list(plt, G, root):
     cmap = plt.get_cmap('viridis')
     colors = cmap(np.linspace(0, 1, len(G.nodes())))
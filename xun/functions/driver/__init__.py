@@ -1,4 +1,6 @@
+from .asyncio import Asyncio
 from .celery import Celery
 from .dask import Dask
 from .driver import Driver
+from .process_pool import ProcessPool
 from .sequential import Sequential
@@ -0,0 +1,292 @@
+from ..errors import CallTimeoutError
+from ..errors import KnownFailureError
+from ..limits import Resources
+from ..limits import TokenBucket
+from ..limits import parse_memory
+from ..store import consumed_results
+from .driver import Driver
+import asyncio
+import contextlib
+import contextvars
+import functools
+import logging
+import networkx as nx
+import time
+import traceback
+
+
+logger = logging.getLogger(__name__)
+
+
+class Asyncio(Driver):
+    """Asyncio
+
+    Runs the call graph in a single asyncio event loop, suitable for local I/O
+    bound work. Calls to async xun functions are awaited in the loop, so
+    thousands of calls can be in flight at once. Calls to regular xun
+    functions, and store accesses, are run in the loop's default executor so
+    that they do not block the loop.
+
+    Parameters
+    ----------
+    concurrency_limit : int, optional
+        The maximum number of calls executing at the same time. Unlimited by
+        default. The `max_parallel` and `rate_limit` of functions apply in
+        addition, a call waiting for the limits of its function does not take
+        up concurrency
+    memory : int or str, optional
+        Memory budget for calls, in bytes or as a string such as `'16G'`.
+        Calls run together only as long as the `memory` hints of their
+        functions fit in the budget
+    cpus : int or float, optional
+        Processor budget for calls, packed against the `cpus` hints of
+        functions, one processor per call by default
+
+    Examples
+    --------
+
+    >>> @xun.function()
+    ... async def download_text(topic):
+    ...     async with session.get(url, params={'page': topic}) as response:
+    ...         return await response.text()
+    ...
+    >>> blueprint.run(
+    ...     driver=xun.functions.driver.Asyncio(concurrency_limit=100),
+    ...     store=xun.functions.store.Memory(),
+    ... )
+    """
+
+    def __init__(self, concurrency_limit=None, memory=None, cpus=None):
+        self.concurrency_limit = concurrency_limit
+        self.memory = parse_memory(memory) if memory is not None else None
+        if cpus is not None and cpus <= 0:
+            raise ValueError('cpus must be positive')
+        self.cpus = cpus
+
+    def _exec(self,
+              graph,
+              entry_call,
+              function_images,
+              store_accessor,
+              failures=None):
+        assert nx.is_directed_acyclic_graph(graph)
+        asyncio.run(self.run(graph, function_images, store_accessor, failures))
+
+    async def run(self, graph, function_images, store_accessor, failures=None):
+        self.failures = failures
+
+        # Semaphores must be created inside the event loop
+        self.semaphore = (
+            asyncio.Semaphore(self.concurrency_limit)
+            if self.concurrency_limit is not None else None
+        )
+        self.function_semaphores = {
+            name: asyncio.Semaphore(func.options['max_parallel'])
+            for name, func in function_images.items()
+            if func.options.get('max_parallel') is not None
+        }
+        self.buckets = {
+            name: TokenBucket(func.options['rate_limit'])
+            for name, func in function_images.items()
+            if func.options.get('rate_limit') is not None
+        }
+        self.resources = (
+            Resources(function_images, memory=self.memory, cpus=self.cpus)
+            if self.memory is not None or self.cpus is not None else None
+        )
+        self.resources_freed = asyncio.Condition()
+
+        remaining = {node: graph.in_degree(node) for node in graph.nodes}
+        pending = {
+            asyncio.ensure_future(self.execute(
+                node, function_images, store_accessor
+            ))
+            for node, count in remaining.items() if count == 0
+        }
+
+        try:
+            while len(pending) > 0:
+                done, pending = await asyncio.wait(
+                    pending,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    node = task.result()
+                    if node is None:
+                        # Failed in keep going mode, its successors are never
+                        # executed
+                        continue
+                    for successor in graph.successors(node):
+                        remaining[successor] -= 1
+                        if remaining[successor] == 0:
+                            pending.add(asyncio.ensure_future(self.execute(
+                                successor,
+                                function_images,
+                                store_accessor,
+                            )))
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def execute(self, node, function_images, store_accessor):
+        func = function_images[node.function_name]
+
+        # Do not rerun finished jobs. For example if a workflow has been
+        # stopped and resumed.
+        completed = await run_in_executor(
+            store_accessor.completed, node, func.hash
+        )
+        if completed:
+            logger.info('{} already completed'.format(node))
+            return node
+
+        try:
+            async with self.claim(node, func.hash, store_accessor) as claimed:
+                if not claimed:
+                    logger.info('{} already completed'.format(node))
+                    return node
+                async with self.slot(node.function_name):
+                    await self.run_and_store(node, func, store_accessor)
+        except Exception as e:
+            if self.failures is None:
+                raise
+            self.failures.fail(node, e)
+            return None
+        return node
+
+    @contextlib.asynccontextmanager
+    async def claim(self, call, hash, store_accessor):
+        """Claim
+
+        Like `StoreAccessor.claim`, but waits for the lease without blocking
+        the loop
+        """
+        async with self.hold_lease(call, hash, store_accessor) as claimed:
+            if claimed and store_accessor.early_cutoff is not None:
+                claimed = not await run_in_executor(
+                    store_accessor.cut_off, call, hash
+                )
+            if not claimed:
+                yield False
+                return
+            if store_accessor.remember_failures:
+                known = await run_in_executor(
+                    store_accessor.known_failure, call, hash
+                )
+                if known is not None:
+                    raise KnownFailureError(known)
+            start = time.time()
+            try:
+                with consumed_results() as consumed:
+                    yield True
+            except Exception as e:
+                if store_accessor.remembers(e):
+                    await run_in_executor(
+                        store_accessor.record_failure,
+                        call,
+                        hash,
+                        e,
+                        traceback.format_exc(),
+                        time.time() - start,
+                    )
+                raise
+            if store_accessor.remember_failures:
+                await run_in_executor(store_accessor.forget_failure, call)
+            if store_accessor.early_cutoff is not None:
+                await run_in_executor(
+                    store_accessor.record_inputs, call, hash, consumed
+                )
+
+    @contextlib.asynccontextmanager
+    async def hold_lease(self, call, hash, store_accessor):
+        lease = store_accessor.lease(call, hash)
+        if lease is None:
+            yield True
+            return
+
+        while not await run_in_executor(lease.acquire):
+            completed = await run_in_executor(
+                store_accessor.completed, call, hash
+            )
+            if completed:
+                yield False
+                return
+            await asyncio.sleep(lease.poll_interval)
+        try:
+            completed = await run_in_executor(
+                store_accessor.completed, call, hash
+            )
+            yield not completed
+        finally:
+            await run_in_executor(lease.release)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, function_name):
+        """Slot
+
+        Wait until the limits of the function, the resource budget, and then
+        the concurrency limit, allow another call, and hold a slot while the
+        call runs
+        """
+        async with contextlib.AsyncExitStack() as stack:
+            function_semaphore = self.function_semaphores.get(function_name)
+            if function_semaphore is not None:
+                await stack.enter_async_context(function_semaphore)
+            bucket = self.buckets.get(function_name)
+            if bucket is not None:
+                await asyncio.sleep(bucket.reserve())
+            if self.resources is not None:
+                async with self.resources_freed:
+                    await self.resources_freed.wait_for(
+                        lambda: self.resources.fits(function_name)
+                    )
+                    taken = self.resources.take(function_name)
+                stack.push_async_callback(self.free, taken)
+            if self.semaphore is not None:
+                await stack.enter_async_context(self.semaphore)
+            yield
+
+    async def free(self, taken):
+        async with self.resources_freed:
+            self.resources.free(taken)
+            self.resources_freed.notify_all()
+
+    async def run_and_store(self, call, func, store_accessor):
+        logger.info('Running {}'.format(call))
+        try:
+            args, kwargs = await run_in_executor(
+                store_accessor.resolve_call_args, call
+            )
+            if func.is_coroutine_function:
+                result = func(*args, **kwargs)
+            else:
+                result = run_in_executor(func, *args, **kwargs)
+            timeout = func.options.get('timeout')
+            try:
+                result = await asyncio.wait_for(result, timeout)
+            except asyncio.TimeoutError:
+                if timeout is None:
+                    raise
+                raise CallTimeoutError('{} timed out after {} seconds'.format(
+                    call, timeout
+                ))
+            await run_in_executor(
+                store_accessor.store_result, call, func.hash, result
+            )
+        except Exception as e:
+            logger.error('{} failed with {}'.format(call, str(e)))
+            raise
+        logger.info('{} succeeded'.format(call))
+
+
+async def run_in_executor(func, *args, **kwargs):
+    """Run in executor
+
+    Run a function in the default executor of the loop, in a copy of the
+    context of the caller, so that the results a call loads are collected
+    """
+    loop = asyncio.get_event_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        None, functools.partial(context.run, func, *args, **kwargs)
+    )
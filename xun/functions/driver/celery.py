@@ -1,11 +1,26 @@
-from .. import graph as graph_helpers
+from ..limits import Stragglers
+from ..limits import TokenBucket
+from ..limits import time_limit
+from ..store import enable_result_cache
 from .driver import Driver
+from .driver import run_to_completion
+from .driver import task_image
+from celery import signals
+from celery.utils.nodenames import worker_direct
+from collections import Counter
 import asyncio
 import celery
 import contextlib
+import copy
 import kombu
 import logging
 import networkx as nx
+import queue
+import socket
+import threading
+import time
+import traceback
+import uuid
 
 
 logger = logging.getLogger(__name__)
@@ -19,11 +34,163 @@ celery_app.conf.timezone = 'Europe/Oslo'
 celery_app.conf.enable_utc = True
 celery_app.conf.task_acks_late = True # Since we run on volatile infrastructure
 
+def locality_option():
+    """
+    Command line option of workers consuming their direct queue, so that
+    drivers with a result cache can route calls to the worker holding their
+    inputs
+    """
+    help = (
+        'Consume the direct queue of the worker, to receive calls whose '
+        'inputs it holds in its result cache'
+    )
+    try:
+        from celery.bin.base import Option
+    except ImportError:
+        # Celery 5 defines command line options with click
+        import click
+        return click.Option(
+            ['--xun-locality'], is_flag=True, default=False, help=help
+        )
+    return Option(
+        '--xun-locality', action='store_true', default=False, help=help
+    )
+
+
+celery_app.user_options['worker'].add(locality_option())
+
+
+@signals.celeryd_init.connect
+def enable_locality(sender=None, conf=None, options=None, **kwargs):
+    if options is not None and options.get('xun_locality'):
+        conf.worker_direct = True
+
 
 class Celery(Driver):
-    def __init__(self, broker_url=None, result_backend=None):
+    """Celery
+
+    Executes calls as Celery tasks. By default the call graph is scheduled
+    from an event loop in the driver process, which publishes calls as they
+    become ready.
+
+    Alternatively, scheduling can be left to the workers. The driver then
+    shares the part of the call graph left to execute with the workers
+    through the store, and publishes only the calls that are ready. Workers
+    publish the successors of every call they finish once all their
+    dependencies are stored. Dependent calls are launched without a round
+    trip through the driver, and the run proceeds even if the driver
+    disconnects.
+
+    Parameters
+    ----------
+    broker_url : str
+        The Celery broker
+    result_backend : str
+        The Celery result backend
+    max_in_flight : int, optional
+        Maximum number of tasks published and not yet finished. Unlimited by
+        default
+    max_in_flight_per_function : mapping of str to int, optional
+        Maximum number of tasks in flight for the named functions. Calls to
+        other functions keep flowing while a function is at its limit. Limits
+        given here take precedence over the `max_parallel` given to
+        `xun.function`
+    scheduler : {'driver', 'workers'}
+        Where calls are scheduled, defaults to 'driver'. In flight limits, and
+        the `max_parallel` and `rate_limit` of functions, only apply when the
+        driver schedules calls
+    routes : mapping of str to str, optional
+        Queue by function name. Calls are published to the queue of their
+        function, so that dedicated pools of workers can serve them. Routes
+        given here take precedence over the queue given to `xun.function`.
+        Calls to other functions go to the default queue
+    result_cache_bytes : int, optional
+        If given, every worker process keeps the results it recently produced
+        or loaded, up to this many bytes, in a least recently used cache. When
+        the driver schedules calls, it routes them to the worker holding most
+        of their input bytes, unless their function is routed to a queue.
+        Only workers started with `--xun-locality`, consuming their direct
+        queue, are routed to. Note that workers with a process pool have one
+        cache per pool process
+    speculate : float, optional
+        When the driver schedules calls, a call that has run this many times
+        longer than the median runtime of its function is backed up by
+        publishing a copy, and the first copy to finish completes the call.
+        Both copies store the same result under the same hash. Workers mark
+        calls as they start in the store, so that calls waiting in a queue
+        are not backed up. Runtimes are recorded in the store for later runs.
+        Calls are not backed up by default
+
+    The `timeout` of functions is enforced by the workers, in the main thread
+    of the process running the task.
+
+    Methods
+    -------
+    gauges()
+        Queue depth and in flight counts of the current run
+    cache_metrics()
+        Result cache hits and bytes saved in the current run
+    """
+
+    def __init__(self,
+                 broker_url=None,
+                 result_backend=None,
+                 max_in_flight=None,
+                 max_in_flight_per_function=None,
+                 scheduler='driver',
+                 routes=None,
+                 result_cache_bytes=None,
+                 speculate=None):
+        if scheduler not in ('driver', 'workers'):
+            raise ValueError(
+                'Unknown scheduler {}, expected driver or workers'
+                .format(repr(scheduler))
+            )
         self.broker_url = broker_url
         self.result_backend = result_backend
+        self.max_in_flight = max_in_flight
+        self.max_in_flight_per_function = max_in_flight_per_function or {}
+        self.scheduler = scheduler
+        self.routes = routes or {}
+        self.result_cache_bytes = result_cache_bytes
+        if speculate is not None and speculate <= 1:
+            raise ValueError('speculate must be greater than one')
+        self.speculate = speculate
+        self.state = None
+
+    def gauges(self):
+        """Gauges
+
+        Returns
+        -------
+        dict or None
+            Queue depth and in flight counts of the current or last run, None
+            if the driver has not been run
+
+        See Also
+        --------
+        AsyncCeleryState.gauges
+        """
+        if self.state is None:
+            return None
+        return self.state.gauges()
+
+    def cache_metrics(self):
+        """Cache metrics
+
+        Returns
+        -------
+        dict or None
+            Result cache metrics of the current or last run, None if the
+            driver has not been run
+
+        See Also
+        --------
+        AsyncCeleryState.cache_metrics
+        """
+        if self.state is None:
+            return None
+        return self.state.cache_metrics()
 
     @contextlib.contextmanager
     def connection_pool(self):
@@ -53,7 +220,12 @@ class Celery(Driver):
 
         connection.release()
 
-    def _exec(self, graph, entry_call, function_images, store_accessor):
+    def _exec(self,
+              graph,
+              entry_call,
+              function_images,
+              store_accessor,
+              failures=None):
         assert nx.is_directed_acyclic_graph(graph)
         with self.connection_pool() as pool:
 
@@ -61,51 +233,267 @@ class Celery(Driver):
             # be locked to the result backend we specify here.
             celery_app.conf.result_backend = self.result_backend
 
-            state = AsyncCeleryState(
-                pool, graph, function_images, store_accessor
+            queues = {
+                name: self.routes.get(name, func.options.get('queue'))
+                for name, func in function_images.items()
+            }
+
+            if self.scheduler == 'workers':
+                return run_on_workers(
+                    pool,
+                    graph,
+                    entry_call,
+                    function_images,
+                    store_accessor,
+                    queues=queues,
+                    result_cache_bytes=self.result_cache_bytes,
+                    failures=failures,
+                )
+
+            self.state = AsyncCeleryState(
+                pool,
+                graph,
+                function_images,
+                store_accessor,
+                max_in_flight=self.max_in_flight,
+                max_in_flight_per_function=self.max_in_flight_per_function,
+                queues=queues,
+                result_cache_bytes=self.result_cache_bytes,
+                speculate=self.speculate,
+                failures=failures,
             )
-            return state(entry_call)
+            return self.state(entry_call)
 
 
 class AsyncCeleryState:
-    def __init__(self, pool, graph, function_images, store_accessor):
+    def __init__(self,
+                 pool,
+                 graph,
+                 function_images,
+                 store_accessor,
+                 max_in_flight=None,
+                 max_in_flight_per_function=None,
+                 queues=None,
+                 result_cache_bytes=None,
+                 speculate=None,
+                 speculation_interval=1.0,
+                 failures=None):
         self.connection_pool = pool
         self.graph = graph
         self.function_images = function_images
         self.store_accessor = store_accessor
-        self.succeeded = set()
+        self.max_in_flight = max_in_flight
+        self.max_in_flight_per_function = max_in_flight_per_function or {}
+        self.queues = queues or {}
+        self.result_cache_bytes = result_cache_bytes
+        self.speculate = speculate
+        self.speculation_interval = speculation_interval
+        self.stragglers = None
+        self.failures = failures
+        self.queue = None
+        self.in_flight = Counter()
+        self.waiting = 0
         self.visited = set()
+        # Number of unfinished dependencies per node. A node is enqueued
+        # exactly once, when its count reaches zero.
+        self.remaining = {
+            node: graph.in_degree(node) for node in graph.nodes
+        }
+        # Bytes of the result of a call held by each worker
+        self.holders = {}
+        self.cache_counts = Counter()
         self.error = None
+        self.publisher = None
+        self.result_listener = None
 
     def __call__(self, entry_call):
         loop = asyncio.new_event_loop()
         loop.set_exception_handler(self.exception_handler)
-        task = loop.create_task(self.run())
-        loop.run_until_complete(task)
+        self.publisher = Publisher(loop, self.connection_pool)
+        self.result_listener = ResultListener(loop)
+        self.result_listener.start()
+        try:
+            task = loop.create_task(self.run())
+            loop.run_until_complete(task)
+        finally:
+            self.result_listener.stop()
 
         if self.error is not None:
             raise self.error
 
+        if self.failures is not None and len(self.failures.failed) > 0:
+            # The entry call depends on the failed calls
+            return None
         return self.store_accessor.load_result(entry_call)
 
     def exception_handler(self, loop, context):
         if not self.error:
             self.error = context.get('exception')
 
+    def gauges(self):
+        """Gauges
+
+        Snapshot of the scheduling state, useful for tuning the in flight
+        limits.
+
+        Returns
+        -------
+        dict
+            queued: nodes ready and not yet picked up by the dispatcher
+            waiting: nodes waiting for their function limits or an in flight
+                slot
+            in_flight: tasks published and not yet finished
+            in_flight_per_function: in_flight by function name
+        """
+        return {
+            'queued': self.queue.qsize() if self.queue is not None else 0,
+            'waiting': self.waiting,
+            'in_flight': sum(self.in_flight.values()),
+            'in_flight_per_function': {
+                name: count for name, count in self.in_flight.items()
+                if count > 0
+            },
+        }
+
+    def cache_metrics(self):
+        """Cache metrics
+
+        Returns
+        -------
+        dict
+            hits: inputs found in the result cache of the executing worker
+            misses: inputs loaded from the store
+            hit_rate: hits over all inputs loaded
+            bytes_saved: size of the inputs found in the result cache
+            routed: calls routed to a worker holding their inputs
+        """
+        hits = self.cache_counts['hits']
+        misses = self.cache_counts['misses']
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses > 0 else 0.0,
+            'bytes_saved': self.cache_counts['bytes_saved'],
+            'routed': self.cache_counts['routed'],
+        }
+
+    def local_queue(self, node):
+        """Local queue
+
+        Returns
+        -------
+        kombu.Queue or None
+            The direct queue of the worker holding most of the input bytes of
+            the given call, None if no worker holds any of them
+        """
+        held = Counter()
+        for predecessor in self.graph.predecessors(node):
+            for worker, size in self.holders.get(predecessor, {}).items():
+                held[worker] += size
+        if len(held) == 0:
+            return None
+        worker, _ = held.most_common(1)[0]
+        self.cache_counts['routed'] += 1
+        return worker_direct(worker)
+
+    def record_report(self, report):
+        """Record report
+
+        Track the results held by workers, and the cache metrics, from the
+        report of a finished task.
+        """
+        if not isinstance(report, dict):
+            return
+        self.cache_counts.update(report['counts'])
+        worker = report['worker']
+        if worker is None:
+            # The worker does not consume its direct queue
+            return
+        for call in report['evicted']:
+            self.holders.get(call, {}).pop(worker, None)
+        for call, size in report['cached']:
+            self.holders.setdefault(call, {})[worker] = size
+
+    @contextlib.asynccontextmanager
+    async def in_flight_slot(self, function_name):
+        """In flight slot
+
+        Wait until the function limits and the overall in flight limit allow
+        another task, and hold a slot while the task runs. The function slot
+        and rate limit are waited for first, so a throttled function does not
+        hold overall slots while waiting.
+        """
+        async with contextlib.AsyncExitStack() as stack:
+            self.waiting += 1
+            try:
+                function_semaphore = self.function_semaphores.get(
+                    function_name
+                )
+                if function_semaphore is not None:
+                    await stack.enter_async_context(function_semaphore)
+                bucket = self.buckets.get(function_name)
+                if bucket is not None:
+                    await asyncio.sleep(bucket.reserve())
+                if self.semaphore is not None:
+                    await stack.enter_async_context(self.semaphore)
+            finally:
+                self.waiting -= 1
+
+            self.in_flight[function_name] += 1
+            try:
+                yield
+            finally:
+                self.in_flight[function_name] -= 1
+
     async def run(self):
-        queue = asyncio.Queue()
+        # Semaphores must be created inside the event loop
+        self.semaphore = (
+            asyncio.Semaphore(self.max_in_flight)
+            if self.max_in_flight is not None else None
+        )
+        limits = {
+            name: func.options['max_parallel']
+            for name, func in self.function_images.items()
+            if func.options.get('max_parallel') is not None
+        }
+        limits.update(self.max_in_flight_per_function)
+        self.function_semaphores = {
+            name: asyncio.Semaphore(limit) for name, limit in limits.items()
+        }
+        self.buckets = {
+            name: TokenBucket(func.options['rate_limit'])
+            for name, func in self.function_images.items()
+            if func.options.get('rate_limit') is not None
+        }
+
+        if self.speculate is not None:
+            self.stragglers = Stragglers(
+                self.function_images,
+                self.speculate,
+                recorded={
+                    name: self.store_accessor.runtimes(name)
+                    for name in self.function_images
+                },
+            )
+
+        queue = self.queue = asyncio.Queue()
 
         consumer = asyncio.ensure_future(self.consume_tasks(queue))
 
-        for node in graph_helpers.source_nodes(self.graph):
-            logger.debug(
-                'Enqueuing source node {}'.format(node)
-            )
-            queue.put_nowait(node)
+        for node, count in self.remaining.items():
+            if count == 0:
+                logger.debug(
+                    'Enqueuing source node {}'.format(node)
+                )
+                queue.put_nowait(node)
         await queue.join()
 
         consumer.cancel()
 
+        if self.stragglers is not None:
+            for name, runtimes in self.stragglers.new_runtimes.items():
+                self.store_accessor.record_runtimes(name, runtimes)
+
     async def consume_tasks(self, queue):
         while True:
             node = await queue.get()
@@ -113,18 +501,13 @@ class AsyncCeleryState:
             if self.error is not None:
                 self.cancel_queue(queue, seen_node=node)
                 break
-            elif not self.is_ready(node):
-                logger.debug('{} not ready'.format(node))
-                queue.task_done()
             else:
                 asyncio.ensure_future(self.execute_task(node, queue))
 
     async def execute_task(self, node, queue):
         try:
-            assert self.is_ready(node)
-
-            if node in self.visited:
-                return
+            assert self.remaining[node] == 0
+            assert node not in self.visited
             self.visited.add(node)
 
             func = self.function_images[node.function_name]
@@ -132,36 +515,133 @@ class AsyncCeleryState:
             if self.store_accessor.completed(node, func.hash):
                 logger.info('{} already completed'.format(node))
             else:
-                logger.info('Submitting {}'.format(node))
-                with self.connection_pool.acquire() as connection:
-                    await celery_xun_exec.async_apply_async(
-                        args=(node, func, self.store_accessor),
-                        connection=connection,
-                        backend='',
-                    )
+                async with self.in_flight_slot(node.function_name):
+                    if self.error is not None:
+                        logger.info(
+                            '{} cancelled due to previous failure'.format(node)
+                        )
+                        return
+                    logger.info('Submitting {}'.format(node))
+                    logger.debug('Gauges: {}'.format(self.gauges()))
+                    queue_name = self.queues.get(node.function_name)
+                    if (queue_name is None and
+                            self.result_cache_bytes is not None):
+                        queue_name = self.local_queue(node)
+                    report = await self.submit(node, func, queue_name)
+                    self.record_report(report)
                 logger.info('{} succeeded'.format(node))
 
-            self.succeeded.add(node)
-
             for successor in self.graph.successors(node):
-                logger.debug(
-                    'Enqueuing {}, successor of {}'.format(successor, node)
-                )
-                queue.put_nowait(successor)
+                self.remaining[successor] -= 1
+                if self.remaining[successor] == 0:
+                    logger.debug(
+                        'Enqueuing {}, successor of {}'.format(successor, node)
+                    )
+                    queue.put_nowait(successor)
         except Exception as e:
             logger.error('{} failed with {}'.format(node, str(e)))
-            raise
+            if self.failures is None:
+                raise
+            # The successors of the call are never enqueued
+            self.failures.fail(node, e)
         finally:
             # Notify the task queue that a task has been completed. There is a
             # coroutine waiting for the queue to complete, so this is _very_
             # important
             queue.task_done()
 
-    def is_ready(self, node):
-        dependencies_satisfied = all(
-            i in self.succeeded for i in self.graph.predecessors(node)
+    async def submit(self, node, func, queue_name):
+        """Submit
+
+        Publish a call and wait for it to finish. If speculation is enabled,
+        a copy of the call is published once the call straggles, and the
+        first copy to finish successfully completes the call.
+
+        Returns
+        -------
+        Any
+            The report of the task completing the call
+        """
+        speculate = (
+            self.stragglers is not None and
+            node.function_name not in self.stragglers.excluded
         )
-        return dependencies_satisfied
+
+        def publish(claim=True):
+            return asyncio.ensure_future(celery_xun_exec.async_apply_async(
+                args=(
+                    node,
+                    task_image(func, node),
+                    self.store_accessor.for_call(node),
+                    self.result_cache_bytes,
+                    speculate,
+                    claim,
+                ),
+                queue=queue_name,
+                backend='',
+                publisher=self.publisher,
+                listener=self.result_listener,
+            ))
+
+        copies = {publish()}
+        backed_up = not speculate
+        try:
+            while True:
+                timeout = None
+                if not backed_up:
+                    timeout = self.straggler_timeout(node, func)
+                    if timeout == 0:
+                        logger.info('{} is straggling, submitting a backup'
+                                    .format(node))
+                        # The first copy holds the lease on the call
+                        copies.add(publish(claim=False))
+                        backed_up = True
+                        timeout = None
+                done, copies = await asyncio.wait(
+                    copies,
+                    timeout=timeout,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                succeeded = [copy for copy in done if copy.exception() is None]
+                if len(succeeded) > 0:
+                    if speculate:
+                        self.record_runtime(node, func)
+                    return succeeded[0].result()
+                for copy in done:
+                    if len(copies) == 0:
+                        raise copy.exception()
+                    logger.warning(
+                        '{} failed with {}, waiting for its backup'
+                        .format(node, str(copy.exception()))
+                    )
+        finally:
+            # The slower copy, if any, runs to completion on its worker and
+            # stores the same result
+            for copy in copies:
+                copy.cancel()
+
+    def straggler_timeout(self, node, func):
+        """Straggler timeout
+
+        Returns
+        -------
+        float
+            Time until the call straggles, zero if it straggles, or the
+            interval between checks if that cannot be told yet
+        """
+        threshold = self.stragglers.threshold(node.function_name)
+        if threshold is None:
+            return self.speculation_interval
+        started = self.store_accessor.started(node, func.hash)
+        if started is None:
+            return min(threshold, self.speculation_interval)
+        return max(0.0, started + threshold - time.time())
+
+    def record_runtime(self, node, func):
+        started = self.store_accessor.started(node, func.hash)
+        if started is not None:
+            self.stragglers.record(node.function_name, time.time() - started)
+            self.store_accessor.forget_started(node, func.hash)
 
     def cancel_queue(self, queue, seen_node=None):
         if seen_node is not None:
@@ -176,17 +656,272 @@ class AsyncCeleryState:
             logger.info('{} cancelled due to previous failure'.format(node))
 
 
+class Publisher:
+    """Publisher
+
+    Publishes tasks in batches. Tasks submitted during one iteration of the
+    event loop are published together at the start of the next iteration,
+    over a single connection and producer, instead of acquiring a connection
+    for every task.
+
+    Parameters
+    ----------
+    loop : asyncio.AbstractEventLoop
+        The event loop submitting tasks
+    connection_pool : kombu.connection.ConnectionPool
+        Pool of broker connections
+    """
+
+    def __init__(self, loop, connection_pool):
+        self.loop = loop
+        self.connection_pool = connection_pool
+        self.pending = []
+
+    def publish(self, task, args=None, kwargs=None, **options):
+        """Publish
+
+        Called from the event loop. Schedules a task for publishing with the
+        next batch.
+
+        Parameters
+        ----------
+        task : celery.Task
+            The task to publish
+        args : tuple
+            Positional arguments to the task
+        kwargs : dict
+            Keyword arguments to the task
+        **options
+            Options passed on to ``task.apply_async``
+
+        Returns
+        -------
+        asyncio.Future
+            Future holding the ``celery.result.AsyncResult`` of the task once
+            it has been published
+        """
+        future = self.loop.create_future()
+        if len(self.pending) == 0:
+            self.loop.call_soon(self.flush)
+        self.pending.append((task, args, kwargs, options, future))
+        return future
+
+    def flush(self):
+        pending, self.pending = self.pending, []
+        logger.debug('Publishing {} tasks'.format(len(pending)))
+        try:
+            with self.connection_pool.acquire() as connection:
+                producer = celery_app.amqp.Producer(
+                    connection, auto_declare=False
+                )
+                for task, args, kwargs, options, future in pending:
+                    if future.cancelled():
+                        # The task is no longer needed, such as a backup of
+                        # a call that has completed
+                        continue
+                    try:
+                        async_result = task.apply_async(
+                            args, kwargs, producer=producer, **options
+                        )
+                    except Exception as e:
+                        future.set_exception(e)
+                    else:
+                        future.set_result(async_result)
+        except Exception as e:
+            for *_, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+
+
+class ResultListener:
+    """ResultListener
+
+    Delivers task completion to the event loop as results are pushed by the
+    result backend, instead of polling the backend for every task in flight.
+    A single thread owns the backend's result consumer. It registers results
+    handed to it by the event loop, and drains result messages as they arrive.
+    Backends that cannot push results are polled by the same thread, checking
+    the state of every task in flight in one batch where the backend allows.
+    If receiving results fails `retries` times in a row, the tasks waited for
+    fail with the error.
+
+    Parameters
+    ----------
+    loop : asyncio.AbstractEventLoop
+        The event loop waiting for results
+    interval : float
+        The longest time the thread waits for result messages before picking
+        up newly registered results
+    poll_interval : float
+        Time between polls of backends that cannot push results
+    retries : int
+        Number of failures to receive results in a row that fail the tasks
+        waited for
+    """
+
+    def __init__(self, loop, interval=0.1, poll_interval=0.05, retries=3):
+        self.loop = loop
+        self.interval = interval
+        self.poll_interval = poll_interval
+        self.retries = retries
+        self.failures = 0
+        self.backend = None
+        self.polled = {}
+        self.pushed = {}
+        self.registrations = queue.Queue()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(
+            target=self.run,
+            name='xun-result-listener',
+            daemon=True,
+        )
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def wait(self, async_result):
+        """Wait
+
+        Called from the event loop. Returns a future that is done when the
+        given task has finished, successfully or not.
+
+        Parameters
+        ----------
+        async_result : celery.result.AsyncResult
+            Result of a task published with an async result backend
+
+        Returns
+        -------
+        asyncio.Future
+            Future done when the task is ready, or failed with the error if
+            results cannot be received
+        """
+        future = self.loop.create_future()
+        self.registrations.put((async_result, future))
+        return future
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.register_pending()
+            if len(self.polled) > 0:
+                try:
+                    self.poll()
+                except Exception as e:
+                    self.fail('Polling results', e)
+                else:
+                    self.failures = 0
+                self.stopped.wait(self.poll_interval)
+                continue
+            if self.backend is None or not self.backend.is_async:
+                self.stopped.wait(self.interval)
+                continue
+            try:
+                self.backend.result_consumer.drain_events(
+                    timeout=self.interval
+                )
+            except socket.timeout:
+                self.failures = 0
+            except Exception as e:
+                self.fail('Receiving results', e)
+                self.stopped.wait(self.interval)
+            else:
+                self.failures = 0
+
+    def fail(self, action, exception):
+        """
+        Record a failure to receive results. Once receiving has failed
+        `retries` times in a row, the tasks waited for fail with the error
+        """
+        logger.error('{} failed with {}'.format(action, exception))
+        self.failures += 1
+        if self.failures < self.retries:
+            return
+        self.failures = 0
+        futures = [future for _, future in self.polled.values()]
+        futures.extend(self.pushed.values())
+        self.polled.clear()
+        self.pushed.clear()
+        for future in futures:
+            self.loop.call_soon_threadsafe(self.set_failed, future, exception)
+
+    def poll(self):
+        if hasattr(self.backend, 'get_many'):
+            # Key value store backends fetch the state of all tasks in a
+            # single round trip, and cache the results of finished ones
+            ready = [
+                task_id for task_id, _ in self.backend.get_many(
+                    list(self.polled), interval=0, max_iterations=1
+                )
+            ]
+        else:
+            ready = [
+                task_id for task_id, (async_result, _) in self.polled.items()
+                if async_result.ready()
+            ]
+        for task_id in ready:
+            _, future = self.polled.pop(task_id)
+            self.loop.call_soon_threadsafe(self.set_done, future)
+
+    def register_pending(self):
+        while True:
+            try:
+                async_result, future = self.registrations.get_nowait()
+            except queue.Empty:
+                return
+
+            self.backend = async_result.backend
+            if not self.backend.is_async:
+                self.polled[async_result.id] = (async_result, future)
+                continue
+
+            def notify(_, task_id=async_result.id, future=future):
+                self.pushed.pop(task_id, None)
+                self.loop.call_soon_threadsafe(self.set_done, future)
+
+            self.pushed[async_result.id] = future
+            async_result.then(notify, on_error=notify)
+
+            # Results that landed before the backend subscribed to them are
+            # picked up here
+            self.backend.result_consumer.on_wait_for_pending(async_result)
+
+    @staticmethod
+    def set_done(future):
+        if not future.done():
+            future.set_result(None)
+
+    @staticmethod
+    def set_failed(future, exception):
+        if not future.done():
+            future.set_exception(exception)
+
+
 class AsyncTask(celery.Task):
     async def async_apply_async(self, args=None, kwargs=None, task_id=None,
                                 producer=None, link=None, link_error=None,
-                                shadow=None, **options):
-        ar = self.apply_async(
-            args, kwargs, task_id, producer, link, link_error, shadow,
-            **options
-        )
+                                shadow=None, publisher=None, listener=None,
+                                **options):
+        if publisher is not None:
+            ar = await publisher.publish(
+                self, args, kwargs, task_id=task_id, link=link,
+                link_error=link_error, shadow=shadow, **options
+            )
+        else:
+            ar = self.apply_async(
+                args, kwargs, task_id, producer, link, link_error, shadow,
+                **options
+            )
 
-        while not ar.successful() and not ar.failed():
-            await asyncio.sleep(0.05)
+        if listener is not None:
+            await listener.wait(ar)
+        else:
+            # Backends that cannot push results must be polled
+            while not ar.successful() and not ar.failed():
+                await asyncio.sleep(0.05)
 
         result = ar.get()
 
@@ -196,14 +931,363 @@ class AsyncTask(celery.Task):
         return result
 
 
+# Node name of the worker in this process, the name of its direct queue. It is
+# None unless the worker consumes its direct queue. Pool processes are forked
+# after initialization, and inherit it.
+_worker_name = None
+
+
+@signals.worker_init.connect
+def remember_worker_name(sender=None, **kwargs):
+    global _worker_name
+    if sender.app.conf.worker_direct:
+        _worker_name = sender.hostname
+
+
 @celery_app.task(base=AsyncTask)
-def celery_xun_exec(call, func, store_accessor):
+def celery_xun_exec(call,
+                    func,
+                    store_accessor,
+                    result_cache_bytes=None,
+                    mark_started=False,
+                    claim=True):
     logger = celery.utils.log.get_task_logger(__name__)
-    logger.info('Executing {}'.format(call))
 
-    args, kwargs = store_accessor.resolve_call_args(call)
-    result = func(*args, **kwargs)
-    store_accessor.store_result(call, func.hash, result)
+    cache = None
+    if result_cache_bytes is not None:
+        cache = enable_result_cache(result_cache_bytes)
+
+    with contextlib.ExitStack() as stack:
+        claimed = True
+        if claim:
+            claimed = stack.enter_context(
+                store_accessor.claim(call, func.hash)
+            )
+        if claimed:
+            logger.info('Executing {}'.format(call))
+            if mark_started:
+                store_accessor.mark_started(call, func.hash)
+
+            args, kwargs = store_accessor.resolve_call_args(call)
+            with time_limit(func.options.get('timeout'), call):
+                result = run_to_completion(func(*args, **kwargs))
+            store_accessor.store_result(call, func.hash, result)
+
+            logger.info('{} succeeded'.format(call))
+        else:
+            logger.info('{} already completed'.format(call))
 
-    logger.info('{} succeeded'.format(call))
+    if cache is not None:
+        return cache.report(_worker_name, store_accessor.store_token)
     return 0
+
+
+class WorkerPlan:
+    """WorkerPlan
+
+    The part of a call graph left to execute, shared with the workers when
+    they schedule calls.
+
+    Parameters
+    ----------
+    graph : nx.DiGraph
+        Call graph of the calls left to execute
+    function_images : dict
+        Function images by function name
+    queues : dict, optional
+        Queue by function name, calls to other functions are published to the
+        default queue
+    result_cache_bytes : int, optional
+        Size of the result cache of the worker processes, if any
+    keep_going : bool, optional
+        If true, workers record failed calls and keep running calls that do
+        not depend on them
+    elements : dict, optional
+        Subscripts of the elements stored separately, by call. The plan is
+        shared once, and tasks carry only the elements of their call
+    tree_inputs : dict, optional
+        Partial results combined by the calls of reduction trees, by call.
+        Tasks carry only the inputs of their call
+    """
+
+    def __init__(self,
+                 graph,
+                 function_images,
+                 queues=None,
+                 result_cache_bytes=None,
+                 keep_going=False,
+                 elements=None,
+                 tree_inputs=None):
+        self.function_images = function_images
+        self.queues = queues or {}
+        self.result_cache_bytes = result_cache_bytes
+        self.keep_going = keep_going
+        self.elements = elements
+        self.tree_inputs = tree_inputs
+        self.predecessors = {
+            node: list(graph.predecessors(node)) for node in graph.nodes
+        }
+        self.successors = {
+            node: list(graph.successors(node)) for node in graph.nodes
+        }
+
+    def is_ready(self, call, store_accessor):
+        return all(
+            store_accessor.completed(
+                predecessor,
+                self.function_images[predecessor.function_name].hash,
+            )
+            for predecessor in self.predecessors[call]
+        )
+
+    def store_accessor(self, call, store_accessor):
+        """
+        The accessor sent with the task executing a call, given the accessor
+        of any task of the run
+        """
+        if self.elements is None and self.tree_inputs is None:
+            return store_accessor
+        accessor = copy.copy(store_accessor)
+        accessor.elements = self.elements
+        accessor.tree_inputs = self.tree_inputs
+        return accessor.for_call(call)
+
+
+def run_on_workers(pool,
+                   graph,
+                   entry_call,
+                   function_images,
+                   store_accessor,
+                   queues=None,
+                   result_cache_bytes=None,
+                   failures=None,
+                   poll_interval=0.05):
+    """Run on workers
+
+    Execute a call graph with calls scheduled by the workers. Completed calls
+    are pruned from the graph, the remaining plan is written to the store,
+    and the calls that are ready are published. The driver then waits until
+    the entry call is stored or a worker records a failure. In keep going
+    mode, the driver waits until every call has completed, failed, or
+    depends on a failed call.
+
+    Parameters
+    ----------
+    pool : kombu.connection.ConnectionPool
+        Pool of broker connections
+    graph : nx.DiGraph
+        The call graph
+    entry_call : CallNode
+        The call whose result completes the run
+    function_images : dict
+        Function images by function name
+    store_accessor : StoreAccessor
+        Accessor for the store shared with the workers
+    queues : dict, optional
+        Queue by function name
+    result_cache_bytes : int, optional
+        Size of the result cache of the worker processes, if any
+    failures : FailureReport, optional
+        Records failed calls in keep going mode
+    poll_interval : float
+        Time between checks for the entry call result
+    """
+    remaining = [
+        node for node in graph.nodes
+        if not store_accessor.completed(
+            node, function_images[node.function_name].hash
+        )
+    ]
+    if len(remaining) == 0:
+        return
+
+    remaining_graph = graph.subgraph(remaining)
+    plan = WorkerPlan(
+        remaining_graph,
+        function_images,
+        queues,
+        result_cache_bytes,
+        keep_going=failures is not None,
+        elements=store_accessor.elements,
+        tree_inputs=store_accessor.tree_inputs,
+    )
+    run_id = uuid.uuid4().hex
+    namespace = store_accessor.store / 'celery' / run_id
+    namespace['plan'] = plan
+
+    try:
+        with pool.acquire() as connection:
+            producer = celery_app.amqp.Producer(connection, auto_declare=False)
+            for node in remaining:
+                if len(plan.predecessors[node]) == 0:
+                    logger.info('Submitting {}'.format(node))
+                    celery_xun_exec_and_trigger.apply_async(
+                        args=(
+                            run_id,
+                            node,
+                            plan.store_accessor(node, store_accessor),
+                        ),
+                        queue=plan.queues.get(node.function_name),
+                        producer=producer,
+                    )
+
+        if failures is not None:
+            wait_for_outcomes(
+                plan,
+                list(nx.topological_sort(remaining_graph)),
+                namespace,
+                store_accessor,
+                failures,
+                poll_interval,
+            )
+            return
+
+        entry_hash = function_images[entry_call.function_name].hash
+        while not store_accessor.completed(entry_call, entry_hash):
+            if 'error' in namespace:
+                node, error = namespace['error']
+                logger.error('{} failed with {}'.format(node, str(error)))
+                raise error
+            time.sleep(poll_interval)
+    finally:
+        # Workers stop scheduling calls once the plan is gone
+        namespace.clear()
+        (namespace / 'failures').clear()
+
+
+def wait_for_outcomes(plan,
+                      schedule,
+                      namespace,
+                      store_accessor,
+                      failures,
+                      poll_interval):
+    """Wait for outcomes
+
+    Wait until every call has completed, failed, or depends on a failed call,
+    and record the failures. Calls are checked in the order of the schedule,
+    up to the first call that is still to run, so that every poll is cheap.
+    """
+    recorded = namespace / 'failures'
+    outstanding = schedule
+    blocked = set()
+    while len(outstanding) > 0:
+        waiting = []
+        for call in outstanding:
+            if any(pred in blocked for pred in plan.predecessors[call]):
+                blocked.add(call)
+                continue
+            if len(waiting) > 0:
+                waiting.append(call)
+                continue
+            func = plan.function_images[call.function_name]
+            if store_accessor.completed(call, func.hash):
+                continue
+            if call in recorded:
+                error, formatted_traceback = recorded[call]
+                logger.error('{} failed with {}'.format(call, str(error)))
+                failures.fail(call, error, formatted_traceback)
+                blocked.add(call)
+                continue
+            waiting.append(call)
+        outstanding = waiting
+        if len(outstanding) > 0:
+            time.sleep(poll_interval)
+
+
+# Plans are cached by workers for the duration of a run, to avoid loading
+# them from the store for every call
+_worker_plans = {}
+
+
+def run_has_ended(run_id, namespace):
+    """
+    True once the driver has removed the plan of a run, such as when a call
+    failed. The plan is then evicted from the cache of the worker
+    """
+    if 'plan' in namespace:
+        return False
+    _worker_plans.pop(run_id, None)
+    return True
+
+
+def load_worker_plan(run_id, namespace, cache_size=16):
+    if run_has_ended(run_id, namespace):
+        return None
+
+    try:
+        return _worker_plans[run_id]
+    except KeyError:
+        pass
+
+    try:
+        plan = namespace['plan']
+    except KeyError:
+        return None
+
+    while len(_worker_plans) >= cache_size:
+        del _worker_plans[next(iter(_worker_plans))]
+    _worker_plans[run_id] = plan
+    return plan
+
+
+@celery_app.task(ignore_result=True)
+def celery_xun_exec_and_trigger(run_id, call, store_accessor):
+    logger = celery.utils.log.get_task_logger(__name__)
+
+    namespace = store_accessor.store / 'celery' / run_id
+    plan = load_worker_plan(run_id, namespace)
+    if plan is None:
+        logger.info('{} cancelled, run {} has ended'.format(call, run_id))
+        return
+
+    func = plan.function_images[call.function_name]
+
+    if plan.result_cache_bytes is not None:
+        # There is no driver collecting reports when workers schedule calls,
+        # so the record of changes is discarded
+        enable_result_cache(plan.result_cache_bytes).changes()
+
+    try:
+        if store_accessor.completed(call, func.hash):
+            logger.info('{} already completed'.format(call))
+        else:
+            with store_accessor.claim(call, func.hash) as claimed:
+                if claimed:
+                    logger.info('Executing {}'.format(call))
+                    args, kwargs = store_accessor.resolve_call_args(call)
+                    with time_limit(func.options.get('timeout'), call):
+                        result = run_to_completion(func(*args, **kwargs))
+                    store_accessor.store_result(call, func.hash, result)
+                    logger.info('{} succeeded'.format(call))
+                else:
+                    logger.info('{} already completed'.format(call))
+    except Exception as e:
+        logger.error('{} failed with {}'.format(call, str(e)))
+        if plan.keep_going:
+            # Successors of the call are not published, the driver tells
+            # they were skipped
+            (namespace / 'failures')[call] = (e, traceback.format_exc())
+        else:
+            namespace['error'] = (call, e)
+        raise
+
+    if run_has_ended(run_id, namespace):
+        logger.info('Run {} has ended, not submitting successors of {}'.format(
+            run_id, call
+        ))
+        return
+
+    # Calls finishing at the same time may both find a common successor
+    # ready and publish it. This is safe, since the successor is skipped
+    # once it has been completed, and results are keyed by function hash.
+    for successor in plan.successors[call]:
+        if plan.is_ready(successor, store_accessor):
+            logger.info('Submitting {}'.format(successor))
+            celery_xun_exec_and_trigger.apply_async(
+                args=(
+                    run_id,
+                    successor,
+                    plan.store_accessor(successor, store_accessor),
+                ),
+                queue=plan.queues.get(successor.function_name),
+            )
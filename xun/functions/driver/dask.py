@@ -1,39 +1,469 @@
+from ..limits import TokenBucket
+from ..store import preloaded_results
 from .driver import Driver
-import dask
+from .driver import run_to_completion
+from .driver import task_image
+from concurrent.futures import ThreadPoolExecutor
+from dask.highlevelgraph import HighLevelGraph
+from dask.highlevelgraph import MaterializedLayer
+from dask.optimization import fuse_linear
+from distributed import Semaphore
+from distributed import get_client
+from distributed import rejoin
+from distributed import secede
+import contextlib
 import logging
 import networkx as nx
+import threading
+import time
+import traceback
+import uuid
 
 logger = logging.getLogger(__name__)
 
 
-def compute_proxy(node, dependencies, func, store_accessor):
-    if store_accessor.completed(node, func.hash):
-        return store_accessor.load_result(node)
+def compute_proxy(node,
+                  predecessors,
+                  dependencies,
+                  func,
+                  store_accessor,
+                  limits=None,
+                  keep_going=False):
+    """Compute proxy
 
-    args, kwargs = store_accessor.resolve_call_args(node)
-    result = func(*args, **kwargs)
-    store_accessor.store_result(node, func.hash, result)
+    Runs a call on a dask worker. The results of the predecessors computed in
+    the same run are handed over by dask, and used instead of loading them
+    from the store. The result is returned, and written to the store in the
+    background. In single flight and early cutoff modes, it is written before
+    the task finishes instead. A call completed by another run, or reusing an
+    earlier result, is loaded from the store.
+
+    In keep going mode, a failed call returns a `Failed` result instead of
+    raising. Calls depending on failed calls are skipped, and pass on the
+    failures of their predecessors, so that they reach the last calls.
+
+    Parameters
+    ----------
+    node : CallNode
+        The call to run
+    predecessors : list of CallNode
+        Predecessors of the call computed in this run
+    dependencies : list
+        Results of the predecessors, in the same order
+    func : FunctionImage
+        The function of the call
+    store_accessor : StoreAccessor
+        Accessor for the store
+    limits : FunctionLimits, optional
+        The limits of the function of the call, if any
+    keep_going : bool, optional
+        Return failures instead of raising them
+
+    Returns
+    -------
+    Any
+        The result of the call
+    """
+    failed = [result for result in dependencies if isinstance(result, Failed)]
+    if len(failed) > 0:
+        logger.info('{} skipped due to failed dependency'.format(node))
+        return Failed.merge(failed)
+
+    try:
+        with store_accessor.claim(node, func.hash) as claimed:
+            if not claimed:
+                logger.info('{} already completed'.format(node))
+                return store_accessor.load_result(node, func.hash)
+            with preloaded_results(dict(zip(predecessors, dependencies))):
+                args, kwargs = store_accessor.resolve_call_args(node)
+                if limits is None:
+                    result = run_to_completion(func(*args, **kwargs))
+                else:
+                    with limits.slot():
+                        result = run_to_completion(func(*args, **kwargs))
+            if (store_accessor.lease_ttl is not None or
+                    store_accessor.early_cutoff is not None):
+                # Runs waiting for the lease expect the result in the store
+                # once it is released, and calls loading the result record
+                # its digest
+                store_accessor.store_result(node, func.hash, result)
+                return result
+    except Exception as e:
+        if not keep_going:
+            raise
+        logger.error('{} failed with {}'.format(node, str(e)))
+        return Failed({node: (e, traceback.format_exc())})
+    store_writer().submit(store_accessor.store_result, node, func.hash, result)
     return result
 
 
+class Failed:
+    """Failed
+
+    Result of a task in keep going mode, if its call failed or depends on
+    failed calls
+
+    Parameters
+    ----------
+    failures : dict
+        Exception and formatted traceback by failed call
+    """
+
+    def __init__(self, failures):
+        self.failures = failures
+
+    @staticmethod
+    def merge(failed):
+        failures = {}
+        for f in failed:
+            failures.update(f.failures)
+        return Failed(failures)
+
+
+class FunctionLimits:
+    """FunctionLimits
+
+    The `max_parallel` and `rate_limit` of a function, shared by all workers
+    of a dask cluster. The parallel limit is a distributed semaphore, and the
+    rate limit a token bucket kept on the scheduler. While a task waits for
+    them, it secedes from the thread pool of its worker, so that tasks of
+    other functions keep running.
+
+    Parameters
+    ----------
+    name : str
+        Unique name of the limits
+    options : dict
+        The options of the function
+    client : dask.distributed.Client
+        Client of the cluster
+
+    Methods
+    -------
+    slot()
+        Context holding a slot of the function while a call runs
+    close(client)
+        Remove the limits from the cluster
+    """
+
+    def __init__(self, name, options, client):
+        self.name = name
+        self.rate_limit = options.get('rate_limit')
+        self.semaphore = None
+        if options.get('max_parallel') is not None:
+            self.semaphore = Semaphore(
+                max_leases=options['max_parallel'],
+                name=name,
+                scheduler_rpc=client.scheduler,
+                loop=client.loop,
+            )
+
+    @contextlib.contextmanager
+    def slot(self):
+        seceded = False
+        acquired = False
+        try:
+            if self.semaphore is not None:
+                acquired = self.semaphore.acquire(timeout=0)
+                if not acquired:
+                    secede()
+                    seceded = True
+                    acquired = self.semaphore.acquire()
+            if self.rate_limit is not None:
+                delay = get_client().run_on_scheduler(
+                    reserve_token, self.name, self.rate_limit
+                )
+                if delay > 0:
+                    if not seceded:
+                        secede()
+                        seceded = True
+                    time.sleep(delay)
+            if seceded:
+                rejoin()
+            yield
+        finally:
+            if acquired:
+                self.semaphore.release()
+
+    def close(self, client):
+        if self.semaphore is not None:
+            self.semaphore.close()
+        if self.rate_limit is not None:
+            client.run_on_scheduler(forget_tokens, self.name)
+
+
+# Token buckets of the rate limited functions of the runs in progress, kept on
+# the scheduler
+_token_buckets = {}
+
+
+def reserve_token(name, rate):
+    """Reserve token
+
+    Executed on the scheduler. Takes a token from the named token bucket.
+
+    Returns
+    -------
+    float
+        Seconds to wait before using the token
+    """
+    bucket = _token_buckets.get(name)
+    if bucket is None:
+        bucket = _token_buckets[name] = TokenBucket(rate)
+    return bucket.reserve()
+
+
+def forget_tokens(name):
+    _token_buckets.pop(name, None)
+
+
+class StoreWriter:
+    """StoreWriter
+
+    Writes results to the store in background threads, so that workers move
+    on to the next task without waiting for the store.
+    """
+
+    def __init__(self, max_workers=4):
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix='xun-store-writer',
+        )
+        self.lock = threading.Lock()
+        self.futures = []
+
+    def submit(self, func, *args):
+        future = self.executor.submit(func, *args)
+        with self.lock:
+            self.futures.append(future)
+
+    def flush(self):
+        """Flush
+
+        Wait for the writes submitted so far to finish
+
+        Raises
+        ------
+        Exception
+            The first error raised by a write, if any
+        """
+        with self.lock:
+            futures, self.futures = self.futures, []
+        for future in futures:
+            future.result()
+
+
+_store_writer = None
+_store_writer_lock = threading.Lock()
+
+
+def store_writer():
+    global _store_writer
+    with _store_writer_lock:
+        if _store_writer is None:
+            _store_writer = StoreWriter()
+        return _store_writer
+
+
+def flush_store_writes():
+    store_writer().flush()
+
+
 class Dask(Driver):
-    def __init__(self, client):
+    """Dask
+
+    Runs the call graph on a dask cluster. The call graph is translated
+    directly to a dask task graph, with one layer per function. Results are
+    handed from call to call in worker memory by dask, and are written to the
+    store in the background. Calls that are already completed are not
+    submitted, the calls that need their results load them from the store.
+
+    Parameters
+    ----------
+    client : dask.distributed.Client
+        Client of the cluster to run on
+    annotations : mapping of str to dict, optional
+        Dask annotations by function name, such as ``resources``,
+        ``priority``, and ``retries``. Calls to the function are scheduled
+        accordingly
+    fuse : bool
+        If true, linear chains of calls are fused into single tasks, saving
+        scheduling overhead for chains of small calls. Calls to annotated
+        functions are not fused
+
+    The `max_parallel` and `rate_limit` of functions are enforced across the
+    cluster. Tasks waiting for the limits of their function do not take up
+    worker threads.
+
+    Examples
+    --------
+
+    >>> driver = xun.functions.driver.Dask(
+    ...     client,
+    ...     annotations={'train': {'resources': {'GPU': 1}, 'retries': 2}},
+    ... )
+    """
+
+    def __init__(self, client, annotations=None, fuse=False):
         self.client = client
+        self.annotations = annotations or {}
+        self.fuse = fuse
 
-    def _exec(self, graph, entry_call, function_images, store_accessor):
+    def _exec(self,
+              graph,
+              entry_call,
+              function_images,
+              store_accessor,
+              failures=None):
         assert nx.is_directed_acyclic_graph(graph)
 
-        output = {}
+        run_id = uuid.uuid4().hex
+        limits = {
+            name: FunctionLimits(
+                'xun-{}-{}'.format(name, run_id), func.options, self.client
+            )
+            for name, func in function_images.items()
+            if func.options.get('max_parallel') is not None
+            or func.options.get('rate_limit') is not None
+        }
+
+        try:
+            dsk, keys = self.dask_graph(
+                graph,
+                function_images,
+                store_accessor,
+                limits,
+                keep_going=failures is not None,
+            )
+            if len(keys) == 0:
+                return
+
+            logger.info('Running dask job')
+            try:
+                futures = self.client.get(dsk, keys, sync=False)
+                results = self.client.gather(futures)
+                if failures is not None:
+                    failed = [r for r in results if isinstance(r, Failed)]
+                    if len(failed) > 0:
+                        merged = Failed.merge(failed).failures
+                        for call, (error, tb) in merged.items():
+                            failures.fail(call, error, tb)
+            finally:
+                # Results must be in the store when the run is over
+                self.client.run(flush_store_writes)
+        finally:
+            for function_limits in limits.values():
+                function_limits.close(self.client)
+
+    def dask_graph(self,
+                   graph,
+                   function_images,
+                   store_accessor,
+                   limits=None,
+                   keep_going=False):
+        """Dask graph
+
+        Translate a call graph to a dask task graph
 
-        topsort = list(nx.topological_sort(graph))
+        Parameters
+        ----------
+        graph : nx.DiGraph
+            The call graph
+        function_images : dict
+            Function images by function name
+        store_accessor : StoreAccessor
+            Accessor for the store
+        limits : mapping of str to FunctionLimits, optional
+            Limits by function name
+        keep_going : bool, optional
+            Tasks return failures instead of raising them
 
-        for node in topsort:
-            logger.info('Submitting node {}'.format(node))
+        Returns
+        -------
+        (HighLevelGraph, list of str)
+            The task graph, and the keys of the tasks whose results are
+            requested. These are the last calls, dask releases the results of
+            the others once they are no longer needed
+        """
+        limits = limits or {}
+        keys = {}
+        dsk = {}
+        dependencies = {}
+        functions = {}
+
+        for node in nx.topological_sort(graph):
             func = function_images[node.function_name]
-            dependencies = [output[anc] for anc in graph.predecessors(node)]
-            output[node] = dask.delayed(compute_proxy)(node, dependencies,
-                                                       func, store_accessor)
 
-        logger.info('Running dask job')
-        future = self.client.compute(output[entry_call], optimize_graph=False)
-        return future.result()
+            # Do not rerun finished jobs. For example if a workflow has been
+            # stopped and resumed.
+            if store_accessor.completed(node, func.hash):
+                logger.info('{} already completed'.format(node))
+                continue
+
+            logger.debug('Adding {} to task graph'.format(node))
+            key = '{}-{}'.format(node.function_name, uuid.uuid4().hex)
+            predecessors = [
+                pred for pred in graph.predecessors(node) if pred in keys
+            ]
+            dependency_keys = [keys[pred] for pred in predecessors]
+
+            keys[node] = key
+            functions[key] = node.function_name
+            dependencies[key] = set(dependency_keys)
+            dsk[key] = (
+                compute_proxy,
+                node,
+                predecessors,
+                dependency_keys,
+                task_image(func, node),
+                store_accessor.for_call(node),
+                limits.get(node.function_name),
+                keep_going,
+            )
+
+        dependents = {key: set() for key in dsk}
+        for key, deps in dependencies.items():
+            for dep in deps:
+                dependents[dep].add(key)
+        sinks = [key for key in dsk if len(dependents[key]) == 0]
+
+        if self.fuse and len(dsk) > 0:
+            # Annotated and limited tasks, and the tasks they depend on, keep
+            # their keys
+            annotated = {
+                key for key in dsk
+                if functions[key] in self.annotations
+                or functions[key] in limits
+            }
+            kept = set(sinks) | annotated
+            for key in annotated:
+                kept |= dependencies[key]
+            dsk, dependencies = fuse_linear(
+                dsk,
+                keys=list(kept),
+                dependencies={
+                    key: list(deps) for key, deps in dependencies.items()
+                },
+                rename_keys=False,
+            )
+
+        layers = {}
+        layer_dependencies = {}
+        for key, task in dsk.items():
+            name = functions[key]
+            layers.setdefault(name, {})[key] = task
+            layer_dependencies.setdefault(name, set()).update(
+                functions[dep] for dep in dependencies[key]
+                if functions[dep] != name
+            )
+
+        hlg = HighLevelGraph(
+            {
+                name: MaterializedLayer(
+                    tasks, annotations=self.annotations.get(name)
+                )
+                for name, tasks in layers.items()
+            },
+            layer_dependencies,
+        )
+        return hlg, sinks
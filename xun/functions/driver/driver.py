@@ -1,6 +1,17 @@
+from ..errors import CallsFailedError
+from ..graph import ReduceNode
 from ..store import StoreAccessor
 from abc import ABC
 from abc import abstractmethod
+import asyncio
+import inspect
+import networkx as nx
+import traceback
+
+
+# Seconds a lease on a call is held without being renewed, in single flight
+# mode
+DEFAULT_LEASE_TTL = 30.0
 
 
 class Driver(ABC):
@@ -9,16 +20,193 @@ class Driver(ABC):
     Drivers are the classes that have the responsibility of executing programs.
     This includes scheduling the calls of the call graph and managing any
     concurrency.
+
+    In keep going mode, `_exec` is given a `FailureReport`. Drivers record
+    failed calls in it instead of raising, and keep running every call that
+    does not depend on a failed call.
+
+    In single flight mode, the store accessor given to `_exec` holds leases.
+    Drivers execute calls within `store_accessor.claim`, and skip the calls
+    that other runs completed while they waited. The same context records
+    the failures of calls, and fails calls with known failures, if failures
+    are remembered. In early cutoff mode, it reuses the earlier results of
+    calls whose inputs are unchanged.
+
+    Given `elements`, the subscripts of result elements by call, results are
+    stored with these elements in separate entries, and subscripted calls
+    load only their elements. The call graph must then hold no subscripted
+    calls.
     """
     @abstractmethod
     def _exec(self, graph, entry_call, function_images, store_accessor):
         pass
 
-    def exec(self, graph, entry_call, function_images, store):
+    def exec(self,
+             graph,
+             entry_call,
+             function_images,
+             store,
+             keep_going=False,
+             single_flight=False,
+             remember_failures=False,
+             early_cutoff=False,
+             elements=None):
         entry_hash = function_images[entry_call.function_name].hash
-        store_accessor = StoreAccessor(store)
-        self._exec(graph, entry_call, function_images, store_accessor)
+        if single_flight is True:
+            lease_ttl = DEFAULT_LEASE_TTL
+        elif single_flight is False:
+            lease_ttl = None
+        else:
+            lease_ttl = float(single_flight)
+        cutoff_hashes = None
+        if early_cutoff:
+            cutoff_hashes = {
+                name: (func.hash, func.source_hash)
+                for name, func in function_images.items()
+            }
+        store_accessor = StoreAccessor(
+            store,
+            lease_ttl=lease_ttl,
+            remember_failures=remember_failures,
+            early_cutoff=cutoff_hashes,
+            elements=elements,
+            function_hashes={
+                name: func.hash for name, func in function_images.items()
+            },
+            tree_inputs=ReduceNode.tree_inputs(graph) or None,
+        )
+        store_accessor.store_arguments(graph.nodes)
+        if not keep_going:
+            self._exec(graph, entry_call, function_images, store_accessor)
+            return store_accessor.load_result(entry_call, hash=entry_hash)
+
+        failures = FailureReport(graph, function_images, store_accessor)
+        self._exec(
+            graph,
+            entry_call,
+            function_images,
+            store_accessor,
+            failures=failures,
+        )
+        if len(failures.failed) > 0:
+            raise CallsFailedError(failures)
         return store_accessor.load_result(entry_call, hash=entry_hash)
 
-    def __call__(self, graph, entry_call, function_images, store):
-        return self.exec(graph, entry_call, function_images, store)
+    def __call__(self, graph, entry_call, function_images, store, **kwargs):
+        return self.exec(graph, entry_call, function_images, store, **kwargs)
+
+
+class FailureReport:
+    """FailureReport
+
+    The calls that failed in a run in keep going mode, and the calls that
+    were skipped because they depend on them. All other calls of the run
+    completed, and their results are in the store. Batches and fused chains
+    of calls are reported as the tasks the driver ran.
+
+    Attributes
+    ----------
+    failed : dict
+        Exception by failed call
+    tracebacks : dict
+        Formatted traceback by failed call
+    skipped : set of CallNode
+        Calls depending on failed calls
+    completed : set of CallNode
+        Calls with a result in the store
+
+    Methods
+    -------
+    fail(call, exception)
+        Record a failed call
+    result(call)
+        Load the result of a completed call
+    """
+
+    def __init__(self, graph, function_images, store_accessor):
+        self.graph = graph
+        self.function_images = function_images
+        self.store_accessor = store_accessor
+        self.failed = {}
+        self.tracebacks = {}
+
+    def fail(self, call, exception, formatted_traceback=None):
+        if formatted_traceback is None:
+            formatted_traceback = ''.join(traceback.format_exception(
+                type(exception), exception, exception.__traceback__
+            ))
+        self.failed[call] = exception
+        self.tracebacks[call] = formatted_traceback
+
+    @property
+    def skipped(self):
+        skipped = set()
+        for call in self.failed:
+            skipped |= nx.descendants(self.graph, call)
+        return skipped
+
+    @property
+    def completed(self):
+        return set(self.graph.nodes) - set(self.failed) - self.skipped
+
+    def result(self, call):
+        func = self.function_images[call.function_name]
+        return self.store_accessor.load_result(call, hash=func.hash)
+
+    def __str__(self):
+        lines = [
+            '{} calls failed, {} calls skipped'.format(
+                len(self.failed), len(self.skipped)
+            )
+        ]
+        for call, exception in self.failed.items():
+            lines.append('{} failed with {}'.format(call, repr(exception)))
+        return '\n'.join(lines)
+
+
+def run_to_completion(result):
+    """Run to completion
+
+    Calls to async xun functions return coroutines. Drivers that execute calls
+    synchronously use this to run such results to completion in a new event
+    loop.
+
+    Parameters
+    ----------
+    result : Any
+        The value returned by a call to a function image
+
+    Returns
+    -------
+    Any
+        The awaited result if the given result is a coroutine, otherwise the
+        result itself
+    """
+    if inspect.iscoroutine(result):
+        return asyncio.run(result)
+    return result
+
+
+def task_image(func, call):
+    """Task image
+
+    Drivers that send function images with every task use this to send only
+    what the task needs. Images of fused calls are restricted to the elements
+    of the calls the task runs, other images are sent as is.
+
+    Parameters
+    ----------
+    func : FunctionImage
+        The function image of the call
+    call : CallNode
+        The call executed by the task
+
+    Returns
+    -------
+    FunctionImage
+        The function image to send with the task
+    """
+    for_call = getattr(func, 'for_call', None)
+    if for_call is None:
+        return func
+    return for_call(call)
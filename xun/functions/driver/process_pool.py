@@ -0,0 +1,482 @@
+from ..limits import Limits
+from ..limits import Resources
+from ..limits import Stragglers
+from ..limits import machine_memory
+from ..limits import parse_memory
+from ..limits import peak_memory
+from ..limits import time_limit
+from .driver import Driver
+from .driver import run_to_completion
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import wait
+import collections
+import contextlib
+import hashlib
+import logging
+import math
+import multiprocessing
+import networkx as nx
+import os
+import pickle
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class ProcessPool(Driver):
+    """ProcessPool
+
+    Runs the call graph on a pool of local worker processes. Workers are
+    started from a fork server where available, and are kept alive for the
+    lifetime of the driver. Compiled function images and imported modules
+    therefore stay warm across tasks and across consecutive runs.
+
+    Only the call and the function hash are sent with a task. A function image
+    is sent to a worker only if that worker has not seen it before. Results
+    are passed between workers through the store, which must be picklable.
+
+    The driver submits no more tasks than there are workers. Calls to
+    functions at their `max_parallel` limit, or waiting for their
+    `rate_limit`, are held back while calls to other functions are
+    submitted.
+
+    Calls are also packed against a budget of memory and processors. A call
+    needs the `memory` and `cpus` given to its function, or one processor and
+    no memory by default. With `learn_resources`, the peak resident set size
+    of the worker running a call is recorded in the store, and functions
+    without a memory hint are expected to need the largest peak recorded for
+    them, in this run or earlier ones. Measuring peaks requires Linux.
+
+    With `speculate`, a call that runs that many times longer than the median
+    runtime of its function is backed up by a copy on another worker, and the
+    first copy to finish completes the call. Both copies store the same
+    result under the same hash, the slower one keeps running in the
+    background. Runtimes are recorded in the store, so that calls can be
+    backed up from the start of the next run. Calls failing with the
+    `timeout` of their function are interrupted in the worker.
+
+    Parameters
+    ----------
+    max_workers : int, optional
+        Number of worker processes, defaults to the processor budget rounded
+        up, or the number of processors on the machine
+    memory : int or str, optional
+        Memory budget for calls, in bytes or as a string such as `'16G'`.
+        Defaults to the physical memory of the machine
+    cpus : int or float, optional
+        Processor budget for calls, defaults to the number of workers
+    learn_resources : bool, optional
+        Record the peak memory of calls, and use recorded peaks for functions
+        without a memory hint
+    speculate : float, optional
+        How many times the median runtime of its function a call runs before
+        it is backed up. Calls are not backed up by default
+
+    Examples
+    --------
+
+    >>> with xun.functions.driver.ProcessPool(max_workers=4) as driver:
+    ...     blueprint.run(driver=driver, store=store)
+
+    >>> driver = xun.functions.driver.ProcessPool(
+    ...     memory='32G', learn_resources=True
+    ... )
+    """
+
+    def __init__(self,
+                 max_workers=None,
+                 memory=None,
+                 cpus=None,
+                 learn_resources=False,
+                 speculate=None):
+        self.max_workers = max_workers
+        self.memory = parse_memory(memory) if memory is not None else None
+        if cpus is not None and cpus <= 0:
+            raise ValueError('cpus must be positive')
+        self.cpus = cpus
+        self.learn_resources = learn_resources
+        if speculate is not None and speculate <= 1:
+            raise ValueError('speculate must be greater than one')
+        self.speculate = speculate
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            context = multiprocessing.get_context(start_method())
+            if context.get_start_method() == 'forkserver':
+                # Workers forked from the server inherit its imports
+                context.set_forkserver_preload([__name__])
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.worker_count,
+                mp_context=context,
+            )
+        return self._executor
+
+    @property
+    def worker_count(self):
+        if self.max_workers is not None:
+            return self.max_workers
+        if self.cpus is not None:
+            return math.ceil(self.cpus)
+        return os.cpu_count() or 1
+
+    def shutdown(self):
+        """Shutdown
+
+        Stop the worker processes. A new pool is started if the driver is used
+        again.
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+    def _exec(self,
+              graph,
+              entry_call,
+              function_images,
+              store_accessor,
+              failures=None):
+        assert nx.is_directed_acyclic_graph(graph)
+
+        store_token = hashlib.sha256(
+            pickle.dumps(store_accessor.store)
+        ).hexdigest()
+
+        remaining = {node: graph.in_degree(node) for node in graph.nodes}
+        ready = [node for node, count in remaining.items() if count == 0]
+        running = {}
+
+        # Calls waiting for a slot of their function, and calls holding a
+        # slot that wait for a free worker or for their rate limit, by
+        # function name
+        limits = Limits(function_images)
+        throttled = collections.defaultdict(collections.deque)
+        queued = collections.OrderedDict()
+
+        # Memory learned from the peaks recorded in earlier runs, and peaks
+        # measured in this run, by function name
+        learned = {}
+        if self.learn_resources:
+            for function_name in function_images:
+                peak = store_accessor.peak_memory(function_name)
+                if peak is not None:
+                    learned[function_name] = peak
+        peaks = {}
+        resources = Resources(
+            function_images,
+            memory=self.memory or machine_memory(),
+            cpus=self.cpus or self.worker_count,
+            learned=learned,
+        )
+
+        # Resources taken by running calls, their start times, and whether
+        # they claim the call, by future
+        taken = {}
+        started = {}
+        claims = {}
+
+        # Runtimes of functions, and calls with a backup running
+        stragglers = None
+        if self.speculate is not None:
+            stragglers = Stragglers(
+                function_images,
+                self.speculate,
+                recorded={
+                    name: store_accessor.runtimes(name)
+                    for name in function_images
+                },
+            )
+        backed_up = set()
+
+        def submit(node, resources_taken, send_image=False, claim=True):
+            func = function_images[node.function_name]
+            future = self.executor.submit(
+                run_and_store,
+                node,
+                (node.function_name, func.hash, store_token),
+                store_accessor.for_call(node),
+                func if send_image else None,
+                claim,
+            )
+            running[future] = node
+            taken[future] = resources_taken
+            started[future] = time.monotonic()
+            claims[future] = claim
+
+        def complete(node):
+            for successor in graph.successors(node):
+                remaining[successor] -= 1
+                if remaining[successor] == 0:
+                    ready.append(successor)
+
+        def release(node):
+            limits.release(node.function_name)
+            waiting = throttled[node.function_name]
+            if len(waiting) > 0:
+                ready.append(waiting.popleft())
+
+        def submit_queued():
+            """
+            Submit queued calls while there are free workers and resources,
+            taking turns between functions. Tasks are not queued in the
+            executor, so that calls start when their rate limit and resources
+            allow. Returns the time until the rate limit of a waiting function
+            allows a call, if any
+            """
+            timeout = None
+            submitted = True
+            while submitted and len(running) < self.worker_count:
+                submitted = False
+                for function_name, calls in list(queued.items()):
+                    if len(running) >= self.worker_count:
+                        break
+                    delay = limits.delay(function_name)
+                    if delay > 0:
+                        timeout = delay if timeout is None else min(
+                            timeout, delay
+                        )
+                        continue
+                    if not resources.fits(function_name):
+                        continue
+                    node = calls.popleft()
+                    if len(calls) == 0:
+                        del queued[function_name]
+                    logger.info('Submitting {}'.format(node))
+                    limits.start(function_name)
+                    submit(node, resources.take(function_name))
+                    submitted = True
+            return timeout
+
+        def back_up_stragglers():
+            """
+            Submit a backup of every straggling call, while there are free
+            workers and resources. Returns the time until the next running
+            call straggles, if any
+            """
+            timeout = None
+            now = time.monotonic()
+            for future, node in list(running.items()):
+                if node in backed_up:
+                    continue
+                threshold = stragglers.threshold(node.function_name)
+                if threshold is None:
+                    continue
+                left = started[future] + threshold - now
+                if left > 0:
+                    timeout = left if timeout is None else min(timeout, left)
+                    continue
+                if (len(running) >= self.worker_count or
+                        not resources.fits(node.function_name)):
+                    continue
+                logger.info('{} is straggling, submitting a backup'.format(
+                    node
+                ))
+                backed_up.add(node)
+                # The original call holds the lease on the call
+                submit(node, resources.take(node.function_name), claim=False)
+            return timeout
+
+        try:
+            while len(ready) > 0 or len(running) > 0 or len(queued) > 0:
+                while len(ready) > 0:
+                    node = ready.pop()
+                    func = function_images[node.function_name]
+
+                    # Do not rerun finished jobs. For example if a workflow
+                    # has been stopped and resumed.
+                    if store_accessor.completed(node, func.hash):
+                        logger.info('{} already completed'.format(node))
+                        complete(node)
+                        continue
+
+                    if limits.acquire(node.function_name):
+                        queued.setdefault(
+                            node.function_name, collections.deque()
+                        ).append(node)
+                    else:
+                        logger.debug('{} waiting for a slot'.format(node))
+                        throttled[node.function_name].append(node)
+
+                timeout = submit_queued()
+                if stragglers is not None:
+                    timeouts = [timeout, back_up_stragglers()]
+                    timeouts = [t for t in timeouts if t is not None]
+                    timeout = min(timeouts) if len(timeouts) > 0 else None
+                if len(running) == 0:
+                    # Only calls waiting for their rate limit are left, if
+                    # any. The last calls may have been completed elsewhere
+                    if timeout is not None:
+                        time.sleep(timeout)
+                    continue
+
+                done, _ = wait(
+                    running, timeout=timeout, return_when=FIRST_COMPLETED
+                )
+                for future in done:
+                    if future not in running:
+                        # A copy of a call that has already completed
+                        continue
+                    node = running.pop(future)
+                    resources_taken = taken.pop(future)
+                    start = started.pop(future)
+                    claim = claims.pop(future)
+                    copies = [
+                        copy for copy, call in running.items() if call == node
+                    ]
+                    try:
+                        executed, peak = future.result()
+                    except Exception as e:
+                        if len(copies) > 0:
+                            logger.warning(
+                                '{} failed with {}, waiting for its backup'
+                                .format(node, str(e))
+                            )
+                            resources.free(resources_taken)
+                            continue
+                        logger.error('{} failed with {}'.format(node, str(e)))
+                        if failures is None:
+                            raise
+                        # The successors of the call never become ready
+                        failures.fail(node, e)
+                        resources.free(resources_taken)
+                        backed_up.discard(node)
+                        release(node)
+                        continue
+
+                    if not executed:
+                        # The worker did not have the function image, send
+                        # it along with the task this time
+                        logger.debug('Sending function image with {}'.format(
+                            node
+                        ))
+                        submit(
+                            node,
+                            resources_taken,
+                            send_image=True,
+                            claim=claim,
+                        )
+                        continue
+
+                    logger.info('{} succeeded'.format(node))
+                    resources.free(resources_taken)
+                    for copy in copies:
+                        # The slower copy is left running in the background,
+                        # it stores the same result
+                        copy.cancel()
+                        del running[copy]
+                        del started[copy]
+                        del claims[copy]
+                        resources.free(taken.pop(copy))
+                    backed_up.discard(node)
+                    if stragglers is not None:
+                        stragglers.record(
+                            node.function_name, time.monotonic() - start
+                        )
+                    if self.learn_resources and peak is not None:
+                        resources.learn(node.function_name, peak)
+                        peaks[node.function_name] = max(
+                            peak, peaks.get(node.function_name, 0)
+                        )
+                    release(node)
+                    complete(node)
+        finally:
+            for future in running:
+                future.cancel()
+            for function_name, peak in peaks.items():
+                store_accessor.record_peak_memory(function_name, peak)
+            if stragglers is not None:
+                for function_name, runtimes in stragglers.new_runtimes.items():
+                    store_accessor.record_runtimes(function_name, runtimes)
+
+
+def start_method():
+    """Start method
+
+    Fork server style workers are preferred since they are cheap to start and
+    do not inherit the state of the driver process. Platforms that lack a fork
+    server fall back to spawning workers.
+
+    Returns
+    -------
+    str
+        Name of the multiprocessing start method to use for workers
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return 'forkserver'
+    return 'spawn'
+
+
+# Function images are cached by worker processes across runs. The cache is
+# keyed by function name, function hash and store, since the images reference
+# the store they were created for. The least recently used images are evicted
+# once the cache is full, and are sent again if they are needed.
+_function_images = collections.OrderedDict()
+
+
+def run_and_store(call,
+                  key,
+                  store_accessor,
+                  func=None,
+                  claim=True,
+                  cache_size=256):
+    """Run and store
+
+    Executed in worker processes. Runs a call and stores its result.
+
+    Parameters
+    ----------
+    call : CallNode
+        The call to execute
+    key : (str, bytes, str)
+        Function name, function hash and store identifier used to look up the
+        function image
+    store_accessor : StoreAccessor
+        Accessor for the store used to load arguments and store the result
+    func : FunctionImage, optional
+        The function image, only given if the worker is missing it
+    claim : bool, optional
+        Claim the call before executing it, in single flight mode. Backups of
+        straggling calls run without claiming
+    cache_size : int, optional
+        The largest number of function images cached by the worker
+
+    Returns
+    -------
+    (bool, int or None)
+        False if the function image was not available and the call was not
+        executed, True otherwise. Then the peak resident set size of the
+        worker during the call in bytes, if it could be measured
+    """
+    if func is not None:
+        while len(_function_images) >= cache_size:
+            _function_images.popitem(last=False)
+        _function_images[key] = func
+
+    try:
+        func = _function_images[key]
+    except KeyError:
+        return False, None
+    _function_images.move_to_end(key)
+
+    with contextlib.ExitStack() as stack:
+        if claim:
+            claimed = stack.enter_context(
+                store_accessor.claim(call, func.hash)
+            )
+            if not claimed:
+                return True, None
+        with peak_memory() as measurement:
+            args, kwargs = store_accessor.resolve_call_args(call)
+            with time_limit(func.options.get('timeout'), call):
+                result = run_to_completion(func(*args, **kwargs))
+            store_accessor.store_result(call, func.hash, result)
+    return True, measurement['peak']
@@ -1,7 +1,11 @@
 from .. import CallNode
+from ..limits import Limits
+from ..limits import time_limit
 from .driver import Driver
+from .driver import run_to_completion
 import logging
 import networkx as nx
+import time
 
 
 logger = logging.getLogger(__name__)
@@ -9,18 +13,34 @@ logger = logging.getLogger(__name__)
 
 class Sequential(Driver):
     """
-    Does a topological sort of the graph, and runs the jobs sequentially
+    Does a topological sort of the graph, and runs the jobs sequentially. Calls
+    run one at a time, so only rate limits of functions have any effect.
+    Timeouts of functions are only enforced when run from the main thread
     """
 
     def run_and_store(self, call, func, store_accessor):
-        args, kwargs = store_accessor.resolve_call_args(call)
-        result = func(*args, **kwargs)
-        store_accessor.store_result(call, func.hash, result)
+        with store_accessor.claim(call, func.hash) as claimed:
+            if not claimed:
+                logger.info('{} already completed'.format(call))
+                return
+            args, kwargs = store_accessor.resolve_call_args(call)
+            with time_limit(func.options.get('timeout'), call):
+                result = run_to_completion(func(*args, **kwargs))
+            store_accessor.store_result(call, func.hash, result)
 
-    def _exec(self, graph, entry_call, function_images, store_accessor):
+    def _exec(self,
+              graph,
+              entry_call,
+              function_images,
+              store_accessor,
+              failures=None):
         assert nx.is_directed_acyclic_graph(graph)
 
         schedule = list(nx.topological_sort(graph))
+        limits = Limits(function_images)
+
+        # Calls that failed, or depend on a failed call, in keep going mode
+        blocked = set()
 
         for node in schedule:
             if not isinstance(node, CallNode):
@@ -34,6 +54,14 @@ class Sequential(Driver):
                 logger.info('{} already completed'.format(node))
                 continue
 
+            if any(pred in blocked for pred in graph.predecessors(node)):
+                logger.info('{} skipped due to failed dependency'.format(node))
+                blocked.add(node)
+                continue
+
+            limits.acquire(node.function_name)
+            time.sleep(limits.delay(node.function_name))
+            limits.start(node.function_name)
             logger.info('Running {}'.format(node))
             try:
                 self.run_and_store(node, func, store_accessor)
@@ -41,7 +69,11 @@ class Sequential(Driver):
                 logger.error(
                     '{} failed with {}'.format(node, str(e))
                 )
-                raise
+                if failures is None:
+                    raise
+                failures.fail(node, e)
+                blocked.add(node)
+                continue
+            finally:
+                limits.release(node.function_name)
             logger.info('{} succeeded'.format(node))
-
-        return store_accessor.load_result(entry_call)
@@ -2,6 +2,16 @@ class ContextError(Exception):
     pass
 
 
+class CallTimeoutError(TimeoutError):
+    pass
+
+
+class CallsFailedError(Exception):
+    def __init__(self, report):
+        super().__init__(str(report))
+        self.report = report
+
+
 class CopyError(Exception):
     pass
 
@@ -14,6 +24,15 @@ class FunctionError(Exception):
     pass
 
 
+class KnownFailureError(Exception):
+    def __init__(self, failure):
+        super().__init__(failure)
+        self.failure = failure
+
+    def __str__(self):
+        return str(self.failure)
+
+
 class NotDAGError(Exception):
     pass
 
@@ -1,5 +1,8 @@
 from .blueprint import Blueprint
+from .errors import XunSyntaxError
 from .function_description import describe
+from .limits import parse_memory
+from .limits import parse_rate
 from . import transformations
 import hashlib
 import astor
@@ -18,7 +21,11 @@ class Function:
         The function name
     dependencies : mapping of function name to Function
         Dict holding the xun functions this one is dependent on
-
+    options : dict
+        Options telling drivers how to execute calls to this function
+    lazy : bool
+        If true, lists and tuples of results used by the body are loaded as
+        they are accessed
 
     Methods
     -------
@@ -85,10 +92,17 @@ class Function:
         def source_str(self):
             return astor.to_source(self.source)
 
-    def __init__(self, desc, dependencies, max_parallel):
+    def __init__(self,
+                 desc,
+                 dependencies,
+                 max_parallel,
+                 options=None,
+                 lazy=False):
         self.desc = desc
         self.dependencies = dependencies
         self.max_parallel = max_parallel
+        self.options = options if options is not None else {}
+        self.lazy = lazy
         self.hash = Function.sha256(desc, dependencies)
         self._graph_builder = None
         self.code = self.FunctionCode(self)
@@ -123,7 +137,15 @@ class Function:
         return sha256
 
     @staticmethod
-    def from_function(func, max_parallel=None):
+    def from_function(func,
+                      max_parallel=None,
+                      queue=None,
+                      batch_size=None,
+                      rate_limit=None,
+                      memory=None,
+                      cpus=None,
+                      timeout=None,
+                      lazy=False):
         """From Function
 
         Creates a xun function from a python function
@@ -132,24 +154,65 @@ class Function:
         ----------
         func : python function
             The function definition to create the xun function from
-        max_parallel : int
-            The maximum parallel jobs allowed for this function
+        max_parallel : int, optional
+            The maximum number of calls to this function executing at the same
+            time
+        queue : str, optional
+            The queue calls to this function are routed to, for drivers that
+            support routing
+        batch_size : int, optional
+            Calls to this function that become ready together are executed in
+            batches of this size
+        rate_limit : int, float, or str, optional
+            The maximum rate of calls to this function, in calls per second or
+            as a string such as `'100/m'`
+        memory : int or str, optional
+            The memory a call to this function is expected to use, in bytes or
+            as a string such as `'2G'`
+        cpus : int or float, optional
+            The number of processors a call to this function is expected to
+            use
+        timeout : int or float, optional
+            Seconds after which a call to this function fails
+        lazy : bool, optional
+            Load lists and tuples of results used by the body as they are
+            accessed
 
         Returns
         -------
         Function
             The `Function` representation of the given function
         """
-        if max_parallel is not None:
-            msg = 'Limiting parallel execution not yet implemented'
-            raise NotImplementedError(msg)
-
         desc = describe(func)
         dependencies = {
             g.name: g for g in desc.globals.values() if isinstance(g, Function)
         }
 
-        f = Function(desc, dependencies, max_parallel)
+        options = {}
+        if queue is not None:
+            options['queue'] = queue
+        if batch_size is not None:
+            if batch_size < 1:
+                raise ValueError('batch_size must be positive')
+            options['batch_size'] = batch_size
+        if max_parallel is not None:
+            if max_parallel < 1:
+                raise ValueError('max_parallel must be positive')
+            options['max_parallel'] = max_parallel
+        if rate_limit is not None:
+            options['rate_limit'] = parse_rate(rate_limit)
+        if memory is not None:
+            options['memory'] = parse_memory(memory)
+        if cpus is not None:
+            if cpus <= 0:
+                raise ValueError('cpus must be positive')
+            options['cpus'] = cpus
+        if timeout is not None:
+            if timeout <= 0:
+                raise ValueError('timeout must be positive')
+            options['timeout'] = timeout
+
+        f = Function(desc, dependencies, max_parallel, options, lazy)
 
         # Add f to it's dependencies, to allow recursive dependencies
         f.dependencies[f.name] = f
@@ -195,7 +258,11 @@ class Function:
                 .apply(transformations.build_xun_graph, self.dependencies)
             )
 
-            self._graph_builder = decomposed.assemble(decomposed.xun_graph)
+            # Graphs are built synchronously, also for async functions
+            self._graph_builder = decomposed.assemble(
+                decomposed.xun_graph,
+                coroutine=False,
+            )
         return self._graph_builder
 
     def graph(self, *args, **kwargs):
@@ -232,7 +299,8 @@ class Function:
         Returns
         -------
         FunctionImage
-            Serializable callable function image
+            Serializable callable function image. If this function is defined
+            with `async def`, calling the image returns a coroutine
 
         See Also
         --------
@@ -242,7 +310,11 @@ class Function:
             .apply(transformations.separate_constants)
             .apply(transformations.sort_constants)
             .apply(transformations.copy_only_constants, self.dependencies)
-            .apply(transformations.load_from_store, self.dependencies)
+            .apply(
+                transformations.load_from_store,
+                self.dependencies,
+                self.lazy,
+            )
         )
 
         f = decomp.assemble(decomp.load_from_store, decomp.body)
@@ -258,15 +330,65 @@ class Function:
 
         f.globals = new_globals
         f.hash = self.hash
+        f.source_hash = Function.sha256(self.desc, {})
+        f.options = dict(self.options)
 
         return f
 
 
-def function(max_parallel=None):
+def function(max_parallel=None,
+             queue=None,
+             batch_size=None,
+             rate_limit=None,
+             memory=None,
+             cpus=None,
+             timeout=None,
+             lazy=False):
     """xun.function
 
     Function decorator used to create xun functions from python functions
 
+    Parameters
+    ----------
+    max_parallel : int, optional
+        The maximum number of calls to this function executing at the same
+        time. Calls to other functions keep running while this function is at
+        its limit
+    queue : str, optional
+        The queue calls to this function are routed to, for drivers that
+        support routing, such as the Celery driver. This allows running
+        dedicated pools of workers for some functions
+    batch_size : int, optional
+        Calls to this function that become ready at the same time, such as
+        the calls of a fan-out, are executed in batches of up to this many
+        calls per task. This saves scheduling overhead for short calls. The
+        result of each call is still stored separately
+    rate_limit : int, float, or str, optional
+        The maximum rate of calls to this function, in calls per second or as a
+        string of calls per second, minute, or hour such as `'100/m'`. Calls
+        are spaced evenly. Like `max_parallel`, this protects external
+        services from wide fan-outs without serialising the whole workflow
+    memory : int or str, optional
+        The memory a call to this function is expected to use, in bytes or as
+        a string such as `'512M'` or `'2G'`. Local drivers given a memory
+        budget only run as many calls together as fit in the budget
+    cpus : int or float, optional
+        The number of processors a call to this function is expected to use,
+        one by default. Local drivers pack calls against their processor
+        budget
+    timeout : int or float, optional
+        Seconds after which a call to this function fails with a
+        `CallTimeoutError`, so that a hung call does not stall the workflow.
+        Enforced by all drivers except Dask. Calls to synchronous functions
+        on the Asyncio driver keep running in the background after failing
+    lazy : bool, optional
+        By default, the results used by the body are loaded before it runs.
+        If true, lists and tuples of results, such as the results of a list
+        comprehension of calls, are loaded as they are accessed instead. The
+        body is given a read-only sequence, `LazyResults`, that loads a few
+        results ahead while it is iterated. The memory used by a large
+        fan-in is then bounded by what the body holds on to
+
     Examples
     --------
 
@@ -298,5 +420,107 @@ def function(max_parallel=None):
         xun function created from the decorated function
     """
     def decorator(func):
-        return Function.from_function(func, max_parallel)
+        return Function.from_function(
+            func,
+            max_parallel,
+            queue,
+            batch_size,
+            rate_limit,
+            memory,
+            cpus,
+            timeout,
+            lazy,
+        )
     return decorator
+
+
+def map(func, items, chunk_size=None):
+    """xun.map
+
+    Map a xun function over items, calling it once for every item. Used in with
+    constants statements, in place of a list comprehension of calls. Instead of
+    one node per call, the call graph holds one node per chunk of calls, which
+    keeps large maps cheap to plan. Drivers run the chunks in parallel, and the
+    result of every call is stored separately. The result of the map is a
+    sequence, loading each result as it is accessed.
+
+    Parameters
+    ----------
+    func : Function
+        The xun function to map, referenced by name
+    items : iterable
+        The arguments, one per call
+    chunk_size : int, optional
+        The number of calls per chunk. By default the calls are split into at
+        most 1000 chunks
+
+    Examples
+    --------
+
+    >>> @xun.function()
+    ... def square(i):
+    ...     return i * i
+    ...
+    >>> @xun.function()
+    ... def sum_of_squares(n):
+    ...     return sum(squares)
+    ...     with ...:
+    ...         squares = xun.map(square, range(n))
+    ...
+    >>> sum_of_squares.blueprint(4).run(
+    ...     driver=xun.functions.driver.Sequential(),
+    ...     store=xun.functions.store.Memory(),
+    ... )
+    14
+    """
+    msg = 'xun.map can only be used in with constants statements'
+    raise XunSyntaxError(msg)
+
+
+def reduce(func, items, fan_in=8):
+    """xun.reduce
+
+    Reduce items with a xun function taking two values and returning one, like
+    `functools.reduce`. Used in with constants statements, in place of a
+    single call taking all the items. The reduction is a balanced tree of
+    calls, each combining up to `fan_in` items or partial results, so that
+    partial reductions run in parallel close to their inputs, and no call
+    loads more than `fan_in` values. The function must be associative, and
+    cannot call xun functions itself.
+
+    Parameters
+    ----------
+    func : Function
+        The xun function combining two values, referenced by name
+    items : iterable
+        The values to reduce, typically results of other xun functions or the
+        result of `xun.map`
+    fan_in : int, optional
+        The largest number of values combined by one call of the tree, at
+        least 2
+
+    Examples
+    --------
+
+    >>> @xun.function()
+    ... def add(a, b):
+    ...     return a + b
+    ...
+    >>> @xun.function()
+    ... def square(i):
+    ...     return i * i
+    ...
+    >>> @xun.function()
+    ... def sum_of_squares(n):
+    ...     return total
+    ...     with ...:
+    ...         total = xun.reduce(add, xun.map(square, range(n)), fan_in=2)
+    ...
+    >>> sum_of_squares.blueprint(4).run(
+    ...     driver=xun.functions.driver.Sequential(),
+    ...     store=xun.functions.store.Memory(),
+    ... )
+    14
+    """
+    msg = 'xun.reduce can only be used in with constants statements'
+    raise XunSyntaxError(msg)
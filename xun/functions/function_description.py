@@ -51,7 +51,7 @@ def describe(func):
     is_single_function_module = (
         isinstance(tree, ast.Module)
         and len(tree.body) == 1
-        and isinstance(tree.body[0], ast.FunctionDef)
+        and isinstance(tree.body[0], (ast.FunctionDef, ast.AsyncFunctionDef))
     )
 
     if not is_single_function_module:
@@ -1,3 +1,4 @@
+from .compatibility import ast
 from .function_description import describe
 import importlib
 
@@ -28,6 +29,13 @@ class FunctionImage:
     referenced_modules : dict
         The dict keys are the names used by the function, while the values are
         actual module names.
+    options : dict
+        Options telling drivers how to execute the function, such as the queue
+        to route calls to. Options do not affect the hash
+    source_hash : bytes
+        Hash of the source of the function alone, unlike `hash` it does not
+        change with the functions it depends on. None for functions that are
+        not xun functions
     _func : function
         Cached compiled function. _func is not pickled.
 
@@ -69,6 +77,8 @@ class FunctionImage:
         self.globals = globals
         self.referenced_modules = referenced_modules
         self.hash = hash
+        self.options = {}
+        self.source_hash = None
         self._func = None
 
     @staticmethod
@@ -118,6 +128,14 @@ class FunctionImage:
             hash=hash,
         )
 
+    @property
+    def is_coroutine_function(self):
+        """
+        True if the represented function is defined with `async def`, calling
+        it then returns a coroutine
+        """
+        return isinstance(self.tree.body[0], ast.AsyncFunctionDef)
+
     def compile(self):
         """Compile
 
@@ -163,6 +181,8 @@ class FunctionImage:
             self.globals,
             self.referenced_modules,
             self.hash,
+            self.options,
+            self.source_hash,
         )
 
     def __setstate__(self, state):
@@ -175,6 +195,9 @@ class FunctionImage:
         self.globals = state[2]
         self.referenced_modules = state[3]
         self.hash = state[4]
+        # Images pickled by earlier versions have no options or source hash
+        self.options = state[5] if len(state) > 5 else {}
+        self.source_hash = state[6] if len(state) > 6 else None
         self._func = None
 
 
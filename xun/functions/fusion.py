@@ -0,0 +1,537 @@
+from .driver.driver import run_to_completion
+from .graph import CallNode
+from .graph import MapNode
+from .graph import ReduceNode
+from .limits import TokenBucket
+from .store import StoreAccessor
+from .store import preloaded_results
+from .store.store_accessor import BATCHED_PREFIX
+from .store.store_accessor import FUSED_NAME
+import copy
+import functools
+import hashlib
+import networkx as nx
+import pickle
+import time
+
+
+class FusedCalls:
+    """FusedCalls
+
+    Function image of fused calls. Calls to it take a tuple of calls, such as
+    a chain in the call graph or a batch of calls to one function, and runs
+    them one after the other in the same task. The result of each call is
+    stored, and handed directly to the calls after it. Calls that are already
+    completed are skipped. Calls to functions with a rate limit are spaced
+    evenly at that rate, rather than run in a burst.
+
+    The hash covers the name of the image, the hashes of the fused functions,
+    and the elements stored separately, so that differently configured
+    images, such as the batches and the map chunks of a function, never share
+    a hash.
+
+    Parameters
+    ----------
+    function_images : dict
+        Function images by function name, of the functions of the fused calls
+    store : Store
+        The store results are written to
+    name : str, optional
+        The function name used for calls to this image
+    options : dict, optional
+        Options telling drivers how to execute calls to this image
+    elements : dict, optional
+        Subscripts of the elements stored separately, by call. Only those of
+        calls to the fused functions are kept
+
+    See Also
+    --------
+    fuse_chains : Fuse the chains of a call graph
+    batch_calls : Batch calls to functions with a batch size
+    """
+
+    name = FUSED_NAME
+    is_coroutine_function = False
+    source_hash = None
+
+    def __init__(self,
+                 function_images,
+                 store,
+                 name=None,
+                 options=None,
+                 elements=None):
+        if elements is not None:
+            elements = {
+                call: subscripts for call, subscripts in elements.items()
+                if call.function_name in function_images
+            }
+        self.function_images = function_images
+        self.store_accessor = StoreAccessor(store, elements=elements)
+        if name is not None:
+            self.name = name
+        self.hash = hashlib.sha256(b''.join((
+            self.name.encode(),
+            *(
+                function_images[function_name].hash
+                for function_name in sorted(function_images)
+            ),
+            elements_digest(elements),
+        ))).digest()
+        self.options = options if options is not None else {}
+
+    def for_call(self, call):
+        """
+        The image sent with the task executing a call, holding only the
+        elements of the calls it runs
+        """
+        image = copy.copy(self)
+        image.store_accessor = self.store_accessor.for_call(call)
+        return image
+
+    def __call__(self, calls):
+        results = {}
+        buckets = {}
+        for call in calls:
+            func = self.function_images[call.function_name]
+            if self.store_accessor.completed(call, func.hash):
+                continue
+            rate_limit = func.options.get('rate_limit')
+            if rate_limit is not None:
+                bucket = buckets.setdefault(
+                    call.function_name, TokenBucket(rate_limit)
+                )
+                time.sleep(bucket.reserve())
+            with preloaded_results(results):
+                args, kwargs = self.store_accessor.resolve_call_args(call)
+                result = run_to_completion(func(*args, **kwargs))
+            self.store_accessor.store_result(call, func.hash, result)
+            results[call] = result
+
+
+class MappedCalls(FusedCalls):
+    """MappedCalls
+
+    Function image of the chunks of maps of a function. Calls to it take the
+    items of a chunk, and run the call of the mapped function for each item.
+
+    Parameters
+    ----------
+    function_name : str
+        Name of the mapped function
+    function_images : dict
+        Function images by function name
+    store : Store
+        The store results are written to
+    chunk_size : int, optional
+        The largest number of calls in a chunk
+    elements : dict, optional
+        Subscripts of the elements stored separately, by call
+
+    See Also
+    --------
+    xun.map : Map a xun function over items
+    """
+
+    def __init__(self,
+                 function_name,
+                 function_images,
+                 store,
+                 chunk_size=1,
+                 elements=None):
+        func = function_images[function_name]
+        super().__init__(
+            {function_name: func},
+            store,
+            name=MapNode.chunk_prefix + function_name,
+            options=task_options(func.options, chunk_size),
+            elements=elements,
+        )
+        self.function_name = function_name
+
+    def __call__(self, items):
+        return super().__call__(
+            CallNode(self.function_name, item) for item in items
+        )
+
+
+class ReducedCalls:
+    """ReducedCalls
+
+    Function image of the calls of reduction trees of a function. Calls to it
+    take the digest of their reduction, their level and index in the tree,
+    and the values or partial results to combine, and reduce the values with
+    the function, two at a time. The hash is derived from that of the
+    reducing function, so that the results of the trees can be loaded knowing
+    only the function.
+
+    Parameters
+    ----------
+    function_name : str
+        Name of the reducing function
+    function_images : dict
+        Function images by function name
+    fan_in : int, optional
+        The largest number of values combined by a call
+
+    See Also
+    --------
+    xun.reduce : Reduce items with a xun function
+    """
+
+    is_coroutine_function = False
+    source_hash = None
+
+    def __init__(self, function_name, function_images, fan_in=2):
+        self.func = function_images[function_name]
+        self.name = ReduceNode.prefix + function_name
+        self.hash = ReduceNode.tree_hash(self.func.hash)
+        self.options = task_options(self.func.options, max(1, fan_in - 1))
+
+    def __call__(self, digest, level, index, *values):
+        return functools.reduce(
+            lambda a, b: run_to_completion(self.func(a, b)), values
+        )
+
+
+def map_chunks(graph, function_images, store, elements=None):
+    """Map chunks
+
+    Add the function images needed to execute the chunks of the maps in a call
+    graph
+
+    Parameters
+    ----------
+    graph : nx.DiGraph
+        The call graph
+    function_images : dict
+        Function images by function name
+    store : Store
+        The store results are written to
+    elements : dict, optional
+        Subscripts of the elements stored separately, by call
+
+    Returns
+    -------
+    (nx.DiGraph, dict)
+        The call graph, and the function images needed to execute it
+    """
+    chunk_sizes = {}
+    for node in graph.nodes:
+        if not isinstance(node, CallNode):
+            continue
+        function_name = MapNode.mapped_function_name(node)
+        if function_name is not None:
+            chunk_sizes[function_name] = max(
+                chunk_sizes.get(function_name, 1), len(node.args[0])
+            )
+    if len(chunk_sizes) == 0:
+        return graph, function_images
+
+    images = dict(function_images)
+    for function_name, chunk_size in chunk_sizes.items():
+        image = MappedCalls(
+            function_name,
+            function_images,
+            store,
+            chunk_size,
+            elements=elements,
+        )
+        images[image.name] = image
+    return graph, images
+
+
+def reduce_trees(graph, function_images):
+    """Reduce trees
+
+    Add the function images needed to execute the reduction trees in a call
+    graph
+
+    Parameters
+    ----------
+    graph : nx.DiGraph
+        The call graph
+    function_images : dict
+        Function images by function name
+
+    Returns
+    -------
+    (nx.DiGraph, dict)
+        The call graph, and the function images needed to execute it
+    """
+    fan_ins = {}
+    for node in graph.nodes:
+        if not isinstance(node, CallNode):
+            continue
+        function_name = ReduceNode.reduced_function_name(node)
+        if function_name is not None:
+            # Calls at the leaves take the values they combine, after their
+            # digest, level and index, other calls take their predecessors
+            fan_ins[function_name] = max(
+                fan_ins.get(function_name, 2),
+                len(node.args) - 3,
+                graph.in_degree(node),
+            )
+    if len(fan_ins) == 0:
+        return graph, function_images
+
+    images = dict(function_images)
+    for function_name, fan_in in fan_ins.items():
+        image = ReducedCalls(function_name, function_images, fan_in)
+        images[image.name] = image
+    return graph, images
+
+
+def fuse_chains(graph, function_images, store, elements=None):
+    """Fuse chains
+
+    Replace linear chains of calls in a call graph by single calls to
+    `FusedCalls`. A call is chained to its successor if it has no other
+    successors, and the successor has no other predecessors. Calls to
+    functions with options, such as a queue, are not fused, nor are the calls
+    of reduction trees, which are given their inputs by the driver.
+
+    Parameters
+    ----------
+    graph : nx.DiGraph
+        The call graph
+    function_images : dict
+        Function images by function name
+    store : Store
+        The store results are written to
+    elements : dict, optional
+        Subscripts of the elements stored separately, by call
+
+    Returns
+    -------
+    (nx.DiGraph, dict)
+        The fused call graph, and the function images needed to execute it
+    """
+    def fusable(node):
+        return (isinstance(node, CallNode)
+            and ReduceNode.reduced_function_name(node) is None
+            and len(function_images[node.function_name].options) == 0)
+
+    def chained(node):
+        if not fusable(node) or graph.out_degree(node) != 1:
+            return False
+        successor = next(iter(graph.successors(node)))
+        return fusable(successor) and graph.in_degree(successor) == 1
+
+    replacements = {}
+    for node in nx.topological_sort(graph):
+        if any(chained(pred) for pred in graph.predecessors(node)):
+            continue
+        chain = [node]
+        while chained(chain[-1]):
+            chain.append(next(iter(graph.successors(chain[-1]))))
+        if len(chain) > 1:
+            fused = CallNode(FusedCalls.name, tuple(chain))
+            replacements.update((call, fused) for call in chain)
+
+    if len(replacements) == 0:
+        return graph, function_images
+
+    fused_images = dict(function_images)
+    fused_images[FusedCalls.name] = FusedCalls(
+        function_images, store, elements=elements
+    )
+
+    return replace_nodes(graph, replacements), fused_images
+
+
+def batch_calls(graph, function_images, store, elements=None):
+    """Batch calls
+
+    Replace calls to functions with the `batch_size` option by calls to
+    `FusedCalls`, each running a batch of up to `batch_size` calls. Calls are
+    batched by readiness level, the length of the longest path of calls
+    leading to them, so calls batched together cannot depend on each other.
+    Calls left alone in their batch are not replaced. The results are still
+    stored per call.
+
+    Parameters
+    ----------
+    graph : nx.DiGraph
+        The call graph
+    function_images : dict
+        Function images by function name
+    store : Store
+        The store results are written to
+    elements : dict, optional
+        Subscripts of the elements stored separately, by call
+
+    Returns
+    -------
+    (nx.DiGraph, dict)
+        The batched call graph, and the function images needed to execute it
+    """
+    groups = {}
+    levels = {}
+    for node in nx.topological_sort(graph):
+        levels[node] = max(
+            (levels[pred] + 1 for pred in graph.predecessors(node)),
+            default=0,
+        )
+        if not isinstance(node, CallNode):
+            continue
+        func = function_images[node.function_name]
+        if func.options.get('batch_size') is None:
+            continue
+        key = node.function_name, levels[node]
+        groups.setdefault(key, []).append(node)
+
+    replacements = {}
+    batched_images = dict(function_images)
+    for (function_name, _), calls in groups.items():
+        func = function_images[function_name]
+        batch_size = func.options['batch_size']
+        batch_name = BATCHED_PREFIX + function_name
+        if len(calls) == 1 or batch_size == 1:
+            continue
+        if batch_name not in batched_images:
+            batched_images[batch_name] = FusedCalls(
+                {function_name: func},
+                store,
+                name=batch_name,
+                options=task_options(func.options, batch_size),
+                elements=elements,
+            )
+        for i in range(0, len(calls), batch_size):
+            batch = tuple(calls[i:i + batch_size])
+            if len(batch) == 1:
+                continue
+            batched = CallNode(batch_name, batch)
+            replacements.update((call, batched) for call in batch)
+
+    if len(replacements) == 0:
+        return graph, function_images
+
+    return replace_nodes(graph, replacements), batched_images
+
+
+def separate_elements(graph):
+    """Separate elements
+
+    Subscripted calls, such as the elements of unpacked results, are nodes of
+    their own in the call graph, and are executed as calls of their own.
+    Replace them by the calls they subscript, so that each call is executed
+    once, and collect their subscripts. The elements at these subscripts are
+    stored separately with the results of the calls.
+
+    Parameters
+    ----------
+    graph : nx.DiGraph
+        The call graph
+
+    Returns
+    -------
+    (nx.DiGraph, dict)
+        The call graph without subscripted calls, and the set of subscripts
+        by call
+
+    Examples
+    --------
+
+    >>> graph, elements = separate_elements(graph)
+    >>> elements
+    {CallNode('f'): {(0,), (1, 1)}}
+    """
+    replacements = {}
+    elements = {}
+    for node in graph.nodes:
+        if not isinstance(node, CallNode) or len(node.subscript) == 0:
+            continue
+        call = node._replace(subscript=())
+        replacements[node] = call
+        elements.setdefault(call, set()).add(node.subscript)
+
+    if len(replacements) == 0:
+        return graph, elements
+
+    return replace_nodes(graph, replacements), elements
+
+
+def elements_digest(elements):
+    """Elements digest
+
+    A digest of the subscripts of the elements stored separately, that does
+    not depend on the order of the calls and subscripts
+
+    Parameters
+    ----------
+    elements : dict or None
+        Subscripts of the elements stored separately, by call
+
+    Returns
+    -------
+    bytes
+        The digest, empty if elements are not stored separately
+    """
+    if elements is None:
+        return b''
+    return hashlib.sha256(pickle.dumps(sorted(
+        (pickle.dumps(call), sorted(pickle.dumps(s) for s in subscripts))
+        for call, subscripts in elements.items()
+    ))).digest()
+
+
+def task_options(options, calls_per_task):
+    """Task options
+
+    The options of tasks running several calls to a function, such as batches
+    and chunks of maps. Calls in a task run one at a time, so the parallel
+    limit of the function applies to the tasks as is, while the rate limit is
+    divided, and the timeout multiplied, by the number of calls per task.
+    Tasks space their calls at the rate limit, so the timeout also covers the
+    time waited between calls.
+
+    Parameters
+    ----------
+    options : dict
+        The options of the function
+    calls_per_task : int
+        The largest number of calls in a task
+
+    Returns
+    -------
+    dict
+        The options of the tasks
+    """
+    options = {
+        key: value for key, value in options.items() if key != 'batch_size'
+    }
+    rate_limit = options.get('rate_limit')
+    if rate_limit is not None:
+        options['rate_limit'] = rate_limit / calls_per_task
+    if options.get('timeout') is not None:
+        options['timeout'] = options['timeout'] * calls_per_task
+        if rate_limit is not None:
+            options['timeout'] += (calls_per_task - 1) / rate_limit
+    return options
+
+
+def replace_nodes(graph, replacements):
+    """Replace nodes
+
+    Parameters
+    ----------
+    graph : nx.DiGraph
+        The call graph
+    replacements : mapping of CallNode to CallNode
+        The node replacing each replaced node. Several nodes may be replaced
+        by the same node
+
+    Returns
+    -------
+    nx.DiGraph
+        A graph with the nodes replaced, and edges between replaced nodes
+        removed
+    """
+    replaced = nx.DiGraph()
+    replaced.add_nodes_from(replacements.get(n, n) for n in graph.nodes)
+    replaced.add_edges_from(
+        (replacements.get(u, u), replacements.get(v, v))
+        for u, v in graph.edges
+        if replacements.get(u, u) != replacements.get(v, v)
+    )
+    return replaced
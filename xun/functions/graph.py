@@ -1,6 +1,16 @@
-import networkx as nx
 from .errors import CopyError
 from .errors import NotDAGError
+from collections import OrderedDict
+from collections import deque
+from collections.abc import Sequence
+import concurrent.futures
+import contextvars
+import hashlib
+import itertools
+import networkx as nx
+import pickle
+import sys
+import threading
 
 
 def sink_nodes(dag):
@@ -34,6 +44,19 @@ class CallNode:
     disallowed. This is because the value a CallNode represents is not known
     until execution and can therefore not be used.
 
+    Arguments whose pickles are larger than `intern_threshold` bytes are
+    interned. They are replaced by an `InternedArgument` identifying them by
+    the digest of their pickle, and are stored once in the store when the
+    call graph is run. Calls to the internal functions of xun, whose names
+    start with `_xun_`, keep their arguments.
+
+    Interned arguments are compared by their pickles rather than by value.
+    Large arguments that are equal but pickle differently, such as
+    `(1,) * N` and `(1.0,) * N`, or dicts with their keys in different
+    orders, make different calls, and their results are stored under
+    different keys. Setting `intern_threshold` to `math.inf` disables
+    interning.
+
     Attributes
     ----------
     function_name : str
@@ -43,9 +66,17 @@ class CallNode:
     kwargs : mapping of str to arguments
         the keyword arguments of this call
     """
+
+    intern_threshold = 16 * 1024
+
     def __init__(self, function_name, *args, **kwargs):
         self.function_name = function_name
         self.subscript = ()
+        if not function_name.startswith('_xun_'):
+            args = tuple(intern_argument(arg) for arg in args)
+            kwargs = {
+                key: intern_argument(arg) for key, arg in kwargs.items()
+            }
         self.args = args
         self.kwargs = kwargs
 
@@ -68,12 +99,22 @@ class CallNode:
             return False
 
     def __hash__(self):
-        return hash((
-            self.function_name,
-            self.subscript,
-            tuple(self.args),
-            frozenset(self.kwargs.items())
-        ))
+        # Calls can take other calls as arguments, as in reduction trees, where
+        # hashing would otherwise recurse through the whole tree every time.
+        # String hashes differ between processes, so the hash is not pickled
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = hash((
+                self.function_name,
+                self.subscript,
+                tuple(self.args),
+                frozenset(self.kwargs.items())
+            ))
+            return self._hash
+
+    def __getstate__(self):
+        return {k: v for k, v in vars(self).items() if k != '_hash'}
 
     def __repr__(self):
         args = [repr(self.function_name)]
@@ -101,7 +142,9 @@ class CallNode:
         -------
         A new CallNode with replaced attributes
         """
-        attribs = {k: kwargs.pop(k, v) for k, v in vars(self).items()}
+        attribs = {
+            k: kwargs.pop(k, v) for k, v in self.__getstate__().items()
+        }
         if kwargs:
             raise ValueError(f'Got unexpected field names: {list(kwargs)!r}')
         inst = CallNode.__new__(CallNode)
@@ -144,3 +187,562 @@ class CallNode:
             else:
                 raise TypeError("Invalid content in shape tuple")
         return output
+
+
+class InternedArgument:
+    """InternedArgument
+
+    Stands in for a large argument in CallNodes. The argument is identified by
+    the digest of its pickled content, so that the CallNode stays cheap to
+    hash, compare, pickle, and send to workers, and small as a key in the
+    store. The argument itself is kept in the process that interned it, and
+    is stored once in the store under `store / 'arguments'` when the call
+    graph is run.
+
+    Attributes
+    ----------
+    digest : bytes
+        SHA256 digest of the pickled argument
+    size : int
+        Size of the pickled argument in bytes
+
+    Methods
+    -------
+    load(store_accessor)
+        The argument, loaded from the store unless it is kept in the process
+    """
+
+    def __init__(self, value, pickled):
+        self.digest = hashlib.sha256(pickled).digest()
+        self.size = len(pickled)
+        self._value = value
+        self._kept = True
+
+    @property
+    def kept(self):
+        """
+        True if the argument is kept in this process
+        """
+        return self._kept
+
+    @property
+    def value(self):
+        if not self._kept:
+            raise ValueError('Interned argument is not kept in this process')
+        return self._value
+
+    def load(self, store_accessor):
+        if not self._kept:
+            self._value = store_accessor.load_argument(self.digest)
+            self._kept = True
+        return self._value
+
+    def __eq__(self, other):
+        try:
+            return self.digest == other.digest
+        except AttributeError:
+            return False
+
+    def __hash__(self):
+        return hash(self.digest)
+
+    def __getstate__(self):
+        return self.digest, self.size
+
+    def __setstate__(self, state):
+        self.digest, self.size = state
+        self._value = None
+        self._kept = False
+
+    def __repr__(self):
+        return 'InternedArgument({}, {} bytes)'.format(
+            self.digest.hex()[:12], self.size
+        )
+
+
+# Arguments interned most recently, by id. The arguments are held, so that
+# their ids are not reused
+_interned = OrderedDict()
+_interned_lock = threading.Lock()
+
+
+def intern_argument(arg):
+    """Intern argument
+
+    Returns an `InternedArgument` for an argument whose pickle is larger
+    than `CallNode.intern_threshold` bytes, and the argument itself
+    otherwise. Numbers are never interned, and strings and bytes are
+    measured without pickling them. Sets, whose pickles depend on the hash
+    seed of the process, and arguments that cannot be pickled are not
+    interned. The digest of an argument is computed once for arguments
+    interned recently.
+    """
+    if isinstance(arg, (CallNode, MapNode, ReduceNode, InternedArgument,
+                        set, frozenset, int, float, complex, type(None))):
+        return arg
+    if (isinstance(arg, (str, bytes))
+            and sys.getsizeof(arg) < CallNode.intern_threshold):
+        return arg
+
+    with _interned_lock:
+        recent = _interned.get(id(arg))
+        if recent is not None and recent[0] is arg:
+            _interned.move_to_end(id(arg))
+            return recent[1]
+
+    try:
+        pickled = pickle.dumps(arg)
+    except Exception:
+        return arg
+    if len(pickled) < CallNode.intern_threshold:
+        return arg
+    interned = InternedArgument(arg, pickled)
+
+    with _interned_lock:
+        _interned[id(arg)] = arg, interned
+        while len(_interned) > 64:
+            _interned.popitem(last=False)
+    return interned
+
+
+def unintern(arg):
+    """Unintern
+
+    The value of an argument of a CallNode, the argument itself unless it is
+    interned
+    """
+    if isinstance(arg, InternedArgument):
+        return arg.value
+    return arg
+
+
+class MapNode:
+    """MapNode
+
+    Representation of a function mapped over items, created by `xun.map`. Each
+    item is the argument of a call to the function. Instead of one CallNode per
+    call, the call graph holds one CallNode per chunk of items, so that large
+    maps stay cheap to plan. The result of each call is still stored under its
+    own CallNode.
+
+    Like CallNodes, MapNodes are sentinel values during scheduling, and cannot
+    be copied.
+
+    Attributes
+    ----------
+    function_name : str
+        name of the mapped function
+    items : tuple
+        the arguments of the calls, one per call
+    hash : bytes
+        hash of the mapped function, used to load the results
+    chunk_size : int
+        the number of calls per chunk
+
+    Methods
+    -------
+    calls()
+        The calls of the map
+    chunks()
+        The CallNodes of the chunks of the map
+    load(store_accessor)
+        The results of the map as a lazily loaded sequence
+    """
+
+    chunk_prefix = '_xun_map_'
+
+    def __init__(self, function_name, items, hash=None, chunk_size=None):
+        self.function_name = function_name
+        self.items = tuple(items)
+        self.hash = hash
+        if chunk_size is None:
+            chunk_size = max(1, -(-len(self.items) // 1000))
+        self.chunk_size = chunk_size
+        self._hash = None
+
+    @staticmethod
+    def mapped_function_name(call):
+        """
+        The name of the mapped function if the given call is a chunk of a map,
+        otherwise None
+        """
+        if call.function_name.startswith(MapNode.chunk_prefix):
+            return call.function_name[len(MapNode.chunk_prefix):]
+        return None
+
+    def calls(self):
+        return (CallNode(self.function_name, item) for item in self.items)
+
+    def chunks(self):
+        return [
+            CallNode(
+                self.chunk_prefix + self.function_name,
+                self.items[i:i + self.chunk_size],
+            )
+            for i in range(0, len(self.items), self.chunk_size)
+        ]
+
+    def load(self, store_accessor):
+        return MapResults(self, store_accessor)
+
+    def __copy__(self):
+        raise CopyError('Cannot copy value')
+
+    def __deepcopy__(self, memo=None):
+        raise CopyError('Cannot copy value')
+
+    def __eq__(self, other):
+        try:
+            return (self.function_name == other.function_name
+                and self.items == other.items)
+        except AttributeError:
+            return False
+
+    def __hash__(self):
+        # Hashing large maps is expensive, and string hashes differ between
+        # processes, so the hash is cached but not pickled
+        if self._hash is None:
+            self._hash = hash((MapNode, self.function_name, self.items))
+        return self._hash
+
+    def __getstate__(self):
+        return self.function_name, self.items, self.hash, self.chunk_size
+
+    def __setstate__(self, state):
+        self.function_name, self.items, self.hash, self.chunk_size = state
+        self._hash = None
+
+    def __repr__(self):
+        return 'MapNode({}, <{} items>)'.format(
+            repr(self.function_name), len(self.items)
+        )
+
+
+class ReduceNode:
+    """ReduceNode
+
+    Representation of a reduction of items with a xun function, created by
+    `xun.reduce`. The reduction is a balanced tree of calls, each combining up
+    to `fan_in` items or partial results. The partial reductions run in
+    parallel, and the depth of the tree is logarithmic in the number of items.
+
+    The calls of the tree are CallNodes of the `_xun_reduce_<function name>`
+    image, identified by the digest of the reduction, their level in the tree
+    and their index in the level. Calls at the leaves also take the items
+    they combine as arguments. Calls above the leaves combine the partial
+    results of their predecessors in the call graph, so that no call holds
+    the calls below it, and keys stay small however large the tree. Their
+    results are stored like those of any other call, under a hash derived
+    from the hash of the reducing function.
+
+    Like CallNodes, ReduceNodes are sentinel values during scheduling, and
+    cannot be copied.
+
+    Attributes
+    ----------
+    function_name : str
+        name of the function reducing two values to one
+    items : tuple or MapNode
+        the values to reduce, or a map whose results are reduced
+    fan_in : int
+        the largest number of values combined by a call
+    hash : bytes
+        hash of the reducing function, used to load the result
+    digest : str
+        digest identifying the reduction, by its function, fan in and leaves
+
+    Methods
+    -------
+    tree_hash(function_hash)
+        The hash of the calls of the trees of a reducing function
+    tree_inputs(graph)
+        The partial results combined by the calls of the trees in a call graph
+    leaves()
+        The values reduced by the tree
+    levels()
+        The calls of the tree, level by level from the leaves to the root
+    root()
+        The call at the root of the tree
+    graph()
+        The calls of the tree and their dependencies
+    load(store_accessor)
+        The result of the reduction
+    """
+
+    prefix = '_xun_reduce_'
+
+    def __init__(self, function_name, items, fan_in=8, hash=None):
+        if fan_in < 2:
+            raise ValueError('fan_in must be at least 2')
+        self.function_name = function_name
+        self.items = items if isinstance(items, MapNode) else tuple(items)
+        self.fan_in = fan_in
+        self.hash = hash
+
+    @staticmethod
+    def tree_hash(function_hash):
+        """
+        The hash of the calls of the trees of a reducing function, distinct
+        from the hash of the function itself
+        """
+        prefixed = ReduceNode.prefix.encode() + function_hash
+        return hashlib.sha256(prefixed).digest()
+
+    @staticmethod
+    def reduced_function_name(call):
+        """
+        The name of the reducing function if the given call is part of a
+        reduction tree, otherwise None
+        """
+        if call.function_name.startswith(ReduceNode.prefix):
+            return call.function_name[len(ReduceNode.prefix):]
+        return None
+
+    @staticmethod
+    def tree_inputs(graph):
+        """
+        The partial results combined by the calls of reduction trees above the
+        leaves, by call. They are the predecessors of the calls in the call
+        graph, in the order of the tree
+        """
+        inputs = {}
+        for node in graph.nodes:
+            if (isinstance(node, CallNode)
+                    and ReduceNode.reduced_function_name(node) is not None
+                    and node.args[1] > 0):
+                # A partial result passed on from a lower level is the last
+                # one of its level
+                inputs[node] = tuple(sorted(
+                    graph.predecessors(node),
+                    key=lambda call: (-call.args[1], call.args[2]),
+                ))
+        return inputs
+
+    @property
+    def digest(self):
+        """
+        Computed once, since it pickles every leaf
+        """
+        try:
+            return self._digest
+        except AttributeError:
+            pickled = pickle.dumps(
+                (self.function_name, self.fan_in, tuple(self.leaves()))
+            )
+            self._digest = hashlib.sha256(pickled).hexdigest()
+            return self._digest
+
+    def leaves(self):
+        if isinstance(self.items, MapNode):
+            return list(self.items.calls())
+        return list(self.items)
+
+    def levels(self):
+        return [[call for call, _ in level] for level in self._tree()]
+
+    def _tree(self):
+        """
+        The calls of the tree level by level, each with the partial results it
+        combines. Calls at the leaves take their items as arguments instead,
+        and calls passed on from a lower level have no inputs
+        """
+        name = self.prefix + self.function_name
+        level = self.leaves()
+        tree = []
+        while len(tree) == 0 or len(level) > 1:
+            groups = [
+                level[i:i + self.fan_in]
+                for i in range(0, max(1, len(level)), self.fan_in)
+            ]
+            if len(tree) == 0:
+                calls = [
+                    (CallNode(name, self.digest, 0, i, *group), ())
+                    for i, group in enumerate(groups)
+                ]
+            else:
+                # Above the leaves, a lone partial result is passed on to the
+                # next level as is
+                calls = [
+                    (group[0], ()) if len(group) == 1
+                    else (CallNode(name, self.digest, len(tree), i), group)
+                    for i, group in enumerate(groups)
+                ]
+            tree.append(calls)
+            level = [call for call, _ in calls]
+        return tree
+
+    def root(self):
+        return self.levels()[-1][0]
+
+    def graph(self):
+        tree = self._tree()
+        levels = [[call for call, _ in level] for level in tree]
+        graph = nx.DiGraph()
+        graph.add_nodes_from(call for level in levels for call in level)
+
+        # The results of maps are stored per call, but only the chunks of the
+        # map are in the call graph
+        if isinstance(self.items, MapNode):
+            chunks = self.items.chunks()
+            chunk_size = self.items.chunk_size
+            graph.add_edges_from(
+                (chunks[i // chunk_size], levels[0][i // self.fan_in])
+                for i in range(len(self.items.items))
+            )
+        else:
+            graph.add_edges_from(
+                (leaf, levels[0][i // self.fan_in])
+                for i, leaf in enumerate(self.items)
+                if isinstance(leaf, CallNode)
+            )
+
+        graph.add_edges_from(
+            (partial, call)
+            for level in tree[1:]
+            for call, inputs in level
+            for partial in inputs
+        )
+        return graph
+
+    def load(self, store_accessor):
+        return store_accessor.load_result(
+            self.root(), hash=self.tree_hash(self.hash)
+        )
+
+    def __getstate__(self):
+        # ReduceNodes are part of the keys of the calls taking them, which must
+        # not depend on whether the digest was computed
+        return {k: v for k, v in vars(self).items() if k != '_digest'}
+
+    def __copy__(self):
+        raise CopyError('Cannot copy value')
+
+    def __deepcopy__(self, memo=None):
+        raise CopyError('Cannot copy value')
+
+    def __eq__(self, other):
+        try:
+            return (self.function_name == other.function_name
+                and self.items == other.items
+                and self.fan_in == other.fan_in)
+        except AttributeError:
+            return False
+
+    def __hash__(self):
+        return hash((ReduceNode, self.function_name, self.items, self.fan_in))
+
+    def __repr__(self):
+        return 'ReduceNode({}, <{} items>, fan_in={})'.format(
+            repr(self.function_name), len(self.leaves()), self.fan_in
+        )
+
+
+class LazyResults(Sequence):
+    """LazyResults
+
+    Values of a with constants statement holding the results of calls, such
+    as a list of calls, loaded from the store as they are accessed. Values
+    that are not calls are returned as they are. Iterating loads up to
+    `read_ahead` results ahead in background threads, so that loading
+    overlaps with the work done on each result, while only a bounded number
+    of results are held at once. Lazy results are pickled as lists of their
+    values, for example when returned and stored.
+
+    Parameters
+    ----------
+    values : list or tuple
+        The values, holding calls
+    store_accessor : StoreAccessor
+        Accessor for the store holding the results
+    hashes : mapping of str to bytes, optional
+        Function hashes used to load the results, by function name
+
+    Attributes
+    ----------
+    read_ahead : int
+        The largest number of results loaded ahead while iterating, none if
+        zero
+    """
+
+    read_ahead = 8
+
+    def __init__(self, values, store_accessor, hashes=None):
+        self.values = values
+        self.store_accessor = store_accessor
+        self.hashes = hashes if hashes is not None else {}
+
+    def load(self, index):
+        return self.store_accessor.load_lazily(self.values[index], self.hashes)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.load(i) for i in range(*index.indices(len(self)))]
+        return self.load(index)
+
+    def __iter__(self):
+        if self.read_ahead < 1:
+            for index in range(len(self)):
+                yield self.load(index)
+            return
+
+        def submit(executor, index):
+            # Loads are run in a copy of the context, so that the results are
+            # collected as consumed in early cutoff mode
+            context = contextvars.copy_context()
+            return executor.submit(context.run, self.load, index)
+
+        indices = iter(range(len(self)))
+        with concurrent.futures.ThreadPoolExecutor(self.read_ahead) as executor:
+            pending = deque(
+                submit(executor, index)
+                for index in itertools.islice(indices, self.read_ahead)
+            )
+            try:
+                while len(pending) > 0:
+                    value = pending.popleft().result()
+                    for index in itertools.islice(indices, 1):
+                        pending.append(submit(executor, index))
+                    yield value
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def __eq__(self, other):
+        if not isinstance(other, Sequence) or isinstance(other, str):
+            return NotImplemented
+        return len(self) == len(other) and all(
+            a == b for a, b in zip(self, other)
+        )
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return list, (list(self),)
+
+    def __repr__(self):
+        return '{}(<{} values>)'.format(type(self).__name__, len(self))
+
+
+class MapResults(LazyResults):
+    """MapResults
+
+    The results of a map, loaded from the store as they are accessed
+
+    Parameters
+    ----------
+    node : MapNode
+        The map
+    store_accessor : StoreAccessor
+        Accessor for the store holding the results
+    """
+
+    def __init__(self, node, store_accessor):
+        super().__init__(node.items, store_accessor)
+        self.node = node
+
+    def load(self, index):
+        call = CallNode(self.node.function_name, self.node.items[index])
+        return self.store_accessor.load_result(call, hash=self.node.hash)
@@ -0,0 +1,508 @@
+"""
+Limits on the execution of calls to xun functions. Functions are limited with
+the `max_parallel` and `rate_limit` arguments of `xun.function`, which are
+enforced by the drivers. The `memory` and `cpus` arguments are hints of the
+resources a call needs, used by local drivers to pack calls against the
+resources of the machine. Calls running longer than the `timeout` of their
+function fail, and drivers can speculatively back up calls that run much
+longer than earlier calls to their function.
+"""
+
+
+from .errors import CallTimeoutError
+import collections
+import contextlib
+import logging
+import os
+import signal
+import statistics
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_rate(rate):
+    """Parse rate
+
+    Parameters
+    ----------
+    rate : int, float, or str
+        Calls per second, or a string of calls per unit of time such as
+        `'10/s'`, `'100/m'`, or `'1000/h'`
+
+    Returns
+    -------
+    float
+        Calls per second
+
+    Raises
+    ------
+    ValueError
+        If the rate is malformed or not positive
+
+    Examples
+    --------
+
+    >>> parse_rate('30/m')
+    0.5
+    """
+    periods = {'s': 1.0, 'm': 60.0, 'h': 3600.0}
+    if isinstance(rate, str):
+        count, _, unit = rate.partition('/')
+        try:
+            calls_per_second = float(count) / periods[unit or 's']
+        except (KeyError, ValueError):
+            msg = 'Invalid rate {}, expected for example 10/s, 10/m or 10/h'
+            raise ValueError(msg.format(repr(rate)))
+    else:
+        calls_per_second = float(rate)
+    if calls_per_second <= 0:
+        raise ValueError('rate_limit must be positive')
+    return calls_per_second
+
+
+def parse_memory(memory):
+    """Parse memory
+
+    Parameters
+    ----------
+    memory : int or str
+        Bytes, or a string with a unit suffix such as `'512M'`, `'2G'`, or
+        `'2GiB'`. Units are powers of 1024
+
+    Returns
+    -------
+    int
+        Bytes
+
+    Raises
+    ------
+    ValueError
+        If the amount is malformed or not positive
+
+    Examples
+    --------
+
+    >>> parse_memory('1.5K')
+    1536
+    """
+    units = {'': 1, 'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40}
+    if isinstance(memory, str):
+        amount = memory.strip().upper()
+        for suffix in ('IB', 'B'):
+            if amount.endswith(suffix):
+                amount = amount[:-len(suffix)]
+                break
+        unit = amount[-1:] if amount[-1:] in units else ''
+        try:
+            memory = float(amount[:len(amount) - len(unit)]) * units[unit]
+        except ValueError:
+            msg = 'Invalid memory {}, expected for example 512M or 2G'
+            raise ValueError(msg.format(repr(memory)))
+    memory = int(memory)
+    if memory <= 0:
+        raise ValueError('memory must be positive')
+    return memory
+
+
+def machine_memory():
+    """Machine memory
+
+    Returns
+    -------
+    int or None
+        The physical memory of the machine in bytes, None if unknown
+    """
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+@contextlib.contextmanager
+def peak_memory():
+    """Peak memory
+
+    Measure the peak resident set size of the current process within the
+    context. The peak is reset on entry, which requires Linux. Elsewhere, the
+    measurement is None.
+
+    Yields
+    ------
+    dict
+        Holds the peak in bytes under `'peak'` once the context exits
+
+    Examples
+    --------
+
+    >>> with peak_memory() as measurement:
+    ...     data = bytearray(2**30)
+    ...
+    >>> measurement['peak'] > 2**30
+    True
+    """
+    measurement = {'peak': None}
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        yield measurement
+        return
+    try:
+        yield measurement
+    finally:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    measurement['peak'] = int(line.split()[1]) * 1024
+
+
+@contextlib.contextmanager
+def time_limit(seconds, call=None):
+    """Time limit
+
+    Raise `CallTimeoutError` in the block if it runs longer than the given
+    time. The block is interrupted by a timer signal, so the limit is only
+    enforced in the main thread, on platforms with interval timers.
+    Elsewhere, the block runs without a limit.
+
+    Parameters
+    ----------
+    seconds : float or None
+        The time limit, None for no limit
+    call : CallNode, optional
+        The call running in the block, named in the error
+
+    Examples
+    --------
+
+    >>> with time_limit(0.1):
+    ...     time.sleep(1)
+    Traceback (most recent call last):
+        ...
+    xun.functions.errors.CallTimeoutError: Timed out after 0.1 seconds
+    """
+    if (seconds is None or
+            not hasattr(signal, 'setitimer') or
+            threading.current_thread() is not threading.main_thread()):
+        yield
+        return
+
+    def expire(signum, frame):
+        msg = 'Timed out after {} seconds'.format(seconds)
+        if call is not None:
+            msg = '{} timed out after {} seconds'.format(call, seconds)
+        raise CallTimeoutError(msg)
+
+    previous = signal.signal(signal.SIGALRM, expire)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+class TokenBucket:
+    """TokenBucket
+
+    Token bucket rate limiter. Tokens are added at the given rate, up to the
+    capacity of the bucket, and every call takes one. Tokens are reserved
+    rather than waited for, so the bucket can be shared by synchronous and
+    asynchronous schedulers alike: the caller waits the returned delay
+    before making its call. Schedulers that would rather not commit to a
+    call before it can start check the delay first.
+
+    Parameters
+    ----------
+    rate : float
+        Tokens added per second
+    capacity : int, optional
+        Largest number of tokens held, the number of calls that can be made
+        at once after an idle period. Defaults to one, spacing calls evenly
+    clock : callable, optional
+        Returns the current time in seconds
+
+    Methods
+    -------
+    delay()
+        How long until a token is available
+    reserve()
+        Take a token, and return how long to wait before using it
+    """
+
+    def __init__(self, rate, capacity=1, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+
+    def refill(self):
+        now = self.clock()
+        elapsed = now - self.updated
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated = now
+
+    def delay(self):
+        self.refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def reserve(self):
+        self.refill()
+
+        # Tokens may go negative, reserving tokens that are yet to be added
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate)
+
+
+class Limits:
+    """Limits
+
+    Tracks the limits of the functions of a run, for drivers that schedule
+    calls from a single thread. A call takes a slot of its function, waits
+    until the rate limit of the function allows it to start, and releases the
+    slot when it finishes. Functions without limits always have slots, and
+    never wait.
+
+    Parameters
+    ----------
+    function_images : dict
+        Function images by function name, limited by their `max_parallel` and
+        `rate_limit` options
+    clock : callable, optional
+        Returns the current time in seconds
+
+    Methods
+    -------
+    acquire(function_name)
+        Take a slot for a call, if the function has one available
+    delay(function_name)
+        How long until the rate limit allows a call to start
+    start(function_name)
+        Take a token for a call that is starting
+    release(function_name)
+        Release the slot of a finished call
+    """
+
+    def __init__(self, function_images, clock=time.monotonic):
+        self.max_parallel = {
+            name: func.options['max_parallel']
+            for name, func in function_images.items()
+            if func.options.get('max_parallel') is not None
+        }
+        self.buckets = {
+            name: TokenBucket(func.options['rate_limit'], clock=clock)
+            for name, func in function_images.items()
+            if func.options.get('rate_limit') is not None
+        }
+        self.running = collections.Counter()
+
+    def acquire(self, function_name):
+        """Acquire
+
+        Returns
+        -------
+        bool
+            True if a slot was taken, False if the function has as many calls
+            running as it allows
+        """
+        max_parallel = self.max_parallel.get(function_name)
+        if (max_parallel is not None and
+                self.running[function_name] >= max_parallel):
+            return False
+        self.running[function_name] += 1
+        return True
+
+    def delay(self, function_name):
+        bucket = self.buckets.get(function_name)
+        return bucket.delay() if bucket is not None else 0.0
+
+    def start(self, function_name):
+        bucket = self.buckets.get(function_name)
+        if bucket is not None:
+            bucket.reserve()
+
+    def release(self, function_name):
+        self.running[function_name] -= 1
+
+
+class Resources:
+    """Resources
+
+    Packs calls against a budget of memory and processors, for drivers that
+    schedule calls from a single thread. Every call needs the `memory` and
+    `cpus` of its function, one processor and no memory by default. A call
+    fits if the resources it needs are free, or if nothing else is running,
+    so that calls larger than the budget still run, one at a time.
+
+    Functions without a memory hint can be given the memory they were
+    learned to need, typically the peak resident set size recorded by earlier
+    calls. Learning updates as calls finish.
+
+    Parameters
+    ----------
+    function_images : dict
+        Function images by function name, with their `memory` and `cpus`
+        options
+    memory : int, optional
+        Bytes of memory available to calls, unlimited by default
+    cpus : int or float, optional
+        Processors available to calls, unlimited by default
+    learned : dict, optional
+        Learned memory in bytes by function name
+
+    Methods
+    -------
+    fits(function_name)
+        True if a call to the function can start
+    take(function_name)
+        Take the resources of a starting call, returns the resources taken
+    free(taken)
+        Free the resources taken by a finished call
+    learn(function_name, memory)
+        Update the learned memory of a function
+    """
+
+    def __init__(self, function_images, memory=None, cpus=None, learned=None):
+        self.memory = memory
+        self.cpus = cpus
+        self.hints = {
+            name: func.options['memory']
+            for name, func in function_images.items()
+            if func.options.get('memory') is not None
+        }
+        self.learned = dict(learned) if learned is not None else {}
+        self.function_cpus = {
+            name: func.options['cpus']
+            for name, func in function_images.items()
+            if func.options.get('cpus') is not None
+        }
+        self.used_memory = 0
+        self.used_cpus = 0
+        self.running = 0
+
+    def demand(self, function_name):
+        """Demand
+
+        Returns
+        -------
+        (int, float)
+            The memory and processors a call to the function needs
+        """
+        memory = self.hints.get(
+            function_name, self.learned.get(function_name, 0)
+        )
+        return memory, self.function_cpus.get(function_name, 1)
+
+    def fits(self, function_name):
+        if self.running == 0:
+            return True
+        memory, cpus = self.demand(function_name)
+        if self.memory is not None and self.used_memory + memory > self.memory:
+            return False
+        if self.cpus is not None and self.used_cpus + cpus > self.cpus:
+            return False
+        return True
+
+    def take(self, function_name):
+        memory, cpus = self.demand(function_name)
+        if (self.memory is not None and memory > self.memory or
+                self.cpus is not None and cpus > self.cpus):
+            logger.warning(
+                '{} needs more than the budget, running it alone'.format(
+                    function_name
+                )
+            )
+        self.used_memory += memory
+        self.used_cpus += cpus
+        self.running += 1
+        return memory, cpus
+
+    def free(self, taken):
+        memory, cpus = taken
+        self.used_memory -= memory
+        self.used_cpus -= cpus
+        self.running -= 1
+
+    def learn(self, function_name, memory):
+        if memory is not None:
+            self.learned[function_name] = max(
+                memory, self.learned.get(function_name, 0)
+            )
+
+
+class Stragglers:
+    """Stragglers
+
+    Detects calls that run much longer than earlier calls to their function,
+    for drivers that speculatively back them up. A call straggles once it has
+    run `factor` times the median runtime of its function, and at least
+    `min_runtime` seconds. Functions with fewer than `min_samples` recorded
+    runtimes are not backed up, nor are functions with a `max_parallel` or
+    `rate_limit`, since a backup would exceed the limit.
+
+    Parameters
+    ----------
+    function_images : dict
+        Function images by function name
+    factor : float
+        How many times the median runtime a call runs before it straggles
+    recorded : dict, optional
+        Runtimes recorded by earlier runs, lists of seconds by function name
+    min_samples : int, optional
+        The fewest runtimes a function needs before its calls are backed up
+    min_runtime : float, optional
+        The shortest time in seconds a call runs before it is backed up
+    keep : int, optional
+        The number of most recent runtimes kept per function
+
+    Methods
+    -------
+    threshold(function_name)
+        Runtime after which a call straggles, None if it is never backed up
+    record(function_name, seconds)
+        Record the runtime of a finished call
+    """
+
+    def __init__(self,
+                 function_images,
+                 factor,
+                 recorded=None,
+                 min_samples=3,
+                 min_runtime=1.0,
+                 keep=100):
+        if factor <= 1:
+            raise ValueError('Speculation factor must be greater than one')
+        self.factor = factor
+        self.min_samples = min_samples
+        self.min_runtime = min_runtime
+        self.keep = keep
+        self.excluded = {
+            name for name, func in function_images.items()
+            if func.options.get('max_parallel') is not None
+            or func.options.get('rate_limit') is not None
+        }
+        self.runtimes = collections.defaultdict(
+            lambda: collections.deque(maxlen=keep)
+        )
+        for name, runtimes in (recorded or {}).items():
+            self.runtimes[name].extend(runtimes)
+
+        # Runtimes recorded in this run, for drivers to save in the store
+        self.new_runtimes = collections.defaultdict(list)
+
+    def threshold(self, function_name):
+        if function_name in self.excluded:
+            return None
+        runtimes = self.runtimes.get(function_name, ())
+        if len(runtimes) < self.min_samples:
+            return None
+        median = statistics.median(runtimes)
+        return max(self.factor * median, self.min_runtime)
+
+    def record(self, function_name, seconds):
+        self.runtimes[function_name].append(seconds)
+        self.new_runtimes[function_name].append(seconds)
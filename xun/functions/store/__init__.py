@@ -1,7 +1,13 @@
 from .store import Store
 from .store import StoreDriver
 from .store import NamespacedKey
+from .store_accessor import KnownFailure
+from .store_accessor import Lease
+from .store_accessor import ResultCache
 from .store_accessor import StoreAccessor
+from .store_accessor import consumed_results
+from .store_accessor import enable_result_cache
+from .store_accessor import preloaded_results
 
 from .disk import Disk
 from .memory import Memory
@@ -2,7 +2,10 @@ from .store import Store
 from .store import StoreDriver
 from pathlib import Path
 import hashlib
+import os
 import pickle
+import time
+import uuid
 
 
 def key_hash(key):
@@ -37,6 +40,7 @@ class DiskDriver(StoreDriver):
 
         (self.dir / 'keys').mkdir(parents=True, exist_ok=True)
         (self.dir / 'values').mkdir(parents=True, exist_ok=True)
+        (self.dir / 'leases').mkdir(parents=True, exist_ok=True)
 
     def refresh_index(self):
         files = [
@@ -122,3 +126,107 @@ class DiskDriver(StoreDriver):
 
         if __debug__:
             self.key_invariant(key)
+
+    def acquire_lease(self, key, owner, ttl):
+        """Acquire lease
+
+        Leases are lock files created exclusively, holding the owner and the
+        expiry time. An expired lease is broken by renaming its lock file, so
+        that only one of the executors breaking it succeeds.
+        """
+        path = self.dir / 'leases' / key_hash(key)
+        for _ in range(8):
+            try:
+                fd = os.open(str(path), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not self.break_expired_lease(path, ttl):
+                    return False
+                continue
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((owner, time.time() + ttl), f)
+            return True
+        return False
+
+    def renew_lease(self, key, owner, ttl):
+        path = self.dir / 'leases' / key_hash(key)
+        if read_lease(path)[0] != owner:
+            return False
+        tmp = path.with_name('{}.{}'.format(path.name, uuid.uuid4().hex))
+        with open(str(tmp), 'wb') as f:
+            pickle.dump((owner, time.time() + ttl), f)
+        os.replace(str(tmp), str(path))
+        return True
+
+    def release_lease(self, key, owner):
+        path = self.dir / 'leases' / key_hash(key)
+        if read_lease(path)[0] == owner:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def break_expired_lease(self, path, ttl):
+        """Break expired lease
+
+        Lock files that cannot be read, because their writer died before
+        writing them, expire `ttl` seconds after they were created.
+
+        Returns
+        -------
+        bool
+            True if the lease is gone, False if it is still held
+        """
+        lease = read_lease(path, ttl)
+        if lease == (None, None):
+            # Gone in the meantime
+            return True
+        if lease[1] is None or lease[1] > time.time():
+            return False
+        broken = path.with_name('{}.{}'.format(path.name, uuid.uuid4().hex))
+        try:
+            os.rename(str(path), str(broken))
+        except FileNotFoundError:
+            return True
+        if read_lease(broken, ttl) != lease:
+            # The lease was taken over after we read it, put it back
+            try:
+                os.link(str(broken), str(path))
+            except FileExistsError:
+                pass
+            broken.unlink()
+            return False
+        broken.unlink()
+        return True
+
+
+def read_lease(path, ttl=None):
+    """Read lease
+
+    Parameters
+    ----------
+    path : Path
+        The lock file of the lease
+    ttl : float, optional
+        Seconds after its creation that a lock file which cannot be read
+        expires
+
+    Returns
+    -------
+    (str, float)
+        Owner and expiry time of the lease. Both are None if there is no
+        lease. If the lock file is still being written, or its writer died,
+        the owner is empty and the lease expires `ttl` seconds after the lock
+        file was modified, the expiry time is None if no `ttl` is given
+    """
+    try:
+        with open(str(path), 'rb') as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None, None
+    except (EOFError, pickle.UnpicklingError):
+        if ttl is None:
+            return '', None
+        try:
+            return '', path.stat().st_mtime + ttl
+        except FileNotFoundError:
+            return None, None
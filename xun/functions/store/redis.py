@@ -52,7 +52,10 @@ class RedisDriver(StoreDriver):
         return pickle.loads(v)
 
     def __iter__(self):
-        return (redis_key_to_key(k) for k in self.redis.scan_iter())
+        return (
+            redis_key_to_key(k) for k in self.redis.scan_iter()
+            if not k.startswith(b'xun-lease:')
+        )
 
     def __len__(self):
         return sum(1 for _ in self.__iter__())
@@ -89,6 +92,38 @@ class RedisDriver(StoreDriver):
             for k in self.scan_namespace_iter(namespace)
         )
 
+    def acquire_lease(self, key, owner, ttl):
+        k = lease_key(key)
+        acquired = self.redis.set(k, owner, nx=True, px=int(ttl * 1000))
+        return bool(acquired)
+
+    def renew_lease(self, key, owner, ttl):
+        k = lease_key(key)
+        with self.redis.pipeline() as pipe:
+            try:
+                pipe.watch(k)
+                if pipe.get(k) != owner.encode():
+                    return False
+                pipe.multi()
+                pipe.set(k, owner, px=int(ttl * 1000))
+                pipe.execute()
+                return True
+            except redis.WatchError:
+                return False
+
+    def release_lease(self, key, owner):
+        k = lease_key(key)
+        with self.redis.pipeline() as pipe:
+            try:
+                pipe.watch(k)
+                if pipe.get(k) != owner.encode():
+                    return
+                pipe.multi()
+                pipe.delete(k)
+                pipe.execute()
+            except redis.WatchError:
+                pass
+
 
 def decode_hex_bytes(hex_bytes):
     """Decode hex bytes
@@ -146,6 +181,15 @@ def key_to_redis_key(key):
         return encode_hex_bytes(key)
 
 
+def lease_key(key):
+    """Lease key
+
+    The redis key of the lease on a key. Leases are kept outside of the keys
+    of the store, so that they are not seen as values.
+    """
+    return b'xun-lease:%b' % key_to_redis_key(key)
+
+
 def redis_key_to_key(key):
     """Redis key to key
 
@@ -2,6 +2,8 @@ from abc import abstractmethod
 from collections.abc import KeysView
 from collections.abc import MutableMapping
 import copy
+import threading
+import time
 
 
 class Store(MutableMapping):
@@ -34,6 +36,15 @@ class Store(MutableMapping):
     >>> store / 'some_namespace' // 'key'
     'Value'
 
+    Stores also hold leases, which executors sharing the store use to agree
+    on who executes a call. A lease on a key is held by one owner at a time,
+    until it is released or its time to live runs out. Leases are kept apart
+    from the values of the store.
+
+    >>> store.acquire_lease('key', 'owner', ttl=30)
+    True
+    >>> store.acquire_lease('key', 'other', ttl=30)
+    False
     """
     def __new__(cls, *args, **kwargs):
         instance = super().__new__(cls)
@@ -99,6 +110,42 @@ class Store(MutableMapping):
     def clear(self):
         self.driver.namespace_clear(self.namespace)
 
+    def acquire_lease(self, key, owner, ttl):
+        """Acquire lease
+
+        Parameters
+        ----------
+        key : Any
+            The key to lease
+        owner : str
+            Identifies the holder of the lease
+        ttl : float
+            Seconds until the lease expires, unless it is renewed
+
+        Returns
+        -------
+        bool
+            True if the lease was acquired, False if another owner holds it
+        """
+        key = NamespacedKey(self.namespace, key)
+        return self.driver.acquire_lease(key, owner, ttl)
+
+    def renew_lease(self, key, owner, ttl):
+        """Renew lease
+
+        Returns
+        -------
+        bool
+            True if the lease was renewed, False if the owner no longer holds
+            it
+        """
+        key = NamespacedKey(self.namespace, key)
+        return self.driver.renew_lease(key, owner, ttl)
+
+    def release_lease(self, key, owner):
+        key = NamespacedKey(self.namespace, key)
+        self.driver.release_lease(key, owner)
+
     def __repr__(self):
         r = repr(self.driver)
         if len(self.namespace) > 0:
@@ -110,6 +157,45 @@ class Store(MutableMapping):
 
 
 class StoreDriver(MutableMapping):
+    """StoreDriver
+
+    The storage behind stores. Leases are held in the memory of the process
+    by default, which coordinates the threads of a process. Drivers of stores
+    shared between processes override the lease methods to hold leases in the
+    underlying storage.
+    """
+
+    _lease_lock = threading.Lock()
+
+    @property
+    def _leases(self):
+        try:
+            return self.__dict__['_leases']
+        except KeyError:
+            return self.__dict__.setdefault('_leases', {})
+
+    def acquire_lease(self, key, owner, ttl):
+        with self._lease_lock:
+            held = self._leases.get(key)
+            if held is not None and held[1] > time.monotonic():
+                return False
+            self._leases[key] = owner, time.monotonic() + ttl
+            return True
+
+    def renew_lease(self, key, owner, ttl):
+        with self._lease_lock:
+            held = self._leases.get(key)
+            if held is None or held[0] != owner:
+                return False
+            self._leases[key] = owner, time.monotonic() + ttl
+            return True
+
+    def release_lease(self, key, owner):
+        with self._lease_lock:
+            held = self._leases.get(key)
+            if held is not None and held[0] == owner:
+                del self._leases[key]
+
     def namespace__len__(self, namespace):
         return sum(1 for _ in self.namespace_keys(namespace))
 
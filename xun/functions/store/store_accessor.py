@@ -1,4 +1,48 @@
 from .. import CallNode
+from .. import InternedArgument
+from .. import LazyResults
+from .. import MapNode
+from .. import ReduceNode
+from ..errors import KnownFailureError
+from collections import Counter
+from collections import OrderedDict
+from collections.abc import Sequence
+import asyncio
+import concurrent.futures
+import contextlib
+import contextvars
+import copy
+import hashlib
+import itertools
+import logging
+import os
+import pickle
+import socket
+import threading
+import time
+import traceback
+import uuid
+
+
+logger = logging.getLogger(__name__)
+
+
+# Names of the function images running the calls they are given, such as a
+# chain in the call graph or a batch of calls to one function
+FUSED_NAME = '_xun_fused'
+BATCHED_PREFIX = '_xun_batched_'
+
+
+# Exceptions of failures that are likely to pass, such as timeouts, lost
+# connections, and running out of memory. They are not remembered, unless
+# they are among the exception types given to remember
+TRANSIENT_ERRORS = (
+    TimeoutError,
+    ConnectionError,
+    MemoryError,
+    asyncio.TimeoutError,
+    concurrent.futures.TimeoutError,
+)
 
 
 class StoreAccessor:
@@ -25,22 +69,188 @@ class StoreAccessor:
     completed(call, hash=None)
         True if there is a value stored for a given call. If hash is not
         supplied, we check against the latest stored result.
+    peak_memory(function_name)
+        The largest peak memory recorded for calls to a function
+    record_peak_memory(function_name, peak)
+        Records the peak memory of calls to a function
+    runtimes(function_name)
+        The most recent runtimes recorded for calls to a function
+    record_runtimes(function_name, runtimes)
+        Records runtimes of calls to a function
+    mark_started(call, hash)
+        Records that a call started executing, and when
+    claim(call, hash)
+        Context in which drivers execute a call. It holds the lease on the
+        call in single flight mode, and records failures of the call if
+        failures are remembered
+    for_call(call)
+        The accessor to send with the task executing a call
+    remembers(exception)
+        True if a failure with the exception is remembered
+    known_failure(call, hash)
+        The failure recorded for a call and function hash, if any
+    known_failures()
+        All failures recorded in the store
+    forget_failure(call)
+        Removes the failure recorded for a call
+    cut_off(call, hash)
+        Reuses the result of an earlier version of a call if its inputs are
+        unchanged, in early cutoff mode
+    store_arguments(calls)
+        Stores the interned arguments of calls that are not stored yet
+    load_argument(digest)
+        Loads an interned argument
+    load_element(call, hash=None)
+        Loads the element of a result a subscripted call refers to
+    load_lazily(value, hashes)
+        Loads the results in a value of a with constants statement, lists
+        and tuples of calls as they are accessed
+
+    In early cutoff mode, results are stored with a digest of their content,
+    and executed calls record the digests of the results they loaded. A call
+    whose function only changed because the functions it depends on changed
+    reuses its earlier result, if the results it loads are the same as
+    before.
+
+    Given `elements`, the subscripts of the elements of results that calls
+    depend on, results are stored with each of these elements in a separate
+    entry, `store / 'elements' / call[subscript] // hash`. Subscripted calls
+    then load only the element they refer to.
+
+    Given `tree_inputs`, the calls of reduction trees above the leaves are
+    given the partial results of their predecessors in the call graph as
+    arguments, after their own.
+
+    Calls to fused images, such as chains and batches of calls, store no
+    result of their own. Their result is None, and they are completed once
+    the calls they run are completed, with the hashes of `function_hashes`.
+
+    If a result cache is enabled in the process, results are kept in it as
+    they are loaded and stored. Results passed to `preloaded_results` are
+    returned without accessing the store.
+
+    See Also
+    --------
+    enable_result_cache : Enable a result cache in the current process
+    preloaded_results : Provide results already in memory
     """
 
-    def __init__(self, store):
+    def __init__(self,
+                 store,
+                 lease_ttl=None,
+                 remember_failures=False,
+                 early_cutoff=None,
+                 elements=None,
+                 function_hashes=None,
+                 tree_inputs=None):
         self.store = store
+        self.lease_ttl = lease_ttl
+        self.remember_failures = remember_failures
+        self.early_cutoff = early_cutoff
+        self.elements = elements
+        self.function_hashes = function_hashes or {}
+        self.tree_inputs = tree_inputs
+
+    @property
+    def store_token(self):
+        """
+        Identifies the store across processes, None if the store cannot be
+        pickled
+        """
+        try:
+            return self._store_token
+        except AttributeError:
+            pass
+        try:
+            pickled = pickle.dumps(self.store)
+        except Exception:
+            self._store_token = None
+        else:
+            self._store_token = hashlib.sha256(pickled).hexdigest()
+        return self._store_token
+
+    def for_call(self, call):
+        """
+        The accessor sent with the task executing a call. It only holds the
+        subscripts of the elements of the call, and of the calls it runs,
+        such as the calls of a batch, rather than those of the whole graph.
+        Likewise, it only holds the tree inputs of the call
+        """
+        if self.elements is None and self.tree_inputs is None:
+            return self
+        accessor = copy.copy(self)
+        if self.elements is not None:
+            calls = [call]
+            for arg in call.args:
+                if isinstance(arg, CallNode):
+                    calls.append(arg)
+                elif isinstance(arg, tuple):
+                    calls.extend(a for a in arg if isinstance(a, CallNode))
+            accessor.elements = {
+                c: self.elements[c] for c in calls if c in self.elements
+            }
+        if self.tree_inputs is not None:
+            accessor.tree_inputs = {}
+            if call in self.tree_inputs:
+                accessor.tree_inputs[call] = self.tree_inputs[call]
+        return accessor
 
     def load_result(self, call, hash=None):
+        if fused_calls(call) is not None:
+            return None
+
+        consumed = _consumed_results.get()
+        if consumed is not None:
+            consumed[call] = hash
+
+        preloaded = _preloaded_results.get()
+        if call in preloaded:
+            return preloaded[call]
+
         namespace = self.store / 'results' / call
         hash = hash if hash is not None else namespace['latest']
-        return namespace[hash]
+        if _result_cache is None or self.store_token is None:
+            return namespace[hash]
+        return _result_cache.load(
+            (self.store_token, call, hash), lambda: namespace[hash]
+        )
 
     def store_result(self, call, hash, result):
+        if fused_calls(call) is not None:
+            # The calls it ran have stored their results
+            return
+
         namespace = self.store / 'results' / call
         namespace[hash] = result
+        cached = _result_cache is not None and self.store_token is not None
+        # The result is pickled at most once, for its digest and the cache
+        pickled = None
+        if self.early_cutoff is not None or cached:
+            pickled = pickle.dumps(result)
+        if self.early_cutoff is not None:
+            digests = self.store / 'digests' / call
+            digests[hash] = hashlib.sha256(pickled).digest()
+        if self.elements is not None:
+            # Elements are stored before the result is marked as the latest,
+            # so that they are there when the result is found
+            for subscript in self.elements.get(call, ()):
+                elements = self.store / 'elements' / call._replace(
+                    subscript=subscript
+                )
+                elements[hash] = result_element(result, subscript)
         namespace['latest'] = hash
+        if cached:
+            _result_cache.put((self.store_token, call, hash), pickled)
 
     def completed(self, call, hash=None):
+        calls = fused_calls(call)
+        if calls is not None:
+            # The last call is stored last, and is checked first
+            return all(
+                self.completed(c, self.function_hashes.get(c.function_name))
+                for c in reversed(calls)
+            )
+
         namespace = self.store / 'results' / call
 
         if hash is not None:
@@ -52,11 +262,349 @@ class StoreAccessor:
 
         return False
 
+    def peak_memory(self, function_name):
+        """
+        The largest peak resident set size in bytes recorded for calls to a
+        function, None if nothing is recorded. Peaks are recorded by function
+        name rather than version, since edits rarely change memory use much.
+        """
+        namespace = self.store / 'resources' / function_name
+        if 'peak_memory' in namespace:
+            return namespace['peak_memory']
+        return None
+
+    def record_peak_memory(self, function_name, peak):
+        namespace = self.store / 'resources' / function_name
+        recorded = self.peak_memory(function_name)
+        if recorded is None or peak > recorded:
+            namespace['peak_memory'] = peak
+
+    def runtimes(self, function_name):
+        namespace = self.store / 'resources' / function_name
+        if 'runtimes' in namespace:
+            return namespace['runtimes']
+        return []
+
+    def record_runtimes(self, function_name, runtimes, keep=100):
+        """
+        Add runtimes in seconds to those recorded for a function, keeping only
+        the most recent ones
+        """
+        namespace = self.store / 'resources' / function_name
+        recorded = self.runtimes(function_name) + list(runtimes)
+        namespace['runtimes'] = recorded[-keep:]
+
+    def mark_started(self, call, hash):
+        """
+        Record the time a call started executing, used by drivers to tell
+        calls that run from calls that wait in a queue. A later start of the
+        same call replaces the mark
+        """
+        namespace = self.store / 'started' / call
+        namespace[hash] = time.time()
+
+    def started(self, call, hash):
+        """
+        The time the call was last marked as started, None if it is not
+        """
+        namespace = self.store / 'started' / call
+        if hash in namespace:
+            return namespace[hash]
+        return None
+
+    def forget_started(self, call, hash):
+        namespace = self.store / 'started' / call
+        if hash in namespace:
+            del namespace[hash]
+
+    def lease(self, call, hash):
+        """
+        A lease on executing a call, not yet acquired. None unless single
+        flight mode is enabled by a `lease_ttl`
+        """
+        if self.lease_ttl is None:
+            return None
+        return Lease(self.store / 'leases' / call, hash, self.lease_ttl)
+
+    @contextlib.contextmanager
+    def claim(self, call, hash):
+        """
+        In single flight mode, runs sharing a store execute each call only
+        once at a time. The context waits for the lease on the call, and holds
+        it until the call is executed and stored. It gives False if the call
+        was completed by another run in the meantime, and True if the caller
+        should execute it. Without a `lease_ttl`, it always gives True.
+
+        If failures are remembered, a call with a known failure raises
+        `KnownFailureError` without being executed, and an exception raised
+        while executing a call is recorded before it is passed on.
+
+        Examples
+        --------
+
+        >>> with store_accessor.claim(call, func.hash) as claimed:
+        ...     if claimed:
+        ...         store_accessor.store_result(call, func.hash, func())
+        """
+        with self.hold_lease(call, hash) as claimed:
+            if claimed and self.early_cutoff is not None:
+                claimed = not self.cut_off(call, hash)
+            if not claimed:
+                yield False
+                return
+            with contextlib.ExitStack() as stack:
+                if self.remember_failures:
+                    stack.enter_context(self.failure_memory(call, hash))
+                if self.early_cutoff is not None:
+                    stack.enter_context(self.input_recorder(call, hash))
+                yield True
+
+    @contextlib.contextmanager
+    def hold_lease(self, call, hash):
+        lease = self.lease(call, hash)
+        if lease is None:
+            yield True
+            return
+
+        waiting = False
+        while not lease.acquire():
+            if not waiting:
+                logger.info('{} is executed elsewhere, waiting'.format(call))
+                waiting = True
+            if self.completed(call, hash):
+                yield False
+                return
+            time.sleep(lease.poll_interval)
+        try:
+            # The lease may have been released by a run that completed it
+            yield not self.completed(call, hash)
+        finally:
+            lease.release()
+
+    def cut_off(self, call, hash):
+        """
+        Early cutoff. If the function of a call only changed in the functions
+        it depends on, and the results the call loaded when it was last
+        executed are unchanged, its result is stored for the new function
+        hash without executing it. True if the result was reused
+        """
+        hashes = self.early_cutoff.get(call.function_name)
+        if hashes is None or hashes[1] is None:
+            return False
+        namespace = self.store / 'results' / call
+        if 'latest' not in namespace:
+            return False
+        previous = namespace['latest']
+        inputs = self.store / 'inputs' / call
+        if previous == hash or previous not in inputs:
+            return False
+
+        source_hash, digests = inputs[previous]
+        if source_hash != hashes[1]:
+            return False
+        for input_call, digest in digests.items():
+            if digest is None or self.result_digest(input_call) != digest:
+                return False
+
+        logger.info('{} has unchanged inputs, reusing its result'.format(
+            call
+        ))
+        namespace[hash] = namespace[previous]
+        result_digests = self.store / 'digests' / call
+        if previous in result_digests:
+            result_digests[hash] = result_digests[previous]
+        if self.elements is not None:
+            for subscript in self.elements.get(call, ()):
+                elements = self.store / 'elements' / call._replace(
+                    subscript=subscript
+                )
+                if previous in elements:
+                    elements[hash] = elements[previous]
+        inputs[hash] = source_hash, digests
+        namespace['latest'] = hash
+        return True
+
+    def result_digest(self, call, hash=None):
+        """
+        The digest of the stored result of a call, None if it has none. The
+        hash of the function of the call in this run is used by default
+        """
+        if hash is None:
+            hashes = self.early_cutoff.get(call.function_name)
+            if hashes is None:
+                return None
+            hash = hashes[0]
+        digests = self.store / 'digests' / call
+        if hash in digests:
+            return digests[hash]
+        return None
+
+    @contextlib.contextmanager
+    def input_recorder(self, call, hash):
+        """
+        Context executing a call in early cutoff mode. Once the call succeeds,
+        the digests of the results it loaded are recorded, along with the
+        source hash of its function
+        """
+        with consumed_results() as consumed:
+            yield
+        self.record_inputs(call, hash, consumed)
+
+    def record_inputs(self, call, hash, consumed):
+        hashes = self.early_cutoff.get(call.function_name)
+        if hashes is None or hashes[1] is None:
+            return
+        source_hash = hashes[1]
+        inputs = self.store / 'inputs' / call
+        inputs[hash] = source_hash, {
+            input_call: self.result_digest(input_call, input_hash)
+            for input_call, input_hash in consumed.items()
+        }
+
+    @contextlib.contextmanager
+    def failure_memory(self, call, hash):
+        """
+        Context executing a call with failures remembered. Raises
+        `KnownFailureError` if the call is known to fail, and otherwise
+        records the exception raised in the context, if any.
+        """
+        known = self.known_failure(call, hash)
+        if known is not None:
+            raise KnownFailureError(known)
+        start = time.time()
+        try:
+            yield
+        except Exception as e:
+            if self.remembers(e):
+                self.record_failure(
+                    call, hash, e, traceback.format_exc(), time.time() - start
+                )
+            raise
+        # A failure of an earlier version of the function is outdated
+        self.forget_failure(call)
+
+    def remembers(self, exception):
+        """
+        True if a failure with the given exception is remembered. Given a
+        tuple of exception types to remember, only failures with these are
+        remembered. Otherwise failures with any exception are remembered,
+        except transient ones such as timeouts and lost connections
+        """
+        if self.remember_failures is True:
+            return not isinstance(exception, TRANSIENT_ERRORS)
+        if not self.remember_failures:
+            return False
+        return isinstance(exception, self.remember_failures)
+
+    def record_failure(self, call, hash, exception, formatted_traceback,
+                       runtime):
+        """
+        Record that a call failed with an exception after running for a
+        number of seconds. Only the latest failure of a call is kept
+        """
+        namespace = self.store / 'failures'
+        namespace[call] = KnownFailure(
+            call, hash, exception, formatted_traceback, runtime
+        )
+
+    def known_failure(self, call, hash):
+        namespace = self.store / 'failures'
+        if call not in namespace:
+            return None
+        failure = namespace[call]
+        if failure.hash != hash:
+            return None
+        return failure
+
+    def known_failures(self):
+        namespace = self.store / 'failures'
+        return [namespace[call] for call in namespace.keys()]
+
+    def forget_failure(self, call):
+        namespace = self.store / 'failures'
+        if call in namespace:
+            del namespace[call]
+
+    def store_arguments(self, calls):
+        """
+        Store the interned arguments of calls, and of the calls they fuse or
+        batch, unless they are stored already. Each argument is stored once,
+        keyed by its digest
+        """
+        namespace = self.store / 'arguments'
+        seen = set()
+        for call in calls:
+            if not isinstance(call, CallNode):
+                continue
+            for arg in interned_arguments(call):
+                if arg.digest in seen or not arg.kept:
+                    continue
+                seen.add(arg.digest)
+                if arg.digest not in namespace:
+                    namespace[arg.digest] = arg.value
+
+    def load_argument(self, digest):
+        namespace = self.store / 'arguments'
+        return namespace[digest]
+
+    def load_element(self, call, hash=None):
+        """
+        Load the element of a result that a subscripted call refers to. If
+        the element was stored in an entry of its own, only the element is
+        loaded, otherwise it is found in the whole result
+        """
+        result_call = call._replace(subscript=())
+        if result_call not in _preloaded_results.get():
+            consumed = _consumed_results.get()
+            if consumed is not None:
+                consumed[result_call] = hash
+            namespace = self.store / 'results' / result_call
+            hash = hash if hash is not None else namespace['latest']
+            elements = self.store / 'elements' / call
+            if hash in elements:
+                return elements[hash]
+        result = self.load_result(result_call, hash=hash)
+        return result_element(result, call.subscript)
+
+    def load_lazily(self, value, hashes):
+        """
+        Resolve a value of a with constants statement, loading as little as
+        possible up front. The results of calls are loaded, and maps and
+        reductions load their results as usual. Lists and tuples holding
+        calls become `LazyResults`, loading results as they are accessed, and
+        the values of dicts are resolved the same way
+
+        Parameters
+        ----------
+        value : Any
+            The value, holding calls in place of their results
+        hashes : mapping of str to bytes
+            Function hashes used to load the results, by function name
+        """
+        if isinstance(value, CallNode):
+            hash = hashes.get(value.function_name)
+            if len(value.subscript) == 0:
+                return self.load_result(value, hash=hash)
+            result = self.load_result(value._replace(subscript=()), hash=hash)
+            return result_element(result, value.subscript)
+        if isinstance(value, (MapNode, ReduceNode)):
+            return value.load(self)
+        if not holds_calls(value):
+            return value
+        if isinstance(value, dict):
+            return {
+                key: self.load_lazily(item, hashes)
+                for key, item in value.items()
+            }
+        return LazyResults(value, self, hashes)
+
     def resolve_call_args(self, call):
         """
         Given a call, return its arguments and keyword arguments. If any
         argument is a CallNode, the CallNode is replaced with a value loaded
-        from the store.
+        from the store. MapNodes are replaced by their results, loaded as they
+        are used, and ReduceNodes by the result of the reduction. Calls of
+        reduction trees are also given the partial results they combine.
 
         Parameters
         ----------
@@ -76,14 +624,14 @@ class StoreAccessor:
             if isinstance(arg, CallNode):
                 if len(arg.subscript) == 0:
                     return cache.setdefault(arg, self.load_result(arg))
-                # In case subscript is specified, find the value at the correct
-                # subscript by iterating thgough the result
-                result = iter(cache.setdefault(arg, self.load_result(arg)))
-                for subscript in arg.subscript:
-                    for _ in range(subscript):
-                        next(result)
-                    result = iter(next(result))
-                return next(result)
+                if self.elements is not None:
+                    return self.load_element(arg)
+                # Subscripted calls are executed separately, and their results
+                # are whole, find the element at the subscript
+                result = cache.setdefault(arg, self.load_result(arg))
+                return result_element(result, arg.subscript)
+            elif isinstance(arg, (MapNode, ReduceNode, InternedArgument)):
+                return arg.load(self)
             else:
                 return arg
 
@@ -91,8 +639,389 @@ class StoreAccessor:
             load_arg_value(arg)
             for arg in call.args
         ]
+        if self.tree_inputs is not None:
+            args.extend(
+                load_arg_value(partial)
+                for partial in self.tree_inputs.get(call, ())
+            )
         kwargs = {
             key: load_arg_value(arg)
             for key, arg in call.kwargs.items()
         }
         return args, kwargs
+
+
+def holds_calls(value):
+    """Holds calls
+
+    True if a value is a list, tuple, or dict holding calls, maps or
+    reductions, at any depth
+    """
+    if isinstance(value, dict):
+        value = value.values()
+    elif not isinstance(value, (list, tuple)):
+        return False
+    return any(
+        isinstance(item, (CallNode, MapNode, ReduceNode)) or holds_calls(item)
+        for item in value
+    )
+
+
+def result_element(result, subscript):
+    """Result element
+
+    The element of a result at a subscript. Integers index sequences, and
+    count the items of other iterables, as when a result is unpacked
+
+    Examples
+    --------
+
+    >>> result_element(('a', ('b', 'c')), (1, 0))
+    'b'
+    """
+    for key in subscript:
+        if isinstance(key, int) and not isinstance(result, Sequence):
+            result = next(itertools.islice(result, key, None))
+        else:
+            result = result[key]
+    return result
+
+
+def fused_calls(call):
+    """
+    The calls run by a call to a fused image, such as a chain or a batch, in
+    the order they are run. None for other calls
+    """
+    if (call.function_name == FUSED_NAME or
+            call.function_name.startswith(BATCHED_PREFIX)):
+        return call.args[0]
+    return None
+
+
+def interned_arguments(call):
+    """Interned arguments
+
+    The interned arguments of a call, and of the calls passed as arguments to
+    the internal functions of xun, such as the calls of a batch
+    """
+    for arg in (*call.args, *call.kwargs.values()):
+        if isinstance(arg, InternedArgument):
+            yield arg
+        elif call.function_name.startswith('_xun_'):
+            inner = arg if isinstance(arg, tuple) else (arg,)
+            for inner_call in inner:
+                if isinstance(inner_call, CallNode):
+                    yield from (
+                        a for a in (
+                            *inner_call.args, *inner_call.kwargs.values()
+                        )
+                        if isinstance(a, InternedArgument)
+                    )
+
+
+class KnownFailure:
+    """KnownFailure
+
+    A failure of a call, recorded in the store so that later runs can fail
+    the call without executing it again
+
+    Attributes
+    ----------
+    call : CallNode
+        The call that failed
+    hash : bytes
+        Hash of the version of the function that failed
+    exception : Exception or None
+        The exception raised by the call, None if it could not be pickled
+    description : str
+        Representation of the exception
+    traceback : str
+        The formatted traceback of the exception
+    runtime : float
+        Seconds the call ran before it failed
+    failed_at : float
+        When the call failed, in seconds since the epoch
+    """
+
+    def __init__(self, call, hash, exception, formatted_traceback, runtime):
+        self.call = call
+        self.hash = hash
+        self.description = repr(exception)
+        self.traceback = formatted_traceback
+        self.runtime = runtime
+        self.failed_at = time.time()
+        try:
+            self.exception = pickle.loads(pickle.dumps(exception))
+        except Exception:
+            self.exception = None
+
+    def __repr__(self):
+        return 'KnownFailure({}, {})'.format(self.call, self.description)
+
+    def __str__(self):
+        return '{} failed in an earlier run after {:.1f} seconds\n{}'.format(
+            self.call, self.runtime, self.traceback.rstrip()
+        )
+
+
+class Lease:
+    """Lease
+
+    A lease on a key of a store. Once acquired, it is renewed by a background
+    thread every third of its time to live, so that it is held for as long as
+    the holder is alive. If the holder dies, the lease expires and another
+    executor may take over.
+
+    Parameters
+    ----------
+    namespace : Store
+        The store holding the lease
+    key : Any
+        The leased key
+    ttl : float
+        Time to live of the lease in seconds
+    """
+
+    def __init__(self, namespace, key, ttl):
+        self.namespace = namespace
+        self.key = key
+        self.ttl = ttl
+        self.owner = '{}:{}:{}'.format(
+            socket.gethostname(), os.getpid(), uuid.uuid4().hex
+        )
+        self.poll_interval = min(1.0, ttl / 10)
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def acquire(self):
+        """
+        Try to acquire the lease, True if it was acquired
+        """
+        if not self.namespace.acquire_lease(self.key, self.owner, self.ttl):
+            return False
+        self._stop.clear()
+        self._heartbeat = threading.Thread(
+            target=self._renew,
+            name='xun-lease-heartbeat',
+            daemon=True,
+        )
+        self._heartbeat.start()
+        return True
+
+    def release(self):
+        if self._heartbeat is None:
+            return
+        self._stop.set()
+        self._heartbeat.join()
+        self._heartbeat = None
+        self.namespace.release_lease(self.key, self.owner)
+
+    def _renew(self):
+        while not self._stop.wait(self.ttl / 3):
+            if not self.namespace.renew_lease(self.key, self.owner, self.ttl):
+                logger.warning('Lost the lease on {}'.format(
+                    self.namespace.namespace
+                ))
+                return
+
+
+class ResultCache:
+    """ResultCache
+
+    Least recently used cache of results, bounded by the pickled size of the
+    results. Results are keyed by store, call, and function hash, and never
+    change once stored, so cached results are always valid. Results are kept
+    pickled, and every hit unpickles a new copy, so that calls mutating their
+    arguments do not change the results other calls load.
+
+    Parameters
+    ----------
+    max_bytes : int
+        The largest total size of the cached results
+
+    Methods
+    -------
+    load(key, load)
+        Returns a cached result, or loads and caches it
+    put(key, pickled)
+        Caches a pickled result
+    changes()
+        Results added and evicted since the last call
+    report(worker, store_token)
+        Summary of the cache activity since the last report
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.counts = Counter()
+        self.added = OrderedDict()
+        self.evicted = set()
+
+    def load(self, key, load):
+        try:
+            pickled = self.entries[key]
+        except KeyError:
+            self.counts['misses'] += 1
+            value = load()
+            self.put(key, pickle.dumps(value))
+            return value
+        self.entries.move_to_end(key)
+        self.counts['hits'] += 1
+        self.counts['bytes_saved'] += len(pickled)
+        return pickle.loads(pickled)
+
+    def put(self, key, pickled):
+        size = len(pickled)
+        if key in self.entries:
+            self.size -= len(self.entries.pop(key))
+        if size > self.max_bytes:
+            self.evict(key)
+            return
+        self.entries[key] = pickled
+        self.size += size
+        self.added[key] = size
+        self.evicted.discard(key)
+        while self.size > self.max_bytes:
+            evicted, evicted_pickled = self.entries.popitem(last=False)
+            self.size -= len(evicted_pickled)
+            self.evict(evicted)
+
+    def evict(self, key):
+        self.added.pop(key, None)
+        self.evicted.add(key)
+
+    def changes(self):
+        """Changes
+
+        Returns
+        -------
+        (dict, set)
+            Sizes by key of results added, and keys of results evicted, since
+            the last call
+        """
+        added, self.added = self.added, OrderedDict()
+        evicted, self.evicted = self.evicted, set()
+        return added, evicted
+
+    def report(self, worker, store_token):
+        """Report
+
+        Summary of the cache activity since the last report, for drivers to
+        route calls to where their inputs are cached.
+
+        Parameters
+        ----------
+        worker : str
+            Name of the reporting worker
+        store_token : str
+            Only results from the store with this token are reported
+
+        Returns
+        -------
+        dict
+            The worker name, the calls and sizes of results added to the
+            cache, the calls of results evicted, and the hit, miss, and bytes
+            saved counts
+        """
+        added, evicted = self.changes()
+        counts, self.counts = self.counts, Counter()
+        return {
+            'worker': worker,
+            'cached': [
+                (call, size) for (token, call, _), size in added.items()
+                if token == store_token
+            ],
+            'evicted': [
+                call for token, call, _ in evicted if token == store_token
+            ],
+            'counts': dict(counts),
+        }
+
+
+# The result cache of the process, results are cached for the lifetime of the
+# process
+_result_cache = None
+
+
+def enable_result_cache(max_bytes):
+    """Enable result cache
+
+    Keep results loaded and stored by store accessors in this process in a
+    least recently used cache. Typically enabled in worker processes, where
+    results produced by one task are often consumed by the next.
+
+    Parameters
+    ----------
+    max_bytes : int
+        The largest total size of the cached results
+
+    Returns
+    -------
+    ResultCache
+        The result cache of the process
+    """
+    global _result_cache
+    if _result_cache is None:
+        _result_cache = ResultCache(max_bytes)
+    _result_cache.max_bytes = max_bytes
+    return _result_cache
+
+
+_preloaded_results = contextvars.ContextVar('preloaded_results', default={})
+
+
+@contextlib.contextmanager
+def preloaded_results(results):
+    """Preloaded results
+
+    Within this context, store accessors return the given results instead of
+    loading them from the store. Drivers use this to pass results computed
+    in the same run directly to the calls that need them. The results must be
+    those of the function versions that are being run. Results preloaded by
+    an enclosing context remain available.
+
+    Parameters
+    ----------
+    results : mapping of CallNode to Any
+        Results by call
+
+    Examples
+    --------
+
+    >>> with preloaded_results({CallNode('f', 1): 2}):
+    ...     args, kwargs = store_accessor.resolve_call_args(call)
+    """
+    token = _preloaded_results.set({**_preloaded_results.get(), **results})
+    try:
+        yield
+    finally:
+        _preloaded_results.reset(token)
+
+
+_consumed_results = contextvars.ContextVar('consumed_results', default=None)
+
+
+@contextlib.contextmanager
+def consumed_results():
+    """Consumed results
+
+    Context collecting the results loaded in it. It gives a dict of the
+    function hash used to load each loaded call, None if no hash was given.
+
+    Examples
+    --------
+
+    >>> with consumed_results() as consumed:
+    ...     store_accessor.load_result(call, hash)
+    ...
+    >>> consumed
+    {call: hash}
+    """
+    consumed = {}
+    token = _consumed_results.set(consumed)
+    try:
+        yield consumed
+    finally:
+        _consumed_results.reset(token)
@@ -13,6 +13,7 @@ The code is represented by and manipulated with the python ast module [1][2].
 
 
 from .compatibility import ast
+from .errors import XunSyntaxError
 from .function_description import FunctionDescription
 from .function_description import describe
 from .function_image import FunctionImage
@@ -40,7 +41,7 @@ class FunctionDecomposition(types.SimpleNamespace):
     -------
     apply(transform, *args, **kwargs)
         Apply transform and return new FunctionDecomposition
-    assemble(*nodes)
+    assemble(*nodes, coroutine=None)
         Assemble FunctionDecomposition into Function object with the given
         function body ast.AST nodes.
     update(changed, new_desc)
@@ -129,7 +130,7 @@ class FunctionDecomposition(types.SimpleNamespace):
         """
         return transformation(copy.copy(self), *args, **kwargs)
 
-    def assemble(self, *nodes):
+    def assemble(self, *nodes, coroutine=None):
         """Assemble serializable `FunctionImage` representation
 
         Takes a list of lists of statements and assembles a serializable
@@ -140,6 +141,9 @@ class FunctionDecomposition(types.SimpleNamespace):
         *nodes : vararg of list of ast.AST nodes
             lists of statements (in order) to be used as the statements of the
             generated function body
+        coroutine : bool, optional
+            Whether or not the generated function should be defined with
+            `async def`. Defaults to the same as the described function
 
         Returns
         -------
@@ -150,10 +154,14 @@ class FunctionDecomposition(types.SimpleNamespace):
 
         body = list(chain(*nodes))
 
+        if coroutine is None:
+            coroutine = isinstance(self.desc.ast.body[0], ast.AsyncFunctionDef)
+        fdef_type = ast.AsyncFunctionDef if coroutine else ast.FunctionDef
+
         fdef = ast.fix_missing_locations(ast.Module(
             type_ignores=[],
             body=[
-                ast.FunctionDef(
+                fdef_type(
                     name=self.desc.name,
                     args=args,
                     decorator_list=[],
@@ -244,6 +252,58 @@ def unpack_unpacking_assignments(nodes):
     ]
 
 
+def is_xun_primitive_call(node, desc, name):
+    """
+    True if the node is a call to the xun primitive with the given name, such
+    as `map` or `reduce`, through a module alias of xun referenced by the
+    described function. For example `xun.map(f, items)`.
+    """
+    return (
+        isinstance(node, ast.Call) and
+        isinstance(node.func, ast.Attribute) and
+        node.func.attr == name and
+        isinstance(node.func.value, ast.Name) and
+        any(
+            m.asname == node.func.value.id and
+            m.module in ('xun', 'xun.functions')
+            for m in desc.referenced_modules
+        )
+    )
+
+
+def xun_primitive_function_name(node, dependencies):
+    """
+    The name of the xun function given to a call to a xun primitive, such as
+    the function mapped by `xun.map`
+    """
+    if (len(node.args) < 2
+        or not isinstance(node.args[0], ast.Name)
+        or node.args[0].id not in dependencies):
+        msg = 'xun.{} takes a xun function and an iterable of items'.format(
+            node.func.attr
+        )
+        raise XunSyntaxError(msg)
+    return node.args[0].id
+
+
+def xun_primitive_call(node, dependencies, constructor):
+    """
+    Replace a call to a xun primitive by a call to the given constructor,
+    with the name and hash of the xun function given to the primitive. For
+    example `xun.map(f, items)` becomes `constructor('f', items, hash=...)`.
+    """
+    fname = xun_primitive_function_name(node, dependencies)
+    hash = dependencies[fname].hash
+    return ast.Call(
+        func=ast.Name(id=constructor, ctx=ast.Load()),
+        args=[ast.Constant(fname, kind=None), *node.args[1:]],
+        keywords=[
+            *node.keywords,
+            ast.keyword('hash', ast.Constant(hash, kind=None)),
+        ],
+    )
+
+
 #
 # Transformations
 #
@@ -393,6 +453,8 @@ def build_xun_graph(
     def helper_code():
         from itertools import chain as _xun_chain
         from xun.functions import CallNode as _xun_CallNode
+        from xun.functions import MapNode as _xun_MapNode
+        from xun.functions import ReduceNode as _xun_ReduceNode
         import networkx as _xun_nx
 
         _xun_graph = _xun_nx.DiGraph()
@@ -402,24 +464,57 @@ def build_xun_graph(
                                **kwargs):
 
             # Any references to results from other xun functions must be loaded
-            dependencies = filter(
-                lambda a: isinstance(a, _xun_CallNode),
-                _xun_chain(args, kwargs.values())
-            )
+            dependencies = []
+            for a in _xun_chain(args, kwargs.values()):
+                if isinstance(a, _xun_CallNode):
+                    dependencies.append(a)
+                elif isinstance(a, _xun_MapNode):
+                    dependencies.extend(a.chunks())
+                elif isinstance(a, _xun_ReduceNode):
+                    dependencies.append(a.root())
             call = _xun_CallNode(fname, *args, **kwargs)
             _xun_graph.add_node(call)
             _xun_graph.add_edges_from((dep, call) for dep in dependencies)
             return call
 
+        def _xun_register_map(fname, items, hash=None, chunk_size=None):
+            node = _xun_MapNode(fname, items, hash=hash, chunk_size=chunk_size)
+            for chunk in node.chunks():
+                _xun_graph.add_node(chunk)
+                _xun_graph.add_edges_from(
+                    (item, chunk) for item in chunk.args[0]
+                    if isinstance(item, _xun_CallNode)
+                )
+            return node
+
+        def _xun_register_reduce(fname, items, fan_in=8, hash=None):
+            node = _xun_ReduceNode(fname, items, fan_in=fan_in, hash=hash)
+            tree = node.graph()
+            _xun_graph.add_nodes_from(tree.nodes)
+            _xun_graph.add_edges_from(tree.edges)
+            return node
+
     header = helper_code.body[0].body
 
     class RegisterCallWrapper(ast.NodeTransformer):
         """
-        Transformation any calls to a xun function to _xun_register_call
+        Transformation any calls to a xun function to _xun_register_call, and
+        any calls to xun.map and xun.reduce to _xun_register_map and
+        _xun_register_reduce
         """
         def visit_Call(self, node):
             node = self.generic_visit(node)
 
+            if is_xun_primitive_call(node, func.desc, 'map'):
+                return xun_primitive_call(
+                    node, dependencies, '_xun_register_map'
+                )
+
+            if is_xun_primitive_call(node, func.desc, 'reduce'):
+                return xun_primitive_call(
+                    node, dependencies, '_xun_register_reduce'
+                )
+
             if not isinstance(node.func, ast.Name):
                 return node
 
@@ -460,6 +555,7 @@ def build_xun_graph(
 def load_from_store(
         func: FunctionDecomposition,
         dependencies={},
+        lazy=False,
     ):
     """Load from Store Transformation
 
@@ -473,6 +569,10 @@ def load_from_store(
     func : FunctionDecomposition
     dependencies : mapping from str to Function
         maps names of dependencies to their Functions
+    lazy : bool
+        If true, the values used by the body are computed with calls in
+        place of their results, and resolved by `StoreAccessor.load_lazily`.
+        Lists and tuples of calls are then loaded as they are accessed
 
     Returns
     -------
@@ -511,6 +611,12 @@ def load_from_store(
             node.func.id in dependencies
         )
 
+    def is_xun_map(node):
+        return is_xun_primitive_call(node, func.desc, 'map')
+
+    def is_xun_reduce(node):
+        return is_xun_primitive_call(node, func.desc, 'reduce')
+
     class NodeMapper(ast.NodeTransformer):
         def map(self, nodes):
             transformed = (self.visit(copy.deepcopy(node)) for node in nodes)
@@ -520,6 +626,14 @@ def load_from_store(
         def visit_Call(self, node):
             node = self.generic_visit(node)
 
+            if is_xun_map(node):
+                return xun_primitive_call(node, dependencies, '_xun_MapNode')
+
+            if is_xun_reduce(node):
+                return xun_primitive_call(
+                    node, dependencies, '_xun_ReduceNode'
+                )
+
             if not is_xun_call(node):
                 return node
 
@@ -539,8 +653,12 @@ def load_from_store(
             introduced_names = stmt_introduced_names(node)
             if any(is_referenced_in_body(name) for name in introduced_names):
                 self.output_targets.extend(node.targets)
+                if lazy:
+                    return lazy_load(node.value)
                 return self.visit(node.value)
-            if is_xun_call(node.value):
+            if (is_xun_call(node.value)
+                or is_xun_map(node.value)
+                or is_xun_reduce(node.value)):
                 target_names = list(
                     target.id for target in flatten_assignment_targets(node))
                 self.known_call_nodes.update(
@@ -548,7 +666,8 @@ def load_from_store(
             return None
 
         def visit_Call(self, node):
-            if not is_xun_call(node):
+            if not (is_xun_call(node) or is_xun_map(node)
+                    or is_xun_reduce(node)):
                 return self.generic_visit(node)
             return self.add_loading_from_store(node)
 
@@ -561,6 +680,21 @@ def load_from_store(
         def add_loading_from_store(self, node):
             call_node = Call2CallNode().visit(node)
 
+            if is_xun_map(node) or is_xun_reduce(node):
+                # Maps and reductions load their results themselves, maps
+                # lazily as they are used
+                return ast.Call(
+                    func=ast.Attribute(
+                        value=call_node,
+                        attr='load',
+                        ctx=ast.Load(),
+                    ),
+                    args=[
+                        ast.Name(id='_xun_store_accessor', ctx=ast.Load()),
+                    ],
+                    keywords=[],
+                )
+
             hash = dependencies[node.func.id].hash
             hash_expr = ast.Constant(value=hash, kind=None)
 
@@ -578,6 +712,20 @@ def load_from_store(
 
             return store_accessor_load_call
 
+    def lazy_load(node):
+        return ast.Call(
+            func=ast.Attribute(
+                value=ast.Name(id='_xun_store_accessor', ctx=ast.Load()),
+                attr='load_lazily',
+                ctx=ast.Load(),
+            ),
+            args=[
+                Call2CallNode().visit(node),
+                ast.Name(id='_xun_hashes', ctx=ast.Load()),
+            ],
+            keywords=[],
+        )
+
     # If No dependencies are referenced in the body of the function, there is
     # nothing to load
     if len(discovered_reference.referenced_in_body) == 0:
@@ -589,6 +737,15 @@ def load_from_store(
         if isinstance(node, ast.Assign)
     ]
 
+    uses_map = any(
+        is_xun_map(node)
+        for assignment in assignments for node in ast.walk(assignment)
+    )
+    uses_reduce = any(
+        is_xun_reduce(node)
+        for assignment in assignments for node in ast.walk(assignment)
+    )
+
     # Converts calls to xun functions to CallNodes
     call_nodes = Call2CallNode().map(assignments)
     call_nodes = unpack_unpacking_assignments(call_nodes)
@@ -608,6 +765,18 @@ def load_from_store(
                     name='CallNode',
                     asname='_xun_CallNode'
                 ),
+                *([
+                    ast.alias(
+                        name='MapNode',
+                        asname='_xun_MapNode'
+                    ),
+                ] if uses_map else []),
+                *([
+                    ast.alias(
+                        name='ReduceNode',
+                        asname='_xun_ReduceNode'
+                    ),
+                ] if uses_reduce else []),
             ],
             level=0,
         ),
@@ -645,6 +814,22 @@ def load_from_store(
                 ),
                 type_comment=None,
             ),
+            *([
+                ast.Assign(
+                    targets=[ast.Name(id='_xun_hashes', ctx=ast.Store())],
+                    value=ast.Dict(
+                        keys=[
+                            ast.Constant(value=name, kind=None)
+                            for name in dependencies
+                        ],
+                        values=[
+                            ast.Constant(value=dep.hash, kind=None)
+                            for dep in dependencies.values()
+                        ],
+                    ),
+                    type_comment=None,
+                ),
+            ] if lazy else []),
             *call_nodes,
             ast.Return(
                 value=ast.Tuple(elts=loads, ctx=ast.Load())
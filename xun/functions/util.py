@@ -85,10 +85,14 @@ def strip_decorators(tree):
         Function AST without decorators
     """
     fdef = tree.body[0]
+    fdef_type = (
+        ast.AsyncFunctionDef if isinstance(fdef, ast.AsyncFunctionDef)
+        else ast.FunctionDef
+    )
     new = ast.Module(
         type_ignores=tree.type_ignores,
         body=[
-            ast.FunctionDef(
+            fdef_type(
                 name=fdef.name,
                 args=fdef.args,
                 body=fdef.body,
@@ -457,6 +461,9 @@ def check_with_constants(node):
     if has_mutating_assignments(node):
         raise ValueError('Mutating assignments not allowed in with constants '
                          f'statement: {node}')
+    if has_await(node):
+        raise ValueError('Await not allowed in with constants statement: '
+                         f'{node}')
 
 
 def is_with_constants(node):
@@ -496,6 +503,19 @@ def is_assignments_and_expressions(node):
     return all(isinstance(node, (ast.Assign, ast.Expr)) for node in node.body)
 
 
+def has_await(node):
+    """Has await
+
+    Returns
+    -------
+    bool
+        Whether or not the node contains await expressions. With constants
+        statements are evaluated synchronously during scheduling, and can
+        therefore not await anything.
+    """
+    return any(isinstance(n, ast.Await) for n in ast.walk(node))
+
+
 def has_mutating_assignments(node):
     """Has mutating assignments
 
@@ -1,3 +1,4 @@
+from .helpers import PicklableMemoryStore
 from collections import namedtuple
 from pathlib import Path
 from pyshd import pushd
@@ -20,6 +21,24 @@ def tmpwd(tmp_path):
         yield tmpwd_paths(Path(old), tmp_path)
 
 
+@pytest.fixture()
+def loaded_results(monkeypatch):
+    """
+    Calls whose results are loaded from PicklableMemoryStores, in the order
+    they are loaded
+    """
+    loaded = []
+
+    class CountingDriver(PicklableMemoryStore.Driver):
+        def __getitem__(self, key):
+            if key.namespace[:1] == ('results',) and key.key != 'latest':
+                loaded.append(key.namespace[1])
+            return super().__getitem__(key)
+
+    monkeypatch.setattr(PicklableMemoryStore, 'Driver', CountingDriver)
+    return loaded
+
+
 @pytest.fixture()
 def xun_celery_worker(request,
                       celery_worker_pool,
@@ -29,6 +48,9 @@ def xun_celery_worker(request,
     xun.functions.driver.celery.celery_app.conf.update(
         broker_url='memory://',
         result_backend='rpc://',
+        # As if started with --xun-locality, so that calls can be routed to
+        # the worker
+        worker_direct=True,
     )
     with celery.contrib.testing.worker.start_worker(
             xun.functions.driver.celery.celery_app,
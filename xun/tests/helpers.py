@@ -28,7 +28,7 @@ class PickleDriver(xun.functions.driver.Sequential):
     """
     Test driver ensuring that anything touched by the driver can be pickled
     """
-    def exec(self, graph, entry_call, function_images, store):
+    def exec(self, graph, entry_call, function_images, store, **kwargs):
         import pickle
 
         P = {
@@ -43,6 +43,7 @@ class PickleDriver(xun.functions.driver.Sequential):
             entry_call=pickle.loads(P['entry_call']),
             function_images=pickle.loads(P['function_images']),
             store=pickle.loads(P['store']),
+            **kwargs,
         )
 
 
@@ -0,0 +1,73 @@
+from .helpers import sample_sin_blueprint
+import asyncio
+import xun
+
+
+def test_asyncio_driver():
+    blueprint, expected = sample_sin_blueprint()
+
+    result = blueprint.run(
+        driver=xun.functions.driver.Asyncio(),
+        store=xun.functions.store.Memory(),
+    )
+
+    assert result == expected
+
+
+concurrency = {'current': 0, 'max': 0}
+
+
+def test_asyncio_driver_concurrency_limit():
+    @xun.function()
+    async def wait_for(i):
+        concurrency['current'] += 1
+        concurrency['max'] = max(concurrency['max'], concurrency['current'])
+        await asyncio.sleep(0.01)
+        concurrency['current'] -= 1
+        return i
+
+    @xun.function()
+    def gather(n):
+        return sum(values)
+        with ...:
+            values = [wait_for(i) for i in range(n)]
+
+    result = gather.blueprint(20).run(
+        driver=xun.functions.driver.Asyncio(concurrency_limit=3),
+        store=xun.functions.store.Memory(),
+    )
+
+    assert result == sum(range(20))
+    assert concurrency['max'] == 3
+
+
+parallel = {'current': 0, 'max': 0}
+
+
+def test_asyncio_driver_max_parallel():
+    @xun.function(max_parallel=2)
+    async def limited(i):
+        parallel['current'] += 1
+        parallel['max'] = max(parallel['max'], parallel['current'])
+        await asyncio.sleep(0.01)
+        parallel['current'] -= 1
+        return i
+
+    @xun.function()
+    async def free(i):
+        return i
+
+    @xun.function()
+    def gather(n):
+        return sum(values) + sum(others)
+        with ...:
+            values = [limited(i) for i in range(n)]
+            others = [free(i) for i in range(n)]
+
+    result = gather.blueprint(10).run(
+        driver=xun.functions.driver.Asyncio(),
+        store=xun.functions.store.Memory(),
+    )
+
+    assert result == 2 * sum(range(10))
+    assert parallel['max'] == 2
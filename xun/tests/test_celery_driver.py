@@ -1,6 +1,8 @@
 from .helpers import PicklableMemoryStore
 from xun.functions import CallNode
+import asyncio
 import gc
+import pytest
 import threading
 import time
 import xun
@@ -20,6 +22,108 @@ def test_celery_driver(xun_celery_worker):
     assert result == expected
 
 
+def test_celery_driver_worker_scheduling(xun_celery_worker):
+    from .reference import decending_fibonacci
+
+    with PicklableMemoryStore() as store:
+        blueprint = decending_fibonacci.blueprint(6)
+        result = blueprint.run(
+            driver=xun.functions.driver.Celery(
+                broker_url='memory://',
+                scheduler='workers',
+            ),
+            store=store,
+        )
+        assert len(store / 'celery') == 0
+
+    expected = [5, 3, 2, 1, 1, 0]
+    assert result == expected
+
+
+def test_celery_driver_worker_scheduling_failure(xun_celery_worker):
+    @xun.function()
+    def fail():
+        raise ValueError('fail')
+
+    @xun.function()
+    def workflow():
+        return value
+        with ...:
+            value = fail()
+
+    with PicklableMemoryStore() as store:
+        with pytest.raises(ValueError):
+            workflow.blueprint().run(
+                driver=xun.functions.driver.Celery(
+                    broker_url='memory://',
+                    scheduler='workers',
+                ),
+                store=store,
+            )
+
+
+def test_celery_workers_stop_scheduling_ended_runs():
+    from xun.functions.driver.celery import WorkerPlan
+    from xun.functions.driver.celery import celery_xun_exec_and_trigger
+    from xun.functions.driver.celery import load_worker_plan
+    from xun.functions.store import StoreAccessor
+
+    @xun.function()
+    def number(i):
+        return i
+
+    @xun.function()
+    def aggregate(n):
+        return sum(numbers)
+        with ...:
+            numbers = [number(i) for i in range(n)]
+
+    blueprint = aggregate.blueprint(2)
+
+    with PicklableMemoryStore() as store:
+        function_images = {
+            name: func.callable(extra_globals={'_xun_store': store})
+            for name, func in blueprint.functions.items()
+        }
+        store_accessor = StoreAccessor(store)
+        namespace = store / 'celery' / 'run'
+        namespace['plan'] = WorkerPlan(blueprint.graph, function_images)
+        assert load_worker_plan('run', namespace) is not None
+
+        # The driver removes the plan once the run has failed, workers that
+        # cached it no longer execute its calls
+        namespace.clear()
+        call = CallNode('number', 0)
+        celery_xun_exec_and_trigger('run', call, store_accessor)
+        assert not store_accessor.completed(call)
+        assert load_worker_plan('run', namespace) is None
+
+
+def test_celery_driver_result_cache(xun_celery_worker, monkeypatch):
+    from .reference import decending_fibonacci
+
+    # The worker runs in this process, keep its result cache to this test
+    monkeypatch.setattr(
+        xun.functions.store.store_accessor, '_result_cache', None
+    )
+
+    driver = xun.functions.driver.Celery(
+        broker_url='memory://',
+        result_cache_bytes=2**20,
+    )
+    with PicklableMemoryStore() as store:
+        blueprint = decending_fibonacci.blueprint(6)
+        result = blueprint.run(driver=driver, store=store)
+
+    expected = [5, 3, 2, 1, 1, 0]
+    assert result == expected
+
+    metrics = driver.cache_metrics()
+    assert metrics['hits'] > 0
+    assert metrics['bytes_saved'] > 0
+    assert metrics['routed'] > 0
+
+
 # Locks and other concurrency primitives cannot be pickled, so we cheat by
 # wrapping them in a non shared function
 events = {}
@@ -129,3 +233,245 @@ def test_celery_concurrency(xun_celery_worker):
     second_event.set()
 
     workflow_thread.join()
+
+
+def test_celery_driver_enqueues_nodes_once():
+    from xun.functions.driver.celery import AsyncCeleryState
+    from xun.functions.store import StoreAccessor
+
+    @xun.function()
+    def number(i):
+        return i
+
+    @xun.function()
+    def aggregate(n):
+        return sum(numbers)
+        with ...:
+            numbers = [number(i) for i in range(n)]
+
+    executed = []
+
+    class CountingState(AsyncCeleryState):
+        async def execute_task(self, node, queue):
+            executed.append(node)
+            await super().execute_task(node, queue)
+
+    blueprint = aggregate.blueprint(50)
+
+    with PicklableMemoryStore() as store:
+        # Complete every call up front, the state then only has to schedule
+        blueprint.run(driver=xun.functions.driver.Sequential(), store=store)
+
+        function_images = {
+            name: func.callable(extra_globals={'_xun_store': store})
+            for name, func in blueprint.functions.items()
+        }
+        state = CountingState(
+            None, blueprint.graph, function_images, StoreAccessor(store)
+        )
+        result = state(blueprint.call)
+
+    assert result == sum(range(50))
+    assert len(executed) == len(set(executed)) == len(blueprint.graph)
+
+
+def test_celery_driver_bounds_in_flight(monkeypatch):
+    from unittest import mock
+    from xun.functions.driver.celery import AsyncCeleryState
+    from xun.functions.driver.celery import celery_xun_exec
+    from xun.functions.store import StoreAccessor
+    import asyncio
+
+    @xun.function()
+    def number(i):
+        return i
+
+    @xun.function()
+    def aggregate(n):
+        return sum(numbers)
+        with ...:
+            numbers = [number(i) for i in range(n)]
+
+    observed = []
+
+    async def apply_async_locally(args, **options):
+        observed.append(state.gauges())
+        await asyncio.sleep(0.01)
+        return celery_xun_exec(*args)
+
+    monkeypatch.setattr(
+        celery_xun_exec, 'async_apply_async', apply_async_locally
+    )
+
+    blueprint = aggregate.blueprint(20)
+
+    with PicklableMemoryStore() as store:
+        function_images = {
+            name: func.callable(extra_globals={'_xun_store': store})
+            for name, func in blueprint.functions.items()
+        }
+        state = AsyncCeleryState(
+            mock.MagicMock(),
+            blueprint.graph,
+            function_images,
+            StoreAccessor(store),
+            max_in_flight=3,
+        )
+        result = state(blueprint.call)
+
+    assert result == sum(range(20))
+    assert len(observed) == len(blueprint.graph)
+    assert max(gauges['in_flight'] for gauges in observed) == 3
+    assert max(gauges['waiting'] for gauges in observed) > 0
+    assert state.gauges()['in_flight'] == 0
+
+
+def test_celery_publisher_batches_tasks():
+    from unittest import mock
+    from xun.functions.driver.celery import Publisher
+    import asyncio
+
+    pool = mock.MagicMock()
+    task = mock.MagicMock()
+
+    async def publish():
+        publisher = Publisher(asyncio.get_event_loop(), pool)
+        return await asyncio.gather(*[
+            publisher.publish(task, args=(i,)) for i in range(10)
+        ])
+
+    results = asyncio.run(publish())
+
+    assert results == [task.apply_async.return_value] * 10
+    assert pool.acquire.call_count == 1
+    assert task.apply_async.call_count == 10
+    producers = {
+        id(call.kwargs['producer']) for call in task.apply_async.call_args_list
+    }
+    assert len(producers) == 1
+
+
+def test_celery_result_listener_fails_tasks_when_results_fail():
+    from xun.functions.driver.celery import ResultListener
+
+    class DisabledBackend:
+        is_async = False
+
+        def get_many(self, task_ids, **kwargs):
+            raise NotImplementedError('No result backend is configured')
+
+    class AsyncResult:
+        id = 'task'
+        backend = DisabledBackend()
+
+    loop = asyncio.new_event_loop()
+    listener = ResultListener(loop, poll_interval=0.01)
+    listener.start()
+    try:
+        with pytest.raises(NotImplementedError):
+            loop.run_until_complete(
+                asyncio.wait_for(listener.wait(AsyncResult()), timeout=5)
+            )
+    finally:
+        listener.stop()
+        loop.close()
+
+
+def test_celery_driver_routes_calls_to_queues(monkeypatch):
+    from xun.functions.driver.celery import celery_xun_exec
+
+    @xun.function(queue='small')
+    def number(i):
+        return i
+
+    @xun.function()
+    def aggregate(n):
+        return sum(numbers)
+        with ...:
+            numbers = [number(i) for i in range(n)]
+
+    @xun.function(queue='small')
+    def workflow():
+        return total
+        with ...:
+            total = aggregate(3)
+
+    queues = {}
+
+    async def apply_async_locally(args, queue=None, **options):
+        call, *_ = args
+        queues[call] = queue
+        return celery_xun_exec(*args)
+
+    monkeypatch.setattr(
+        celery_xun_exec, 'async_apply_async', apply_async_locally
+    )
+
+    with PicklableMemoryStore() as store:
+        result = workflow.blueprint().run(
+            driver=xun.functions.driver.Celery(
+                broker_url='memory://',
+                routes={'workflow': 'large'},
+            ),
+            store=store,
+        )
+
+    assert result == 3
+    assert queues == {
+        CallNode('number', 0): 'small',
+        CallNode('number', 1): 'small',
+        CallNode('number', 2): 'small',
+        CallNode('aggregate', 3): None,
+        CallNode('workflow'): 'large',
+    }
+
+
+def test_celery_driver_records_runtimes(xun_celery_worker):
+    from .reference import decending_fibonacci
+
+    with PicklableMemoryStore() as store:
+        blueprint = decending_fibonacci.blueprint(6)
+        result = blueprint.run(
+            driver=xun.functions.driver.Celery(
+                broker_url='memory://',
+                speculate=3,
+            ),
+            store=store,
+        )
+        accessor = xun.functions.store.StoreAccessor(store)
+        assert len(accessor.runtimes('fibonacci_number')) > 0
+        entry_call = CallNode('decending_fibonacci', 6)
+        assert len(store / 'started' / entry_call) == 0
+
+    expected = [5, 3, 2, 1, 1, 0]
+    assert result == expected
+
+
+@pytest.mark.parametrize('scheduler', ['driver', 'workers'])
+def test_celery_driver_keep_going(xun_celery_worker, scheduler):
+    @xun.function()
+    def fragile(i):
+        if i == 1:
+            raise ValueError('bad input')
+        return i
+
+    @xun.function()
+    def workflow(n):
+        return values
+        with ...:
+            values = [fragile(i) for i in range(n)]
+
+    with PicklableMemoryStore() as store:
+        with pytest.raises(xun.functions.CallsFailedError) as exc_info:
+            workflow.blueprint(3).run(
+                driver=xun.functions.driver.Celery(
+                    broker_url='memory://',
+                    scheduler=scheduler,
+                ),
+                store=store,
+                keep_going=True,
+            )
+        report = exc_info.value.report
+        assert set(report.failed) == {CallNode('fragile', 1)}
+        assert report.skipped == {CallNode('workflow', 3)}
+        assert report.result(CallNode('fragile', 2)) == 2
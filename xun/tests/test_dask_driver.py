@@ -1,6 +1,8 @@
 from .helpers import PicklableMemoryStore
 from .helpers import sample_sin_blueprint
 from dask.distributed import Client
+from xun.functions import CallNode
+import pytest
 import xun
 
 
@@ -15,3 +17,128 @@ def test_dask_driver():
 
     assert result == expected
     client.close()
+
+
+def test_dask_driver_passes_results_in_memory(loaded_results):
+    client = Client(processes=False)
+    dask_driver = xun.functions.driver.Dask(client)
+
+    blueprint, expected = sample_sin_blueprint()
+
+    with PicklableMemoryStore() as store:
+        result = blueprint.run(driver=dask_driver, store=store)
+        assert result == expected
+
+        # Only the result of the entry call is loaded, by the driver
+        assert loaded_results == [blueprint.call]
+
+        # Completed calls are skipped without loading their results
+        result = blueprint.run(driver=dask_driver, store=store)
+        assert result == expected
+        assert loaded_results == [blueprint.call, blueprint.call]
+
+    client.close()
+
+
+@xun.function()
+def increment(n):
+    return previous + 1
+    with ...:
+        previous = increment(n - 1) if n > 0 else 0
+
+
+@xun.function()
+def report(n):
+    return value
+    with ...:
+        value = increment(n)
+
+
+def test_dask_driver_fuses_chains_and_annotates():
+    client = Client(processes=False)
+    dask_driver = xun.functions.driver.Dask(
+        client,
+        annotations={'report': {'priority': 10}},
+        fuse=True,
+    )
+
+    blueprint = report.blueprint(4)
+
+    with PicklableMemoryStore() as store:
+        function_images = {
+            name: func.callable(extra_globals={'_xun_store': store})
+            for name, func in blueprint.functions.items()
+        }
+        dsk, keys = dask_driver.dask_graph(
+            blueprint.graph,
+            function_images,
+            xun.functions.store.StoreAccessor(store),
+        )
+
+        # The chain of increments is fused into a single task
+        assert len(dsk) == 2
+        assert dsk.layers['report'].annotations == {'priority': 10}
+        assert len(keys) == 1
+
+        result = blueprint.run(driver=dask_driver, store=store)
+        assert result == 5
+
+    client.close()
+
+
+@xun.function(max_parallel=1)
+def exclusive(i):
+    import time
+    start = time.time()
+    time.sleep(0.05)
+    return start, time.time()
+
+
+@xun.function()
+def schedule(n):
+    return intervals
+    with ...:
+        intervals = [exclusive(i) for i in range(n)]
+
+
+def test_dask_driver_max_parallel():
+    client = Client(processes=False, n_workers=1, threads_per_worker=4)
+    dask_driver = xun.functions.driver.Dask(client)
+
+    with PicklableMemoryStore() as store:
+        intervals = schedule.blueprint(4).run(driver=dask_driver, store=store)
+
+    intervals = sorted(intervals)
+    assert all(
+        end <= start for (_, end), (start, _) in zip(intervals, intervals[1:])
+    )
+    client.close()
+
+
+def test_dask_driver_keep_going():
+    client = Client(processes=False)
+    dask_driver = xun.functions.driver.Dask(client)
+
+    @xun.function()
+    def fragile(i):
+        if i == 1:
+            raise ValueError('bad input')
+        return i
+
+    @xun.function()
+    def workflow(n):
+        return values
+        with ...:
+            values = [fragile(i) for i in range(n)]
+
+    with PicklableMemoryStore() as store:
+        with pytest.raises(xun.functions.CallsFailedError) as exc_info:
+            workflow.blueprint(3).run(
+                driver=dask_driver, store=store, keep_going=True
+            )
+        report = exc_info.value.report
+        assert set(report.failed) == {CallNode('fragile', 1)}
+        assert report.skipped == {CallNode('workflow', 3)}
+        assert report.result(CallNode('fragile', 2)) == 2
+
+    client.close()
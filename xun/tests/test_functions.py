@@ -5,6 +5,8 @@ from .helpers import run_in_process
 from xun.functions import CallNode
 from xun.functions import CopyError
 from xun.functions import XunSyntaxError
+import asyncio
+import pickle
 import pytest
 import networkx as nx
 import xun
@@ -160,6 +162,20 @@ def test_blueprint_is_picklable():
     assert result == expected
 
 
+def test_function_images_pickled_without_options_are_unpickled():
+    @xun.function()
+    def f(a):
+        return a + 1
+
+    image = f.callable()
+    old = xun.functions.FunctionImage.__new__(xun.functions.FunctionImage)
+    old.__setstate__(image.__getstate__()[:5])
+
+    assert old.options == {}
+    assert old.source_hash is None
+    assert old(1) == 2
+
+
 def test_failure_on_use_of_unresolved_call():
     def use(value):
         return value + 1
@@ -613,3 +629,512 @@ def test_symbolic_result_in_variable():
             indirect_value = h()
 
     assert run_in_process(f.blueprint()) == 'ab'
+
+
+def test_async_function():
+    @xun.function()
+    async def f(a):
+        await asyncio.sleep(0)
+        return a
+
+    @xun.function()
+    async def h():
+        await asyncio.sleep(0)
+        return a + b
+        with ...:
+            a = f('a')
+            b = f('b')
+
+    result = run_in_process(h.blueprint())
+
+    assert result == 'ab'
+
+
+def test_await_in_with_constants_fails():
+    async def f():
+        return 'a'
+
+    with pytest.raises(ValueError):
+        @xun.function()
+        async def h():
+            return a
+            with ...:
+                a = await f()
+
+
+def test_map():
+    @xun.function()
+    def square(i):
+        return i * i
+
+    @xun.function()
+    def total(values):
+        return sum(values)
+
+    @xun.function()
+    def sum_of_squares(n):
+        return sum(squares), list(squares[1:3]), summed
+        with ...:
+            squares = xun.map(square, range(n), chunk_size=3)
+            summed = total(squares)
+
+    blueprint = sum_of_squares.blueprint(10)
+
+    chunks = [
+        node for node in blueprint.graph.nodes
+        if node.function_name == '_xun_map_square'
+    ]
+    assert sorted(chunk.args[0] for chunk in chunks) == [
+        (0, 1, 2), (3, 4, 5), (6, 7, 8), (9,)
+    ]
+    total_call = next(
+        n for n in blueprint.graph.nodes if n.function_name == 'total'
+    )
+    assert set(blueprint.graph.predecessors(total_call)) == set(chunks)
+
+    store = xun.functions.store.Memory()
+    result = blueprint.run(
+        driver=xun.functions.driver.Sequential(),
+        store=store,
+    )
+
+    assert result == (285, [1, 4], 285)
+    store_accessor = xun.functions.store.StoreAccessor(store)
+    assert store_accessor.load_result(CallNode('square', 7)) == 49
+
+
+def test_map_requires_xun_function():
+    def square(i):
+        return i * i
+
+    @xun.function()
+    def f(n):
+        return squares
+        with ...:
+            squares = xun.map(square, range(n))
+
+    with pytest.raises(XunSyntaxError):
+        f.blueprint(3)
+
+
+def test_only_xun_maps_call_xun_functions():
+    from xun.functions.blueprint import calls_xun_functions
+
+    @xun.function()
+    def square(i):
+        return i * i
+
+    @xun.function()
+    def pooled(values):
+        return list(pool.map(abs, values))
+        with ...:
+            pool = None
+
+    @xun.function()
+    def mapped(n):
+        return list(squares)
+        with ...:
+            squares = xun.map(square, range(n))
+
+    assert not calls_xun_functions(pooled)
+    assert calls_xun_functions(mapped)
+
+
+def test_reduce():
+    @xun.function()
+    def add(a, b):
+        return a + b
+
+    @xun.function()
+    def square(i):
+        return i * i
+
+    @xun.function()
+    def sums(n):
+        return of_squares, of_calls, plus_one
+        with ...:
+            of_squares = xun.reduce(add, xun.map(square, range(n)), fan_in=3)
+            of_calls = xun.reduce(add, [square(i) for i in range(n)])
+            plus_one = add(xun.reduce(add, range(n), fan_in=2), 1)
+
+    blueprint = sums.blueprint(10)
+
+    tree = xun.functions.ReduceNode('add', range(10), fan_in=2)
+    assert [len(level) for level in tree.levels()] == [5, 3, 2, 1]
+    root = tree.root()
+    levels = tree.levels()
+
+    # Calls hold only their place in the tree, and their items at the leaves
+    assert root == CallNode('_xun_reduce_add', tree.digest, 3, 0)
+    assert levels[0][4] == CallNode('_xun_reduce_add', tree.digest, 0, 4, 8, 9)
+    assert xun.functions.ReduceNode.tree_inputs(tree.graph())[root] == (
+        levels[2][0], levels[0][4]
+    )
+    plus_one_call = next(
+        n for n in blueprint.graph.nodes
+        if n.function_name == 'add' and n.args[1] == 1
+    )
+    assert list(blueprint.graph.predecessors(plus_one_call)) == [root]
+
+    result = blueprint.run(
+        driver=xun.functions.driver.Sequential(),
+        store=xun.functions.store.Memory(),
+    )
+
+    assert result == (285, 285, 46)
+
+
+def test_reduce_keys_stay_small():
+    tree = xun.functions.ReduceNode('add', range(10000), fan_in=8)
+    graph = tree.graph()
+    assert max(len(pickle.dumps(call)) for call in graph.nodes) < 512
+    assert all(
+        len(inputs) <= 8
+        for inputs in xun.functions.ReduceNode.tree_inputs(graph).values()
+    )
+
+
+def test_reduce_function_cannot_call_xun_functions():
+    @xun.function()
+    def g(a):
+        return a
+
+    @xun.function()
+    def add(a, b):
+        return a + b + c
+        with ...:
+            c = g(0)
+
+    @xun.function()
+    def f(n):
+        return total
+        with ...:
+            total = xun.reduce(add, range(n))
+
+    with pytest.raises(XunSyntaxError):
+        f.blueprint(3)
+
+
+@xun.function()
+def fragile(i):
+    if i == 3:
+        raise ValueError('bad input {}'.format(i))
+    return i
+
+
+@xun.function()
+def total(n):
+    return sum(values)
+    with ...:
+        values = [fragile(i) for i in range(n)]
+
+
+@xun.function()
+def branches(n):
+    return first + second
+    with ...:
+        first = total(n)
+        second = total(n - 2)
+
+
+@pytest.mark.parametrize('driver', [
+    xun.functions.driver.Sequential(),
+    xun.functions.driver.Asyncio(),
+    xun.functions.driver.ProcessPool(max_workers=2),
+])
+def test_keep_going(driver, tmp_path):
+    store = xun.functions.store.Disk(tmp_path)
+    with pytest.raises(xun.functions.CallsFailedError) as exc_info:
+        branches.blueprint(5).run(driver=driver, store=store, keep_going=True)
+    if isinstance(driver, xun.functions.driver.ProcessPool):
+        driver.shutdown()
+
+    report = exc_info.value.report
+    assert set(report.failed) == {CallNode('fragile', 3)}
+    assert isinstance(report.failed[CallNode('fragile', 3)], ValueError)
+    assert 'bad input 3' in report.tracebacks[CallNode('fragile', 3)]
+    assert report.skipped == {CallNode('total', 5), CallNode('branches', 5)}
+    assert CallNode('total', 3) in report.completed
+    assert report.result(CallNode('total', 3)) == 3
+    assert report.result(CallNode('fragile', 4)) == 4
+
+
+@xun.function()
+def logged(path, i):
+    import time
+    with open(path, 'a') as f:
+        f.write('{}\n'.format(i))
+    time.sleep(0.2)
+    return i
+
+
+@xun.function()
+def logged_total(path, n):
+    return sum(values)
+    with ...:
+        values = [logged(path, i) for i in range(n)]
+
+
+@pytest.mark.parametrize('driver_cls', [
+    xun.functions.driver.Sequential,
+    xun.functions.driver.Asyncio,
+])
+def test_single_flight(driver_cls, tmp_path):
+    import concurrent.futures
+
+    log = str(tmp_path / 'log')
+    store = xun.functions.store.Disk(tmp_path / 'store')
+    blueprint = logged_total.blueprint(log, 4)
+
+    def run():
+        return blueprint.run(
+            driver=driver_cls(), store=store, single_flight=True
+        )
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        results = [executor.submit(run) for _ in range(2)]
+        assert [r.result() for r in results] == [6, 6]
+
+    with open(log) as f:
+        executed = sorted(int(line) for line in f)
+    assert executed == [0, 1, 2, 3]
+
+
+@xun.function()
+def logged_fragile(path, i):
+    with open(path, 'a') as f:
+        f.write('{}\n'.format(i))
+    if i == 1:
+        raise ValueError('bad input {}'.format(i))
+    return i
+
+
+@xun.function()
+def logged_fragile_total(path, n):
+    return sum(values)
+    with ...:
+        values = [logged_fragile(path, i) for i in range(n)]
+
+
+@pytest.mark.parametrize('driver', [
+    xun.functions.driver.Sequential(),
+    xun.functions.driver.Asyncio(),
+])
+def test_remember_failures(driver, tmp_path):
+    log = str(tmp_path / 'log')
+    store = xun.functions.store.Disk(tmp_path / 'store')
+    blueprint = logged_fragile_total.blueprint(log, 3)
+    failing = CallNode('logged_fragile', log, 1)
+
+    with pytest.raises(ValueError):
+        blueprint.run(driver=driver, store=store, remember_failures=True)
+
+    accessor = xun.functions.store.StoreAccessor(store)
+    [failure] = accessor.known_failures()
+    assert failure.call == failing
+    assert isinstance(failure.exception, ValueError)
+    assert 'bad input 1' in failure.traceback
+
+    # The failure is known, the call is not executed again
+    with pytest.raises(xun.functions.CallsFailedError) as exc_info:
+        blueprint.run(
+            driver=driver,
+            store=store,
+            keep_going=True,
+            remember_failures=True,
+        )
+    report = exc_info.value.report
+    assert isinstance(report.failed[failing], xun.functions.KnownFailureError)
+    assert 'bad input 1' in report.tracebacks[failing]
+    assert report.skipped == {blueprint.call}
+    with open(log) as f:
+        assert f.read().count('1\n') == 1
+
+    # Without remembering failures, the call is executed again
+    with pytest.raises(ValueError):
+        blueprint.run(driver=driver, store=store)
+    with open(log) as f:
+        assert f.read().count('1\n') == 2
+
+
+def test_timed_out_calls_are_not_remembered(tmp_path):
+    @xun.function(timeout=0.5)
+    def slow():
+        import time
+        time.sleep(5)
+
+    store = xun.functions.store.Disk(tmp_path)
+    with pytest.raises(xun.functions.CallTimeoutError):
+        slow.blueprint().run(
+            driver=xun.functions.driver.Sequential(),
+            store=store,
+            remember_failures=True,
+        )
+
+    accessor = xun.functions.store.StoreAccessor(store)
+    assert accessor.known_failures() == []
+
+
+def early_cutoff_blueprint(version, log):
+    if version == 'first':
+        @xun.function()
+        def upstream(n):
+            return n + 1
+    elif version == 'refactored':
+        @xun.function()
+        def upstream(n):
+            return 1 + n
+    else:
+        @xun.function()
+        def upstream(n):
+            return n + 2
+
+    @xun.function()
+    def downstream(path, n):
+        with open(path, 'a') as f:
+            f.write('{}\n'.format(n))
+        return value * 2
+        with ...:
+            value = upstream(n)
+
+    return downstream.blueprint(log, 3)
+
+
+@pytest.mark.parametrize('driver', [
+    xun.functions.driver.Sequential(),
+    xun.functions.driver.Asyncio(),
+])
+def test_early_cutoff(driver, tmp_path):
+    log = str(tmp_path / 'log')
+    store = xun.functions.store.Disk(tmp_path / 'store')
+
+    def run(version):
+        blueprint = early_cutoff_blueprint(version, log)
+        return blueprint.run(driver=driver, store=store, early_cutoff=True)
+
+    def executions():
+        with open(log) as f:
+            return len(f.readlines())
+
+    assert run('first') == 8
+    assert executions() == 1
+
+    # The result of upstream is unchanged, downstream is not executed
+    assert run('refactored') == 8
+    assert executions() == 1
+
+    assert run('changed') == 10
+    assert executions() == 2
+
+
+@xun.function()
+def checksum(values):
+    return sum(values)
+
+
+@xun.function()
+def checksums(n):
+    return first + second
+    with ...:
+        values = tuple(range(n))
+        first = checksum(values)
+        second = checksum(values[1:])
+
+
+def test_interned_arguments(tmp_path):
+    store = xun.functions.store.Disk(tmp_path)
+    driver = xun.functions.driver.ProcessPool(max_workers=2)
+    result = checksums.blueprint(10000).run(driver=driver, store=store)
+    driver.shutdown()
+    assert result == 2 * sum(range(10000))
+
+    # The arguments are stored once, the calls refer to them
+    assert len(store / 'arguments') == 2
+    calls = [
+        call for call in checksums.blueprint(10000).graph.nodes
+        if call.function_name == 'checksum'
+    ]
+    assert len(calls) == 2
+    assert all(
+        isinstance(call.args[0], xun.functions.InternedArgument)
+        for call in calls
+    )
+
+
+@xun.function()
+def logged_split(path, n):
+    with open(path, 'a') as f:
+        f.write('split\n')
+    return tuple(range(n)), ('head', 'tail')
+
+
+@xun.function()
+def measure(values):
+    return len(values)
+
+
+@xun.function()
+def split_sizes(path, n):
+    return size, head, tail
+    with ...:
+        values, (head_value, tail_value) = logged_split(path, n)
+        size = measure(values)
+        head = measure(head_value)
+        tail = measure(tail_value)
+
+
+def test_store_elements(tmp_path, loaded_results):
+    from .helpers import PicklableMemoryStore
+
+    log = str(tmp_path / 'log')
+    blueprint = split_sizes.blueprint(log, 1000)
+    with PicklableMemoryStore() as store:
+        result = blueprint.run(
+            driver=xun.functions.driver.Sequential(),
+            store=store,
+            store_elements=True,
+        )
+        assert result == (1000, 4, 4)
+
+        # The call is executed once, and its result is never loaded, the
+        # calls depending on its elements load only the elements
+        with open(log) as f:
+            assert len(f.readlines()) == 1
+        assert CallNode('logged_split', log, 1000) not in loaded_results
+        element = CallNode('logged_split', log, 1000)[1][0]
+        assert len(store / 'elements' / element) == 1
+
+
+def test_lazy_results(loaded_results):
+    from .helpers import PicklableMemoryStore
+
+    @xun.function()
+    def square(i):
+        return i * i
+
+    @xun.function(lazy=True)
+    def squares_until(n, limit):
+        result = []
+        for value in squares:
+            if value > limit:
+                break
+            result.append(value)
+        return result, len(squares), squares[-1]
+        with ...:
+            squares = [square(i) for i in range(n)]
+
+    with PicklableMemoryStore() as store:
+        blueprint = squares_until.blueprint(1000, 10)
+        result = blueprint.run(
+            driver=xun.functions.driver.Sequential(),
+            store=store,
+        )
+        assert result == ([0, 1, 4, 9], 1000, 998001)
+
+        # Only the results that were accessed, and those read ahead, are
+        # loaded
+        loaded_squares = [
+            call for call in loaded_results if call.function_name == 'square'
+        ]
+        assert CallNode('square', 999) in loaded_squares
+        assert len(loaded_squares) <= 5 + xun.functions.LazyResults.read_ahead
@@ -2,6 +2,8 @@ from xun.functions import CallNode
 from xun.functions import cli
 from xun import XunSyntaxError
 import pytest
+import xun
+import xun.cli
 
 
 def test_interpret_call():
@@ -36,3 +38,23 @@ def test_syntax_errors():
 
     with pytest.raises(XunSyntaxError):
         cli.interpret_call('(1 + 1)()')
+
+
+def test_failures_list_and_clear(tmp_path, capsys):
+    store = xun.functions.store.Disk(tmp_path)
+    accessor = xun.functions.store.StoreAccessor(store)
+    for i in range(2):
+        accessor.record_failure(
+            CallNode('f', i), b'hash', ValueError(i), 'Traceback', 1.0
+        )
+
+    xun.cli.main(['failures', 'list', '--disk', str(tmp_path)])
+    listed = capsys.readouterr().out.splitlines()
+    assert len(listed) == 2
+    assert 'ValueError(0)' in listed[0]
+
+    xun.cli.main(['failures', 'clear', '--disk', str(tmp_path), 'f(0)'])
+    assert [f.call for f in accessor.known_failures()] == [CallNode('f', 1)]
+
+    xun.cli.main(['failures', 'clear', '--disk', str(tmp_path)])
+    assert accessor.known_failures() == []
@@ -0,0 +1,234 @@
+from xun.functions import CallNode
+from xun.functions.fusion import FusedCalls
+from xun.functions.fusion import batch_calls
+from xun.functions.fusion import fuse_chains
+from xun.functions.fusion import task_options
+import pytest
+import time
+import xun
+
+
+@xun.function()
+def start(i):
+    return i
+
+
+@xun.function()
+def step(n):
+    return value + 1
+    with ...:
+        value = start(0) if n == 0 else step(n - 1)
+
+
+@xun.function()
+def total(n):
+    return a + b
+    with ...:
+        a = step(n)
+        b = start(1)
+
+
+def test_fuse_chains():
+    blueprint = total.blueprint(3)
+    graph, function_images = fuse_chains(
+        blueprint.graph,
+        {name: f.callable() for name, f in blueprint.functions.items()},
+        xun.functions.store.Memory(),
+    )
+
+    chain = (
+        CallNode('start', 0),
+        CallNode('step', 0),
+        CallNode('step', 1),
+        CallNode('step', 2),
+        CallNode('step', 3),
+    )
+    fused = CallNode(FusedCalls.name, chain)
+    assert set(graph.nodes) == {fused, CallNode('start', 1), blueprint.call}
+    assert set(graph.edges) == {
+        (fused, blueprint.call),
+        (CallNode('start', 1), blueprint.call),
+    }
+    assert isinstance(function_images[FusedCalls.name], FusedCalls)
+
+
+@pytest.mark.parametrize('driver_class', [
+    xun.functions.driver.Sequential,
+    xun.functions.driver.Asyncio,
+    xun.functions.driver.ProcessPool,
+])
+def test_fused_chains_store_every_result(driver_class, tmp_path):
+    driver = driver_class()
+    store = xun.functions.store.Disk(tmp_path)
+
+    try:
+        result = total.blueprint(3).run(driver=driver, store=store, fuse=True)
+    finally:
+        if isinstance(driver, xun.functions.driver.ProcessPool):
+            driver.shutdown()
+
+    assert result == 5
+    store_accessor = xun.functions.store.StoreAccessor(store)
+    assert [store_accessor.load_result(CallNode('step', n)) for n in range(4)
+        ] == [1, 2, 3, 4]
+
+    # The fused chain stores no result of its own
+    chain = (CallNode('start', 0), *(CallNode('step', n) for n in range(4)))
+    assert len(store / 'results' / CallNode(FusedCalls.name, chain)) == 0
+
+
+@xun.function(batch_size=4)
+def square(i):
+    return i * i
+
+
+@xun.function()
+def sum_of_squares(n):
+    return sum(squares)
+    with ...:
+        squares = [square(i) for i in range(n)]
+
+
+def test_batch_calls(tmp_path):
+    blueprint = sum_of_squares.blueprint(10)
+    graph, function_images = batch_calls(
+        blueprint.graph,
+        {name: f.callable() for name, f in blueprint.functions.items()},
+        xun.functions.store.Memory(),
+    )
+
+    batches = [
+        node.args[0] for node in graph.nodes
+        if node.function_name == '_xun_batched_square'
+    ]
+    assert sorted(len(batch) for batch in batches) == [2, 4, 4]
+    assert graph.in_degree(blueprint.call) == 3
+
+    store = xun.functions.store.Disk(tmp_path)
+    with xun.functions.driver.ProcessPool(max_workers=2) as driver:
+        result = blueprint.run(driver=driver, store=store)
+
+    assert result == sum(i * i for i in range(10))
+    store_accessor = xun.functions.store.StoreAccessor(store)
+    assert store_accessor.load_result(CallNode('square', 3)) == 9
+
+
+@xun.function()
+def load(i):
+    return i
+
+
+@xun.function(batch_size=4)
+def process(i):
+    return i + 1
+
+
+@xun.function()
+def fan_out(n):
+    return sum(processed)
+    with ...:
+        processed = [process(load(i)) for i in range(n)]
+
+
+def test_batch_calls_of_a_fan_out():
+    blueprint = fan_out.blueprint(5)
+    graph, _ = batch_calls(
+        blueprint.graph,
+        {name: f.callable() for name, f in blueprint.functions.items()},
+        xun.functions.store.Memory(),
+    )
+
+    # The calls are ready together, though they have different predecessors
+    batches = [
+        node.args[0] for node in graph.nodes
+        if node.function_name == '_xun_batched_process'
+    ]
+    assert [len(batch) for batch in batches] == [4]
+    assert all(graph.in_degree(node) == 4 for node in graph.nodes
+        if node.function_name == '_xun_batched_process')
+
+    # The call left alone is not batched
+    unbatched = [
+        node for node in graph.nodes if node.function_name == 'process'
+    ]
+    assert len(unbatched) == 1
+    assert unbatched[0] not in batches[0]
+
+    result = blueprint.run(
+        driver=xun.functions.driver.Sequential(),
+        store=xun.functions.store.Memory(),
+    )
+    assert result == sum(i + 1 for i in range(5))
+
+
+@xun.function(batch_size=4, rate_limit=20)
+def stamp(i):
+    return time.monotonic()
+
+
+@xun.function()
+def stamps(n):
+    return times
+    with ...:
+        times = [stamp(i) for i in range(n)]
+
+
+def test_batches_space_rate_limited_calls():
+    result = stamps.blueprint(4).run(
+        driver=xun.functions.driver.Sequential(),
+        store=xun.functions.store.Memory(),
+    )
+
+    # The calls of the batch are spaced at the rate limit, not run in a burst
+    gaps = [b - a for a, b in zip(sorted(result), sorted(result)[1:])]
+    assert len(gaps) == 3
+    assert min(gaps) > 0.04
+
+    # The tasks are given the time waited between calls
+    assert task_options({'rate_limit': 20, 'timeout': 1}, 4) == {
+        'rate_limit': 5, 'timeout': pytest.approx(4.15)
+    }
+
+
+def test_batches_carry_only_the_elements_of_their_calls():
+    blueprint = sum_of_squares.blueprint(10)
+    function_images = {
+        name: f.callable() for name, f in blueprint.functions.items()
+    }
+    elements = {
+        CallNode('square', 1): {(0,)},
+        CallNode('square', 9): {(1,)},
+        blueprint.call: {(2,)},
+    }
+    store = xun.functions.store.Memory()
+    graph, batched_images = batch_calls(
+        blueprint.graph, function_images, store, elements=elements
+    )
+    image = batched_images['_xun_batched_square']
+    assert image.store_accessor.elements == {
+        CallNode('square', 1): {(0,)},
+        CallNode('square', 9): {(1,)},
+    }
+
+    # The hash covers the elements, but not the calls of each task
+    _, unseparated = batch_calls(blueprint.graph, function_images, store)
+    assert image.hash != unseparated['_xun_batched_square'].hash
+
+    batch = next(
+        node for node in graph.nodes
+        if node.function_name == '_xun_batched_square'
+        and CallNode('square', 1) in node.args[0]
+    )
+    task_image = image.for_call(batch)
+    assert task_image.hash == image.hash
+    assert task_image.store_accessor.elements == {
+        CallNode('square', 1): {(0,)},
+    }
+
+    store_accessor = xun.functions.store.StoreAccessor(
+        store, elements=elements
+    )
+    assert store_accessor.for_call(batch).elements == {
+        CallNode('square', 1): {(0,)},
+    }
+    assert store_accessor.for_call(CallNode('square', 0)).elements == {}
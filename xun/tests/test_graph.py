@@ -1,4 +1,6 @@
 from xun.functions.graph import CallNode
+from xun.functions.graph import InternedArgument
+import pickle
 
 
 def test_unpack():
@@ -107,3 +109,33 @@ def test_unpack_starred():
         cn[2],
     )
     assert a == expected
+
+
+def test_large_arguments_are_interned():
+    large = tuple(range(10000))
+    call = CallNode('f', large, key=large)
+
+    [arg] = call.args
+    assert isinstance(arg, InternedArgument)
+    assert arg is call.kwargs['key']
+    assert arg.value is large
+
+    # Interned by content
+    assert CallNode('f', tuple(range(10000)), key=large) == call
+    assert CallNode('f', tuple(range(1, 10001)), key=large) != call
+    assert CallNode('f', 1) == CallNode('f', 1)
+
+    pickled = pickle.dumps(call)
+    assert len(pickled) < 1000
+    unpickled = pickle.loads(pickled)
+    assert unpickled == call
+    assert not unpickled.args[0].kept
+
+    # Calls to internal functions keep their arguments
+    assert CallNode('_xun_fused', large).args == (large,)
+
+    # Arguments are measured by their content, not only their container
+    strings = ('a' * 100000, 'b' * 100000)
+    [arg] = CallNode('f', strings).args
+    assert isinstance(arg, InternedArgument)
+    assert CallNode('f', ('a', 'b')).args == (('a', 'b'),)
@@ -0,0 +1,163 @@
+from xun.functions.limits import Limits
+from xun.functions.limits import Resources
+from xun.functions.limits import Stragglers
+from xun.functions.limits import TokenBucket
+from xun.functions.limits import parse_memory
+from xun.functions.limits import parse_rate
+from xun.functions.limits import time_limit
+import pytest
+import time
+import xun
+
+
+def test_parse_rate():
+    assert parse_rate(4) == 4.0
+    assert parse_rate('10/s') == 10.0
+    assert parse_rate('30/m') == 0.5
+    assert parse_rate('7200/h') == 2.0
+    with pytest.raises(ValueError):
+        parse_rate('10/d')
+    with pytest.raises(ValueError):
+        parse_rate(0)
+
+
+def test_token_bucket():
+    now = [0.0]
+    bucket = TokenBucket(2.0, capacity=2, clock=lambda: now[0])
+
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == 0.0
+    assert bucket.delay() == 0.5
+    assert bucket.reserve() == 0.5
+    assert bucket.reserve() == 1.0
+
+    now[0] = 10.0
+    assert bucket.delay() == 0.0
+
+
+def test_limits():
+    @xun.function(max_parallel=2, rate_limit='1/s')
+    def limited():
+        pass
+
+    @xun.function()
+    def free():
+        pass
+
+    now = [0.0]
+    limits = Limits(
+        {'limited': limited.callable(), 'free': free.callable()},
+        clock=lambda: now[0],
+    )
+
+    assert limits.acquire('limited')
+    limits.start('limited')
+    assert limits.delay('limited') == 1.0
+    assert limits.acquire('limited')
+    assert not limits.acquire('limited')
+    limits.release('limited')
+    assert limits.acquire('limited')
+
+    assert all(limits.acquire('free') for _ in range(10))
+    assert limits.delay('free') == 0.0
+
+
+def test_limits_are_validated():
+    def f():
+        pass
+
+    with pytest.raises(ValueError):
+        xun.function(max_parallel=0)(f)
+    with pytest.raises(ValueError):
+        xun.function(rate_limit='fast')(f)
+    assert xun.function(max_parallel=3, rate_limit='6/m')(f).options == {
+        'max_parallel': 3,
+        'rate_limit': 0.1,
+    }
+
+
+def test_parse_memory():
+    assert parse_memory(1024) == 1024
+    assert parse_memory('1.5K') == 1536
+    assert parse_memory('512M') == 512 * 2**20
+    assert parse_memory('2GiB') == parse_memory('2gb') == 2 * 2**30
+    with pytest.raises(ValueError):
+        parse_memory('lots')
+    with pytest.raises(ValueError):
+        parse_memory(0)
+
+
+def test_resources():
+    @xun.function(memory='3G', cpus=2)
+    def heavy():
+        pass
+
+    @xun.function()
+    def light():
+        pass
+
+    resources = Resources(
+        {'heavy': heavy.callable(), 'light': light.callable()},
+        memory=4 * 2**30,
+        cpus=3,
+        learned={'light': 2**30},
+    )
+
+    taken = resources.take('heavy')
+    assert resources.fits('light')
+    assert not resources.fits('heavy')
+    resources.take('light')
+    assert not resources.fits('light')
+
+    resources.free(taken)
+    resources.learn('light', 2 * 2**30)
+    assert resources.demand('light') == (2 * 2**30, 1)
+    assert resources.fits('heavy')
+    resources.take('light')
+    assert not resources.fits('heavy')
+
+
+def test_time_limit():
+    with pytest.raises(xun.functions.CallTimeoutError):
+        with time_limit(0.05):
+            time.sleep(1)
+
+    @xun.function(timeout=0.05)
+    def hang():
+        import time
+        time.sleep(1)
+
+    with pytest.raises(xun.functions.CallTimeoutError):
+        hang.blueprint().run(
+            driver=xun.functions.driver.Sequential(),
+            store=xun.functions.store.Memory(),
+        )
+
+
+def test_stragglers():
+    @xun.function()
+    def f():
+        pass
+
+    @xun.function(max_parallel=1)
+    def limited():
+        pass
+
+    stragglers = Stragglers(
+        {'f': f.callable(), 'limited': limited.callable()},
+        factor=3,
+        recorded={'f': [1.0, 2.0]},
+        min_runtime=0.5,
+    )
+
+    assert stragglers.threshold('f') is None
+    stragglers.record('f', 4.0)
+    assert stragglers.threshold('f') == 6.0
+    stragglers.record('f', 0.1)
+    stragglers.record('f', 0.1)
+    assert stragglers.threshold('f') == 3.0
+    assert stragglers.new_runtimes == {'f': [4.0, 0.1, 0.1]}
+
+    for _ in range(3):
+        stragglers.record('limited', 1.0)
+    assert stragglers.threshold('limited') is None
@@ -0,0 +1,159 @@
+from .helpers import sample_sin_blueprint
+from xun.functions.driver import process_pool
+import logging
+import pytest
+import sys
+import time
+import xun
+
+
+def test_process_pool_driver(tmp_path):
+    blueprint, expected = sample_sin_blueprint()
+    store = xun.functions.store.Disk(tmp_path)
+
+    with xun.functions.driver.ProcessPool(max_workers=2) as driver:
+        result = blueprint.run(driver=driver, store=store)
+
+    assert result == expected
+
+
+def test_process_pool_driver_reuses_workers(tmp_path, caplog):
+    first, first_expected = sample_sin_blueprint(offset=1)
+    second, second_expected = sample_sin_blueprint(offset=2, step_size=18)
+    store = xun.functions.store.Disk(tmp_path)
+
+    def sent_images():
+        return [
+            r for r in caplog.records
+            if r.getMessage().startswith('Sending function image')
+        ]
+
+    caplog.set_level(logging.DEBUG, logger=process_pool.__name__)
+    with xun.functions.driver.ProcessPool(max_workers=1) as driver:
+        result = first.run(driver=driver, store=store)
+        executor = driver.executor
+        assert result == first_expected
+        assert len(sent_images()) > 0
+
+        caplog.clear()
+        result = second.run(driver=driver, store=store)
+        assert driver.executor is executor
+        assert result == second_expected
+        # The worker kept the function images of the first run
+        assert sent_images() == []
+
+
+def test_process_pool_driver_failure(tmp_path):
+    @xun.function()
+    def fail():
+        raise ValueError('fail')
+
+    @xun.function()
+    def workflow():
+        return value
+        with ...:
+            value = fail()
+
+    with xun.functions.driver.ProcessPool(max_workers=2) as driver:
+        with pytest.raises(ValueError):
+            workflow.blueprint().run(
+                driver=driver,
+                store=xun.functions.store.Disk(tmp_path),
+            )
+
+
+def test_process_pool_driver_packs_memory(tmp_path):
+    @xun.function(memory='600M')
+    def heavy(i):
+        import time
+        start = time.time()
+        time.sleep(0.05)
+        return start, time.time()
+
+    @xun.function()
+    def schedule(n):
+        return intervals
+        with ...:
+            intervals = [heavy(i) for i in range(n)]
+
+    driver = xun.functions.driver.ProcessPool(max_workers=4, memory='1G')
+    with driver:
+        intervals = schedule.blueprint(4).run(
+            driver=driver,
+            store=xun.functions.store.Disk(tmp_path),
+        )
+
+    intervals = sorted(intervals)
+    assert all(
+        end <= start for (_, end), (start, _) in zip(intervals, intervals[1:])
+    )
+
+
+def test_process_pool_driver_learns_peak_memory(tmp_path):
+    @xun.function()
+    def allocate():
+        return len(bytearray(64 * 2**20))
+
+    store = xun.functions.store.Disk(tmp_path)
+    driver = xun.functions.driver.ProcessPool(
+        max_workers=1, learn_resources=True
+    )
+    with driver:
+        allocate.blueprint().run(driver=driver, store=store)
+
+    peak = xun.functions.store.StoreAccessor(store).peak_memory('allocate')
+    if sys.platform.startswith('linux'):
+        assert peak > 64 * 2**20
+    else:
+        assert peak is None
+
+
+def test_process_pool_driver_backs_up_stragglers(tmp_path):
+    @xun.function(timeout=3)
+    def sometimes_slow(i, marker):
+        import pathlib
+        import time
+        if i == 0 and not pathlib.Path(marker).exists():
+            pathlib.Path(marker).touch()
+            time.sleep(10)
+        return i
+
+    @xun.function()
+    def gather(n, marker):
+        return sum(values)
+        with ...:
+            values = [sometimes_slow(i, marker) for i in range(n)]
+
+    marker = str(tmp_path / 'marker')
+    store = xun.functions.store.Disk(tmp_path / 'store')
+    with xun.functions.driver.ProcessPool(max_workers=2, speculate=3) as driver:
+        start = time.time()
+        result = gather.blueprint(8, marker).run(driver=driver, store=store)
+        elapsed = time.time() - start
+
+    assert result == sum(range(8))
+    assert elapsed < 3
+    runtimes = xun.functions.store.StoreAccessor(store).runtimes(
+        'sometimes_slow'
+    )
+    assert len(runtimes) == 8
+
+
+def test_process_pool_driver_maps_and_batches_function(tmp_path):
+    @xun.function(batch_size=2)
+    def square(i):
+        return i * i
+
+    @xun.function()
+    def mapped_and_listed(n):
+        return sum(mapped) + sum(listed)
+        with ...:
+            mapped = xun.map(square, range(n))
+            listed = [square(i) for i in range(n, 2 * n)]
+
+    # A single worker runs both the map chunks and the batches of the function
+    store = xun.functions.store.Disk(tmp_path)
+    with xun.functions.driver.ProcessPool(max_workers=1) as driver:
+        result = mapped_and_listed.blueprint(4).run(driver=driver, store=store)
+
+    assert result == sum(i * i for i in range(8))
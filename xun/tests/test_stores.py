@@ -7,10 +7,12 @@ from xun.functions.store import NamespacedKey
 import contextlib
 import copy
 import mockssh
+import os
 import paramiko
 import pickle
 import pytest
 import tempfile
+import time
 import xun
 
 
@@ -277,6 +279,67 @@ def test_store_mutable_mapping(cls):
         assert dict(store.items()) == {}
 
 
+@pytest.mark.parametrize('cls', stores)
+def test_store_leases(cls):
+    with cls() as store:
+        assert store.acquire_lease('a', 'owner', ttl=30)
+        assert not store.acquire_lease('a', 'other', ttl=30)
+        assert store.acquire_lease('b', 'other', ttl=30)
+
+        # Leases are not values of the store
+        assert 'a' not in store
+        assert len(store) == len(list(store.keys()))
+
+        # Only the owner renews and releases a lease
+        assert store.renew_lease('a', 'owner', ttl=30)
+        assert not store.renew_lease('a', 'other', ttl=30)
+        store.release_lease('a', 'other')
+        assert not store.acquire_lease('a', 'other', ttl=30)
+        store.release_lease('a', 'owner')
+        assert store.acquire_lease('a', 'other', ttl=30)
+
+        # Expired leases are taken over
+        assert store.acquire_lease('c', 'owner', ttl=0.1)
+        time.sleep(0.2)
+        assert store.acquire_lease('c', 'other', ttl=30)
+        assert not store.renew_lease('c', 'owner', ttl=30)
+
+
+def test_disk_store_breaks_unwritten_leases():
+    with TmpDisk() as store:
+        assert store.acquire_lease('a', 'owner', ttl=30)
+        lock_file, = (store.dir / 'leases').iterdir()
+
+        # The owner died before writing the lock file
+        lock_file.write_bytes(b'')
+        assert not store.acquire_lease('a', 'other', ttl=30)
+
+        # Unwritten lock files expire a time to live after they were created
+        old = time.time() - 60
+        os.utime(str(lock_file), (old, old))
+        assert store.acquire_lease('a', 'other', ttl=30)
+        assert store.renew_lease('a', 'other', ttl=30)
+
+
+def test_store_accessor_claims_calls_once():
+    call = xun.functions.CallNode('f', 1)
+    with TmpDisk() as store:
+        accessor = xun.functions.store.StoreAccessor(store, lease_ttl=30)
+        other = xun.functions.store.StoreAccessor(
+            xun.functions.store.Disk(store.dir), lease_ttl=30
+        )
+
+        with accessor.claim(call, 'hash') as claimed:
+            assert claimed
+            lease = other.lease(call, 'hash')
+            assert not lease.acquire()
+            accessor.store_result(call, 'hash', 'result')
+
+        # The call was completed while waiting
+        with other.claim(call, 'hash') as claimed:
+            assert not claimed
+
+
 def test_memory_store_not_picklable():
     store = xun.functions.store.Memory()
 
@@ -296,3 +359,34 @@ def test_sftp_driver_is_complatible_with_disk_driver():
         assert disk // 'a' == 0
         assert disk // 'b' == 1
         assert disk // 'c' == 2
+
+
+def test_result_cache_evicts_least_recently_used():
+    cache = xun.functions.store.ResultCache(
+        max_bytes=2 * len(pickle.dumps('value'))
+    )
+
+    cache.put('a', pickle.dumps('value'))
+    cache.put('b', pickle.dumps('value'))
+    assert cache.load('a', load=mock.Mock()) == 'value'
+    cache.put('c', pickle.dumps('value'))
+
+    load = mock.Mock(return_value='value')
+    assert cache.load('b', load=load) == 'value'
+    load.assert_called_once()
+
+    added, evicted = cache.changes()
+    assert list(added) == ['c', 'b']
+    assert evicted == {'a'}
+    assert cache.counts == {
+        'hits': 1, 'misses': 1, 'bytes_saved': len(pickle.dumps('value'))
+    }
+
+
+def test_result_cache_returns_copies():
+    cache = xun.functions.store.ResultCache(max_bytes=2**20)
+    cache.put('a', pickle.dumps([1, 2]))
+
+    # A call mutating its argument does not change what later calls load
+    cache.load('a', load=mock.Mock()).append(3)
+    assert cache.load('a', load=mock.Mock()) == [1, 2]